@@ -19,7 +19,7 @@ def main():
 
     ual = ualserver.UALRemote(sys.argv[1])
     ual.iomap_vme(4, 0x39, 0x1000, 0x700000, 1)
-    leds = cheby.ual.create_ual_access(ual, 'leds.cheby')
+    leds = cheby.ual.create_compiled_access(ual, 'leds.cheby')
 
     run(leds)
 
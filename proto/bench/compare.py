@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+"""Compare two results of the scaling benchmark (see scaling.py).
+
+For each scenario and each step, the median of the times of the new
+results is compared with the one of the base results.  A step regresses
+if it is slower by more than --time-threshold percent and if the
+difference is larger than the noise: --noise times the spread (the
+median absolute deviation) of the runs.  Steps faster than --min-ms are
+ignored.  The peak memory regresses if it is larger by more than
+--memory-threshold percent.  A scenario or a step of the base results
+that is missing in the new results (like a crashed or dropped benchmark)
+is a regression too.
+
+The exit status is 1 if there is a regression, so that it can be used as
+a gate."""
+import argparse
+import json
+import statistics
+import sys
+
+
+def spread(values):
+    """Return the median absolute deviation of VALUES"""
+    med = statistics.median(values)
+    return statistics.median([abs(v - med) for v in values])
+
+
+def compare_step(base, new, args):
+    """Return (message, regressed) for the step, or None if it is not
+    reported"""
+    res = []
+    regressed = False
+    bmed = statistics.median(base['wall'])
+    nmed = statistics.median(new['wall'])
+    noise = args.noise * max(spread(base['wall']), spread(new['wall']))
+    change = (nmed - bmed) / bmed * 100 if bmed else 0.
+    if max(bmed, nmed) * 1e3 >= args.min_ms:
+        if change > args.time_threshold and nmed - bmed > noise:
+            res.append('time +{:.1f}%'.format(change))
+            regressed = True
+        elif change < -args.time_threshold and bmed - nmed > noise:
+            res.append('time {:.1f}%'.format(change))
+    if base.get('peak') and new.get('peak'):
+        mchange = (new['peak'] - base['peak']) / base['peak'] * 100
+        if mchange > args.memory_threshold:
+            res.append('memory +{:.1f}%'.format(mchange))
+            regressed = True
+        elif mchange < -args.memory_threshold:
+            res.append('memory {:.1f}%'.format(mchange))
+    msg = '{:9.1f} ms -> {:9.1f} ms  (+/- {:.1f} ms)  {}'.format(
+        bmed * 1e3, nmed * 1e3, noise * 1e3, ', '.join(res) or 'ok')
+    return msg, regressed
+
+
+def compare(base, new, args, fd):
+    """Compare results BASE and NEW, report to FD.  Return the number of
+    regressions"""
+    nbr = 0
+    for scen, bres in base['scenarios'].items():
+        nres = new['scenarios'].get(scen)
+        if nres is None:
+            fd.write('{}: missing in the new results  REGRESSION\n'.format(scen))
+            nbr += 1
+            continue
+        if nres['params'] != bres['params']:
+            fd.write('{}: parameters differ, not compared\n'.format(scen))
+            continue
+        fd.write('{}\n'.format(scen))
+        for step, bstep in bres['steps'].items():
+            nstep = nres['steps'].get(step)
+            if nstep is None:
+                fd.write('  {:<28} missing in the new results  REGRESSION\n'.format(step))
+                nbr += 1
+                continue
+            msg, regressed = compare_step(bstep, nstep, args)
+            if regressed:
+                nbr += 1
+            if regressed or args.verbose or not msg.endswith('ok'):
+                fd.write('  {:<28} {}{}\n'.format(step, msg, '  REGRESSION' if regressed else ''))
+    return nbr
+
+
+def main():
+    aparser = argparse.ArgumentParser(description='compare cheby benchmark results')
+    aparser.add_argument('base', help='results of reference (json)')
+    aparser.add_argument('new', help='new results (json)')
+    aparser.add_argument('--time-threshold', type=float, default=10.,
+                         help='time regression threshold, in percent (default: 10)')
+    aparser.add_argument('--memory-threshold', type=float, default=10.,
+                         help='peak memory regression threshold, in percent (default: 10)')
+    aparser.add_argument('--noise', type=float, default=3.,
+                         help='a time difference must be larger than NOISE times the spread '
+                         'of the runs (default: 3)')
+    aparser.add_argument('--min-ms', type=float, default=1.,
+                         help='ignore the times of the steps faster than this (default: 1)')
+    aparser.add_argument('-v', '--verbose', action='store_true',
+                         help='also report the steps without changes')
+    args = aparser.parse_args()
+
+    res = []
+    for filename in [args.base, args.new]:
+        try:
+            with open(filename) as f:
+                res.append(json.load(f))
+        except (OSError, ValueError) as e:
+            sys.stderr.write('error: cannot read {}: {}\n'.format(filename, e))
+            sys.exit(2)
+    base, new = res
+    print('base: {} ({})  new: {} ({})'.format(
+        base.get('commit'), base.get('date'), new.get('commit'), new.get('date')))
+    nbr = compare(base, new, args, sys.stdout)
+    if nbr:
+        print('{} regression(s)'.format(nbr))
+        sys.exit(1)
+    print('no regression')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+"""Generator of synthetic cheby maps, for the benchmarks.
+
+The map is parametrized by:
+  regs      number of registers in each level of blocks
+  fields    number of fields per register (1 to 32)
+  depth     number of levels of nested blocks below the root
+  repeat    count of a repeat of 4 registers (0 for no repeat)
+  submaps   number of submaps (each one in its own file, generated with
+            the same parameters but without submaps).  They are
+            alternatively included and not included.
+  memories  number of memories (of 256 words)
+
+The total number of registers (without the submaps) is
+regs * (depth + 1) + 4 * repeat + memories."""
+import argparse
+import os
+
+DEFAULTS = {'regs': 100, 'fields': 4, 'depth': 0, 'repeat': 0,
+            'submaps': 0, 'memories': 0}
+
+
+def gen_reg(lines, indent, name, fields, access='rw'):
+    pad = ' ' * indent
+    lines.append(pad + '- reg:')
+    lines.append(pad + '    name: {}'.format(name))
+    lines.append(pad + '    width: 32')
+    lines.append(pad + '    access: {}'.format(access))
+    if fields <= 1:
+        return
+    lines.append(pad + '    children:')
+    width = 32 // fields
+    for i in range(fields):
+        lines.append(pad + '      - field:')
+        lines.append(pad + '          name: f{}'.format(i))
+        lo = i * width
+        if width == 1:
+            lines.append(pad + '          range: {}'.format(lo))
+        else:
+            lines.append(pad + '          range: {}-{}'.format(lo + width - 1, lo))
+        if access == 'rw':
+            lines.append(pad + '          preset: {}'.format(i % (1 << min(width, 16))))
+
+
+def gen_level(lines, indent, level, p):
+    pad = ' ' * indent
+    for i in range(p['regs']):
+        gen_reg(lines, indent, 'r{}'.format(i), p['fields'], 'rw' if i % 2 == 0 else 'ro')
+    if level < p['depth']:
+        lines.append(pad + '- block:')
+        lines.append(pad + '    name: b{}'.format(level))
+        lines.append(pad + '    children:')
+        gen_level(lines, indent + 6, level + 1, p)
+
+
+def gen_text(name, p, submaps=()):
+    """Return the text of map NAME with parameters P, and SUBMAPS (a list
+    of filenames)"""
+    lines = ['memory-map:',
+             '  bus: wb-32-be',
+             '  name: {}'.format(name),
+             '  children:']
+    gen_level(lines, 4, 0, p)
+    if p['repeat']:
+        lines.append('    - repeat:')
+        lines.append('        name: rep')
+        lines.append('        count: {}'.format(p['repeat']))
+        lines.append('        children:')
+        for i in range(4):
+            gen_reg(lines, 10, 'rr{}'.format(i), p['fields'])
+    for i in range(p['memories']):
+        lines.append('    - memory:')
+        lines.append('        name: mem{}'.format(i))
+        lines.append('        memsize: {}'.format(256 * 4))
+        lines.append('        children:')
+        gen_reg(lines, 10, 'value', 1)
+    for i, f in enumerate(submaps):
+        lines.append('    - submap:')
+        lines.append('        name: sub{}'.format(i))
+        lines.append('        filename: {}'.format(f))
+        lines.append('        include: {}'.format(i % 2 == 0))
+    return '\n'.join(lines) + '\n'
+
+
+def gen_map(dirname, name='bench', **params):
+    """Write the map NAME (and its submaps) in directory DIRNAME, using
+    PARAMS (see DEFAULTS).  Return the filename of the map"""
+    p = dict(DEFAULTS)
+    for k, v in params.items():
+        if k not in p:
+            raise ValueError('unknown parameter {}'.format(k))
+        p[k] = v
+    os.makedirs(dirname, exist_ok=True)
+    subs = []
+    for i in range(p['submaps']):
+        sub = '{}_sub{}.cheby'.format(name, i)
+        sp = dict(p, submaps=0)
+        with open(os.path.join(dirname, sub), 'w') as f:
+            f.write(gen_text('{}_sub{}'.format(name, i), sp))
+        subs.append(sub)
+    filename = os.path.join(dirname, name + '.cheby')
+    with open(filename, 'w') as f:
+        f.write(gen_text(name, p, subs))
+    return filename
+
+
+def main():
+    aparser = argparse.ArgumentParser(description='generate a synthetic cheby map')
+    for k, v in DEFAULTS.items():
+        aparser.add_argument('--' + k, type=int, default=v)
+    aparser.add_argument('--name', default='bench', help='name of the map')
+    aparser.add_argument('dir', help='output directory')
+    args = aparser.parse_args()
+    params = {k: getattr(args, k) for k in DEFAULTS}
+    print(gen_map(args.dir, args.name, **params))
+
+
+if __name__ == '__main__':
+    main()
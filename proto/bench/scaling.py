@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+"""Scaling benchmark of the cheby passes and generators.
+
+For each scenario, a synthetic map is generated (see genmap.py) and the
+passes (parse, layout, expand...) and the generators (C, consts, docs,
+HDL generation and printing) are run in this process, several times.  The
+wall and CPU times of each step are recorded for each run, and the peak
+of the traced memory for an additional run (tracing slows down the run).
+
+The results can be written in JSON, to be compared between commits with
+compare.py."""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import genmap
+
+protodir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, protodir)
+
+import cheby                                    # noqa: E402
+import cheby.parser as parser                   # noqa: E402
+import cheby.layout as layout                   # noqa: E402
+import cheby.gen_name as gen_name               # noqa: E402
+import cheby.gen_c as gen_c                     # noqa: E402
+import cheby.expand_hdl as expand_hdl           # noqa: E402
+import cheby.gen_hdl as gen_hdl                 # noqa: E402
+import cheby.print_vhdl as print_vhdl           # noqa: E402
+import cheby.print_verilog as print_verilog     # noqa: E402
+import cheby.print_consts as print_consts       # noqa: E402
+import cheby.print_html as print_html           # noqa: E402
+import cheby.print_markdown as print_markdown   # noqa: E402
+import cheby.profiling as profiling             # noqa: E402
+from cheby.options import Options               # noqa: E402
+
+SCENARIOS = {
+    # name: parameters of the map (see genmap.py)
+    'regs-100': {'regs': 100},
+    'regs-1000': {'regs': 1000},
+    'fields-16': {'regs': 200, 'fields': 16},
+    'nested': {'regs': 50, 'depth': 8},
+    'repeat': {'regs': 20, 'repeat': 256},
+    'submaps': {'regs': 50, 'submaps': 16},
+    'memories': {'regs': 20, 'memories': 64},
+    'mixed': {'regs': 100, 'fields': 8, 'depth': 2, 'repeat': 16,
+              'submaps': 4, 'memories': 4},
+}
+
+
+def run_steps(filename, memory):
+    """Run all the steps on FILENAME.  Return the profiler"""
+    p = profiling.Profiler(memory=memory)
+    opts = Options(profiler=p)
+    p.start()
+    try:
+        with p.section('parse'):
+            t = parser.parse_yaml(filename)
+        with p.section('layout'):
+            layout.layout_cheby(t, opts)
+        with p.section('names'):
+            gen_name.gen_name_memmap(t)
+        with p.section('gen_c'):
+            gen_c.gen_c_cheby(io.StringIO(), t, 'neutral')
+        with p.section('expand'):
+            expand_hdl.expand_hdl(t)
+            gen_name.gen_name_memmap(t)
+            layout.sort_tree(t)
+        with p.section('doc-html'):
+            print_html.pprint(io.StringIO(), t, False)
+        with p.section('doc-md'):
+            print_markdown.print_markdown(io.StringIO(), t)
+        for style in ['vhdl', 'verilog', 'h']:
+            with p.section('consts-' + style):
+                print_consts.pconsts_cheby(io.StringIO(), t, style)
+        with p.section('generate_hdl'):
+            h = gen_hdl.generate_hdl(t, opts)
+        with p.section('print-vhdl'):
+            print_vhdl.print_vhdl(io.StringIO(), h, opts)
+        for lang in ['verilog', 'sv']:
+            with p.section('print-' + lang):
+                print_verilog.print_verilog(io.StringIO(), h, opts.replace(hdl_lang=lang))
+    finally:
+        p.stop()
+    return p
+
+
+def run_scenario(dirname, name, params, repeat):
+    filename = genmap.gen_map(dirname, name, **params)
+    files = [os.path.join(dirname, f) for f in os.listdir(dirname)
+             if f.startswith(name + '.') or f.startswith(name + '_sub')]
+    res = {'params': dict(genmap.DEFAULTS, **params),
+           'files': len(files),
+           'bytes': sum(os.path.getsize(f) for f in files),
+           'steps': {}}
+    steps = res['steps']
+    for _ in range(repeat):
+        p = run_steps(filename, False)
+        for r in p.records.values():
+            s = steps.setdefault(r.path, {'wall': [], 'cpu': [], 'peak': None})
+            s['wall'].append(r.wall)
+            s['cpu'].append(r.cpu)
+    p = run_steps(filename, True)
+    for r in p.records.values():
+        steps[r.path]['peak'] = r.peak
+    return res
+
+
+def get_commit():
+    try:
+        res = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=protodir,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True)
+    except OSError:
+        return None
+    return res.stdout.strip() or None
+
+
+def main():
+    aparser = argparse.ArgumentParser(description='cheby scaling benchmark')
+    aparser.add_argument('-n', '--repeat', type=int, default=5,
+                         help='number of timed runs per scenario')
+    aparser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                         help='run only this scenario (can be repeated)')
+    aparser.add_argument('--json', help='write the results to this file')
+    args = aparser.parse_args()
+
+    results = {'cheby': cheby.__version__,
+               'commit': get_commit(),
+               'date': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'machine': platform.machine(),
+               'repeat': args.repeat,
+               'scenarios': {}}
+    # The messages of the layout (submaps loaded) are not interesting.
+    stderr = sys.stderr
+    with tempfile.TemporaryDirectory() as d:
+        for name in args.scenario or SCENARIOS:
+            sys.stderr = io.StringIO()
+            try:
+                r = run_scenario(d, name, SCENARIOS[name], args.repeat)
+            finally:
+                sys.stderr = stderr
+            results['scenarios'][name] = r
+            print('{} ({} files, {} bytes)'.format(name, r['files'], r['bytes']))
+            for step, s in r['steps'].items():
+                print('  {:<28} {:9.1f} ms {:8.1f} MB'.format(
+                    step, statistics.median(s['wall']) * 1e3, s['peak'] / 1e6))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
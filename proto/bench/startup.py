@@ -0,0 +1,119 @@
+#! /usr/bin/env python3
+"""Startup time benchmark for the cheby command line.
+
+Each scenario (a cheby command line) is run several times in a fresh
+interpreter with '-X importtime'.  The wall time, the import time reported
+by python and the cheby modules that were really loaded are reported.
+A scenario fails if it loads a module it doesn't need, or if it is slower
+than --max-ms."""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+protodir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+srcdir = os.path.join(protodir, '..', 'testfiles')
+
+# Modules that are never needed by a run generating only C headers.
+HDL_MODULES = ['cheby.gen_hdl', 'cheby.print_vhdl', 'cheby.print_verilog',
+               'cheby.gen_wbgen_hdl', 'cheby.gen_gena_regctrl',
+               'cheby.print_html', 'cheby.print_latex', 'cheby.gen_edge3',
+               'cheby.batch']
+
+SCENARIOS = [
+    # name, arguments, forbidden modules (a prefix of the module name)
+    ('version', ['--version'], ['cheby.parser', 'cheby.layout', 'cheby.gen_', 'cheby.print_']),
+    ('gen-c', ['--gen-c', '-i', os.path.join(srcdir, 'demo.cheby')], HDL_MODULES),
+    ('gen-hdl', ['--gen-hdl', '-i', os.path.join(srcdir, 'demo.cheby')],
+     ['cheby.gen_c', 'cheby.print_html', 'cheby.print_latex', 'cheby.gen_wbgen_hdl',
+      'cheby.batch']),
+]
+
+# Run cheby in the child, and print the cheby modules that were loaded (a
+# lazily imported module that wasn't used is not in sys.modules).
+CHILD = """
+import sys, types
+sys.argv = ['cheby'] + {args!r}
+import cheby.main
+try:
+    cheby.main.main()
+finally:
+    mods = [n for n, m in sys.modules.items()
+            if n.startswith('cheby') and type(m) is types.ModuleType]
+    sys.stderr.write('cheby-modules: ' + ' '.join(sorted(mods)) + '\\n')
+"""
+
+
+def parse_importtime(lines):
+    """Return the total import time (in ms) of the top-level imports"""
+    total = 0
+    for l in lines:
+        if not l.startswith('import time:'):
+            continue
+        fields = l[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        if fields[2].startswith('  '):
+            # Not a top-level import (the name is indented)
+            continue
+        total += int(fields[1])
+    return total / 1000.
+
+
+def run_scenario(args, repeat):
+    times = []
+    imports = []
+    modules = []
+    env = dict(os.environ)
+    env['PYTHONPATH'] = protodir + os.pathsep + env.get('PYTHONPATH', '')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD.format(args=args)],
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        times.append((time.perf_counter() - start) * 1000.)
+        lines = res.stderr.splitlines()
+        imports.append(parse_importtime(lines))
+        for l in lines:
+            if l.startswith('cheby-modules: '):
+                modules = l.split()[1:]
+    return {'wall_ms': statistics.median(times),
+            'import_ms': statistics.median(imports),
+            'modules': modules}
+
+
+def main():
+    aparser = argparse.ArgumentParser(description='cheby startup benchmark')
+    aparser.add_argument('-n', '--repeat', type=int, default=5,
+                         help='number of runs per scenario (the median is reported)')
+    aparser.add_argument('--max-ms', type=float,
+                         help='fail if the wall time of a scenario is larger')
+    aparser.add_argument('--json', help='write the results to this file')
+    args = aparser.parse_args()
+
+    results = {}
+    ok = True
+    for name, cmd, forbidden in SCENARIOS:
+        r = run_scenario(cmd, args.repeat)
+        bad = [m for m in r['modules'] if any(m.startswith(f) for f in forbidden)]
+        r['unexpected_modules'] = bad
+        results[name] = r
+        print('{:<10} wall: {:7.1f} ms  imports: {:7.1f} ms  cheby modules: {}'.format(
+            name, r['wall_ms'], r['import_ms'], len(r['modules'])))
+        if bad:
+            print('  error: unexpected modules loaded: {}'.format(' '.join(bad)))
+            ok = False
+        if args.max_ms is not None and r['wall_ms'] > args.max_ms:
+            print('  error: slower than {} ms'.format(args.max_ms))
+            ok = False
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
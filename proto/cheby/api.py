@@ -0,0 +1,129 @@
+"""Python API: generate outputs in memory.
+
+  import cheby.api
+  m = cheby.api.load('regs.cheby')        # or cheby.api.loads(text)
+  res = m.generate(['gen-hdl', 'gen-c'], hdl='verilog')
+  res['gen-hdl']                          # The verilog source (a string)
+
+A map is parsed and laid out once, and can then generate any outputs, any
+number of times, with different options.  The artifacts are named like
+the options of the command line (without the leading '--'), and the
+options are the other arguments of the command line, with '_' instead of
+'-' (like c_style='arm' for --c-style=arm).
+
+The outputs are never written to files, and there is no global state: the
+maps are independent.  Files are only read for the input, its submaps and
+the script of 'gen-custom'."""
+
+import argparse
+import pickle
+
+import cheby.main
+import cheby.output as output
+import cheby.parser as parser
+import cheby.layout as layout
+import cheby.pipeline as pipeline
+from cheby.options import Options
+
+
+class ApiException(Exception):
+    """Exception raised for an incorrect artifact or option"""
+    def __init__(self, msg):
+        super(ApiException, self).__init__()
+        self.msg = msg
+
+    def __str__(self):
+        return "api error: {}".format(self.msg)
+
+
+# Generators that write files by themselves.
+NOT_ARTIFACTS = ['gen_gena_dsp']
+
+
+def get_artifacts():
+    """Return the list of the names of the artifacts"""
+    return [g.name.replace('_', '-') for g in cheby.main.get_generators()
+            if g.name not in NOT_ARTIFACTS]
+
+
+class Map(object):
+    """A parsed and laid out memory map"""
+
+    def __init__(self, tree, options):
+        # The laid out tree.  Not modified by generate().
+        self.tree = tree
+        self.options = options
+
+    def make_args(self, artifacts, kwargs):
+        """Return the arguments of a run that generates ARTIFACTS to
+        outputs named like them"""
+        aparser = cheby.main.get_arg_parser()
+        # Without the arguments of the run (see cheby.main.get_arg_parser)
+        # and without --help.
+        actions = {a.dest: a for a in aparser._actions
+                   if not getattr(a, 'run_only', False) and a.default != argparse.SUPPRESS}
+        args = aparser.parse_args([])
+        args.input = self.tree.c_filename
+        args.header = 'none'
+        gens = [g.name for g in cheby.main.get_generators()
+                if g.name not in NOT_ARTIFACTS]
+        for k, v in kwargs.items():
+            a = actions.get(k)
+            if a is None or k in gens or k in NOT_ARTIFACTS:
+                raise ApiException("unknown option '{}'".format(k))
+            if a.choices is not None and v not in a.choices:
+                raise ApiException("incorrect value '{}' for option '{}' "
+                                   "(must be one of {})".format(
+                                       v, k, ', '.join(a.choices)))
+            setattr(args, k, v)
+        for name in artifacts:
+            dest = name.replace('-', '_')
+            if dest not in gens:
+                raise ApiException("unknown artifact '{}'".format(name))
+            setattr(args, dest, name)
+        args.argv = []
+        args.options = self.options.replace(
+            hdl_lang=args.hdl, rst_sync=(args.ff_reset != 'async'))
+        return args
+
+    def generate(self, artifacts, **kwargs):
+        """Generate ARTIFACTS (a list of names) with options KWARGS.
+        Return a dict from the artifact names to their content (a string)"""
+        args = self.make_args(artifacts, kwargs)
+        outputs = output.BufferedOutputSet()
+        # The stages and the generators modify the tree: work on a copy.
+        t = pickle.loads(pickle.dumps(self.tree, pickle.HIGHEST_PROTOCOL))
+        try:
+            pipeline.run(cheby.main.get_stages(), cheby.main.get_generators(),
+                         args, outputs, t=t, done=['parse', 'layout'])
+        except cheby.main.UsageException as e:
+            raise ApiException(e.msg)
+        return dict(outputs.contents)
+
+
+def load(filename, word_endian='default', cache=None):
+    """Parse and lay out the map of file FILENAME.  WORD_ENDIAN overrides
+    the word endianness of the buses ('big' or 'little').  CACHE is an
+    optional parser.DocumentCache to share the files read between maps.
+    Raise parser.ParseException or layout.LayoutException on errors"""
+    options = Options(word_endian=word_endian, document_cache=cache)
+    t = parser.parse_yaml(filename, cache)
+    layout.layout_cheby(t, options)
+    return Map(t, options)
+
+
+def loads(text, filename='<string>', word_endian='default', cache=None):
+    """Like load, but for TEXT (a yaml document).  The submaps are relative
+    to the directory of FILENAME (by default, the current directory)"""
+    options = Options(word_endian=word_endian, document_cache=cache)
+    t = parser.parse_yaml_string(text, filename)
+    layout.layout_cheby(t, options)
+    return Map(t, options)
+
+
+def generate(source, artifacts, **kwargs):
+    """Generate ARTIFACTS for SOURCE (a filename or a Map).  See
+    Map.generate"""
+    if not isinstance(source, Map):
+        source = load(source)
+    return source.generate(artifacts, **kwargs)
@@ -0,0 +1,206 @@
+"""Cache of the generated outputs (option --cache-dir).
+
+The outputs of a run are stored in the cache directory, and a later run
+with the same options and the same input files just copies them, without
+parsing anything.  The cache is content-addressed, so it can be shared by
+several users or machines (the files are written atomically):
+
+  DIR/inputs/KEY1.json   The files read by a run (the input, its submaps
+                         and the custom script).  KEY1 is the digest of the
+                         options, of the cheby version and of the input.
+  DIR/entries/KEY2.json  The outputs of a run, as a list of (name, blob).
+                         KEY2 is the digest of KEY1 and of all the files.
+  DIR/blobs/DIGEST       The content of an output, by digest.
+
+The cache is limited in size: the least recently used entries are removed
+(an entry is touched when used), and then the blobs no longer used."""
+
+import hashlib
+import json
+import os
+import sys
+
+import cheby
+import cheby.output as output
+
+
+# Arguments that don't change the outputs.
+IGNORED_ARGS = ['argv', 'options', 'jobs', 'output_stats', 'depfile',
+                'skip_if_up_to_date', 'profile', 'profile_dump', 'watch',
+                'cache_dir', 'cache_max_size']
+
+
+def digest_of(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class RecordingOutputSet(output.OutputSet):
+    """Write the outputs and keep their content, to store them in the
+    cache"""
+
+    # Output '-' is also recorded.
+    buffer_stdout = True
+
+    def __init__(self):
+        super(RecordingOutputSet, self).__init__()
+        self.contents = []
+
+    def commit(self, name, content):
+        self.contents.append((name, content))
+        if name == '-':
+            self.stdout = True
+            sys.stdout.write(content)
+        else:
+            super(RecordingOutputSet, self).commit(name, content)
+
+
+class ArtifactCache(object):
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        # Maximum size in bytes (None for no limit).
+        self.max_size = max_size
+
+    def path(self, kind, name):
+        return os.path.join(self.directory, kind, name)
+
+    def write(self, kind, name, data):
+        os.makedirs(os.path.join(self.directory, kind), exist_ok=True)
+        output.write_file(self.path(kind, name), data)
+
+    def read_json(self, kind, name):
+        try:
+            with open(self.path(kind, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def get_input_key(args):
+        """Return the key of the options and of the input of ARGS"""
+        opts = {k: v for k, v in vars(args).items() if k not in IGNORED_ARGS}
+        # The command line is written in the headers.
+        argv = args.argv if args.header != 'none' else None
+        return digest_of({'version': cheby.__version__, 'args': opts,
+                          'argv': argv, 'input': output.file_digest(args.input)})
+
+    @staticmethod
+    def get_entry_key(key1, files):
+        digests = [output.file_digest(f) for f in files]
+        if None in digests:
+            return None
+        return digest_of({'key': key1, 'files': list(zip(files, digests))})
+
+    def lookup(self, args):
+        """Return the entry for ARGS (a dict with the 'files' read and the
+        'outputs'), or None"""
+        key1 = self.get_input_key(args)
+        inputs = self.read_json('inputs', key1 + '.json')
+        if inputs is None:
+            return None
+        key2 = self.get_entry_key(key1, inputs['files'])
+        if key2 is None:
+            return None
+        entry = self.read_json('entries', key2 + '.json')
+        if entry is None:
+            return None
+        try:
+            # Mark as recently used.
+            os.utime(self.path('inputs', key1 + '.json'))
+            os.utime(self.path('entries', key2 + '.json'))
+        except OSError:
+            # Just evicted by another process.
+            return None
+        return entry
+
+    def restore(self, entry, outputs):
+        """Write the outputs of ENTRY to OUTPUTS.  Return False if a blob is
+        missing (nothing is written in that case)"""
+        contents = []
+        for name, blob in entry['outputs']:
+            try:
+                with open(self.path('blobs', blob), 'rb') as f:
+                    contents.append((name, f.read().decode('utf-8')))
+            except OSError:
+                return False
+        for name, _ in contents:
+            dirname = os.path.dirname(name)
+            if name != '-' and dirname:
+                os.makedirs(dirname, exist_ok=True)
+        output.replay(outputs, contents)
+        return True
+
+    def store(self, args, files, contents):
+        """Store the CONTENTS (list of (name, content)) generated for ARGS
+        from FILES"""
+        key1 = self.get_input_key(args)
+        key2 = self.get_entry_key(key1, files)
+        if key2 is None:
+            return
+        outs = []
+        for name, content in contents:
+            data = content.encode('utf-8')
+            blob = output.content_digest(data)
+            if not os.path.isfile(self.path('blobs', blob)):
+                self.write('blobs', blob, data)
+            outs.append((name, blob))
+        # The blobs are written before the entry that references them.
+        self.write('entries', key2 + '.json',
+                   json.dumps({'files': files, 'outputs': outs}).encode('utf-8'))
+        self.write('inputs', key1 + '.json',
+                   json.dumps({'files': files}).encode('utf-8'))
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def list_files(self, kind):
+        """Return the list of (mtime, size, path) of the files of KIND"""
+        res = []
+        d = os.path.join(self.directory, kind)
+        try:
+            names = os.listdir(d)
+        except OSError:
+            return res
+        for name in names:
+            path = os.path.join(d, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            res.append((st.st_mtime_ns, st.st_size, path))
+        return res
+
+    def evict(self, max_size):
+        """Remove the least recently used entries until the size of the
+        cache is at most MAX_SIZE bytes"""
+        index = self.list_files('inputs') + self.list_files('entries')
+        blobs = {os.path.basename(p): s for _, s, p in self.list_files('blobs')}
+        size = sum(s for _, s, _ in index) + sum(blobs.values())
+        if size <= max_size:
+            return
+        # Number of entries using each blob.
+        refs = {}
+        uses = {}
+        for _, _, path in index:
+            if os.path.basename(os.path.dirname(path)) == 'entries':
+                ent = self.read_json('entries', os.path.basename(path))
+                uses[path] = [b for _, b in ent['outputs']] if ent else []
+                for b in uses[path]:
+                    refs[b] = refs.get(b, 0) + 1
+        index.sort()
+        for _, s, path in index:
+            if size <= max_size:
+                break
+            self.remove(path)
+            size -= s
+            for b in uses.get(path, []):
+                refs[b] -= 1
+                if refs[b] == 0 and b in blobs:
+                    self.remove(self.path('blobs', b))
+                    size -= blobs[b]
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            # Already removed by another process.
+            pass
@@ -0,0 +1,158 @@
+"""Batch mode: process many input files in one process.
+
+The manifest is a yaml (or json) file:
+
+  args: [--header=commit]          # Optional, arguments for all the inputs
+  inputs:
+    - input: a.cheby
+      args: [--gen-hdl=a.vhdl, --gen-c=a.h]
+    - input: b.cheby
+      args: --gen-hdl=b.vhdl --gen-doc=b.html
+
+The arguments are the command line arguments of cheby (either a list or a
+string).  Relative filenames are relative to the current directory.
+
+The yaml documents read are kept in memory (see parser.DocumentCache), so
+a submap shared by many inputs is read only once per process.  Inputs can
+be distributed over several processes.  An error doesn't abort the batch:
+it is reported with the timing of each input."""
+
+import concurrent.futures
+import json
+import shlex
+import sys
+import time
+
+import cheby.main
+import cheby.parser
+import cheby.layout
+import cheby.yamlread as yamlread
+
+
+class BatchException(Exception):
+    """Exception raised for an incorrect manifest"""
+    def __init__(self, msg):
+        super(BatchException, self).__init__()
+        self.msg = msg
+
+    def __str__(self):
+        return "batch error: {}".format(self.msg)
+
+
+def get_args(el, where):
+    args = el.get('args', [])
+    if isinstance(args, str):
+        return shlex.split(args)
+    if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+        raise BatchException("'args' of {} must be a string or a list of strings".format(where))
+    return args
+
+
+def load_manifest(filename):
+    """Return the list of argument lists (one per input) of the manifest"""
+    try:
+        with open(filename) as f:
+            if filename.endswith('.json'):
+                el = json.load(f)
+            else:
+                el = yamlread.load(f)
+    except (IOError, ValueError, yamlread.ScanException) as e:
+        raise BatchException("cannot read {}: {}".format(filename, e))
+    if isinstance(el, list):
+        el = {'inputs': el}
+    if not isinstance(el, dict) or not isinstance(el.get('inputs'), list):
+        raise BatchException("{}: missing 'inputs' list".format(filename))
+    common = get_args(el, 'the manifest')
+    res = []
+    for i, inp in enumerate(el['inputs']):
+        if isinstance(inp, str):
+            inp = {'input': inp}
+        if not isinstance(inp, dict) or not isinstance(inp.get('input'), str):
+            raise BatchException("input #{}: 'input' is required".format(i))
+        res.append(common + get_args(inp, inp['input']) + ['-i', inp['input']])
+    return res
+
+
+# The DocumentCache of a worker process.
+worker_cache = None
+
+
+def init_worker():
+    global worker_cache
+    worker_cache = cheby.parser.DocumentCache()
+
+
+def run_worker_entry(argv):
+    return run_entry(argv, worker_cache)
+
+
+def run_entry(argv, cache):
+    """Run cheby with arguments ARGV, reading the files through CACHE (a
+    parser.DocumentCache).  Return a dict with the result"""
+    hits, misses = cache.hits, cache.misses
+    res = {'argv': argv, 'input': argv[-1], 'status': 'ok', 'error': None}
+    start = time.perf_counter()
+    try:
+        args = cheby.main.decode_args(argv)
+        args.options.document_cache = cache
+        outputs = cheby.main.run(args)
+        if outputs is None:
+            res['status'] = 'skipped'
+        else:
+            res['unchanged'] = len(outputs.unchanged)
+            res['rewritten'] = len(outputs.rewritten)
+    except cheby.parser.ParseException as e:
+        res['status'], res['error'] = 'error', "{}:{}".format(res['input'], e)
+    except cheby.layout.LayoutException as e:
+        res['status'], res['error'] = 'error', str(e)
+    except cheby.main.UsageException as e:
+        res['status'], res['error'] = 'error', str(e)
+    except SystemExit as e:
+        res['status'], res['error'] = 'error', "exit with status {}".format(e.code)
+    except Exception as e:
+        res['status'], res['error'] = 'error', "{}: {}".format(type(e).__name__, e)
+    res['time'] = time.perf_counter() - start
+    res['cache_hits'] = cache.hits - hits
+    res['cache_misses'] = cache.misses - misses
+    return res
+
+
+def run_entries(entries, jobs=1):
+    """Run all ENTRIES (list of argument lists), using JOBS processes.
+    Return the list of results (in the same order)"""
+    if jobs <= 1:
+        cache = cheby.parser.DocumentCache()
+        return [run_entry(argv, cache) for argv in entries]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=init_worker) as ex:
+        return list(ex.map(run_worker_entry, entries))
+
+
+def report(fd, results, elapsed):
+    for r in results:
+        fd.write("{:9.3f}s  {:<7}  {}\n".format(r['time'], r['status'], r['input']))
+        if r['error'] is not None:
+            fd.write("            {}\n".format(r['error']))
+    nerrs = len([r for r in results if r['status'] == 'error'])
+    nskip = len([r for r in results if r['status'] == 'skipped'])
+    hits = sum(r['cache_hits'] for r in results)
+    misses = sum(r['cache_misses'] for r in results)
+    fd.write("{} inputs: {} ok, {} skipped, {} errors in {:.3f}s"
+             " (files read: {}, reused: {})\n".format(
+                 len(results), len(results) - nerrs - nskip, nskip, nerrs,
+                 elapsed, misses, hits))
+
+
+def run_batch(filename, jobs=1):
+    """Process the manifest FILENAME.  Return the exit status"""
+    try:
+        entries = load_manifest(filename)
+    except BatchException as e:
+        sys.stderr.write("{}\n".format(e))
+        return 2
+    start = time.perf_counter()
+    results = run_entries(entries, jobs)
+    report(sys.stderr, results, time.perf_counter() - start)
+    if any(r['status'] == 'error' for r in results):
+        return 1
+    return 0
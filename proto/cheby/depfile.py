@@ -0,0 +1,94 @@
+"""Dependency files (for make/ninja) and up-to-date checks.
+
+The dependency file lists the outputs of a run as targets and every file
+read by that run (the input, its submaps and the custom script) as
+prerequisites.  Next to it, a stamp file (DEPFILE.stamp, in JSON) records
+the options, the cheby version and the digests of these files, so that a
+later run can be skipped before any parsing."""
+
+import io
+import json
+import os
+
+import cheby
+import cheby.output as output
+
+
+def escape(filename):
+    """Escape FILENAME for a makefile rule"""
+    res = filename.replace('$', '$$')
+    for c in ' #':
+        res = res.replace(c, '\\' + c)
+    return res
+
+
+def gen_depfile(fd, targets, prereqs):
+    """Write a make rule (also understood by ninja)"""
+    if not targets:
+        return
+    fd.write(' '.join(escape(t) for t in targets) + ':')
+    for p in prereqs:
+        fd.write(' \\\n  ' + escape(p))
+    fd.write('\n')
+
+
+def get_stamp_filename(depfile):
+    return depfile + '.stamp'
+
+
+def write_depfile(depfile, targets, prereqs, argv, stdout=False):
+    """Write the dependency file DEPFILE and its stamp file.
+    ARGV is the list of command line arguments of the run.
+    STDOUT is true if an output was sent to stdout; such a run is never
+    considered as up to date."""
+    buf = io.StringIO()
+    gen_depfile(buf, targets, prereqs)
+    output.write_if_changed(depfile, output.encode_text(buf.getvalue()))
+
+    stamp = {'version': cheby.__version__,
+             'args': argv,
+             'stdout': stdout,
+             'inputs': {f: output.file_digest(f) for f in prereqs},
+             'outputs': {f: output.file_digest(f) for f in targets}}
+    # Always rewritten: its modification time is the time of the last run.
+    output.write_file(get_stamp_filename(depfile),
+                      output.encode_text(json.dumps(stamp, indent=1) + '\n'))
+
+
+def is_up_to_date(depfile, argv, mode='mtime'):
+    """Return True if the outputs recorded in the stamp file of DEPFILE are
+    up to date for a run with command line arguments ARGV.  With MODE
+    'mtime', the inputs must not have been modified after the stamp file;
+    with MODE 'hash', the digests of the inputs and of the outputs must be
+    the recorded ones."""
+    stamp_filename = get_stamp_filename(depfile)
+    try:
+        with open(stamp_filename) as f:
+            stamp = json.load(f)
+        stamp_mtime = os.stat(stamp_filename).st_mtime_ns
+    except (OSError, ValueError):
+        return False
+    if stamp.get('version') != cheby.__version__ \
+       or stamp.get('args') != argv \
+       or stamp.get('stdout', True) \
+       or not stamp.get('outputs'):
+        return False
+    if not os.path.isfile(depfile):
+        return False
+    for f, digest in stamp['outputs'].items():
+        if mode == 'hash':
+            if output.file_digest(f) != digest:
+                return False
+        elif not os.path.isfile(f):
+            return False
+    for f, digest in stamp['inputs'].items():
+        if mode == 'hash':
+            if output.file_digest(f) != digest:
+                return False
+        else:
+            try:
+                if os.stat(f).st_mtime_ns > stamp_mtime:
+                    return False
+            except OSError:
+                return False
+    return True
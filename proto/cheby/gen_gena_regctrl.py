@@ -1377,13 +1377,13 @@ def gen_hdl_misc_root(root, module, isigs):
     module.stmts.append(HDLComment(None))
 
 
-def gen_gena_regctrl(root, use_common_visual):
+def gen_gena_regctrl(root, use_common_visual, options=None):
     root.hdl_module_name = root.name
     if not root.bus.startswith('cern-be-vme-'):
         raise LayoutException(
             root, 'bus must be cern-be-vme-xx for --gen-gena-regctrl')
     root.hdl_bus_attribute = None
-    module = gen_hdl.gen_hdl_header(root)
+    module = gen_hdl.gen_hdl_header(root, options=options)
     root.h_bus['vrst'] = root.h_bus['brst']
     module.name = 'RegCtrl_{}'.format(root.name)
     if not root.h_bussplit:
@@ -33,8 +33,9 @@ from cheby.hdltree import (
 import cheby.tree as tree
 import cheby.hdlutils as hdlutils
 import cheby.hdlopt as hdlopt
+import cheby.profiling as profiling
 from cheby.layout import ilog2
-from cheby.hdl.wbbus import WBBus
+from cheby.options import Options
 from cheby.hdl.ibus import Ibus
 from cheby.hdl.genblock import GenBlock
 from cheby.hdl.buses import name_to_busgen
@@ -230,8 +231,12 @@ def add_write_mux_process(root, module, ibus):
     hdlutils.compute_sensitivity(wrproc)
 
 
-def gen_hdl_header(root, ibus=None):
+def gen_hdl_header(root, ibus=None, options=None):
     # Note: also called from gen_gena_regctrl but without ibus.
+    root.h_options = options if options is not None else Options()
+    # The wishbone_pkg package, created when first used.
+    root.h_wb_pkg = None
+
     module = HDLModule()
     module.name = root.hdl_module_name
 
@@ -324,13 +329,12 @@ def gen_hdl_names(n, parent):
         raise AssertionError(n)
 
 
-def generate_hdl(root):
+def generate_hdl(root, options=None):
+    """Generate the HDL module for ROOT (a root or an address space).
+    OPTIONS (an Options object) are the command line options"""
     ibus = Ibus()
 
-    # Force the regeneration of wb package (useful only when testing).
-    WBBus.wb_pkg = None
-
-    module = gen_hdl_header(root, ibus)
+    module = gen_hdl_header(root, ibus, options)
 
     # For compatibility with Gena.
     root.h_bus['vrst'] = root.h_bus['brst']
@@ -360,6 +364,7 @@ def generate_hdl(root):
     add_read_mux_process(root, module, ibus)
 
     # Remove unused assignments (cleanup)
-    hdlopt.remove_unused(module)
+    with profiling.section(root.h_options.profiler, 'hdlopt'):
+        hdlopt.remove_unused(module)
 
     return module
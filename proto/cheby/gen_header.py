@@ -21,7 +21,7 @@ def get_comment_token(language):
     return comment_token_dict[language]
 
 
-def gen_comment_header(f, header, language):
+def gen_comment_header(f, header, language, argv=None):
     # Generate a comment header for the given programming language
     #
     # The following types are supported
@@ -30,6 +30,8 @@ def gen_comment_header(f, header, language):
     #   commit: Print the arguments as well as the cheby version
     #   full:   Print the arguments, cheby version as well as user and time of
     #           generation
+    #
+    # ARGV is the list of arguments (by default, those of the command line)
 
     c = get_comment_token(language)
 
@@ -43,7 +45,9 @@ def gen_comment_header(f, header, language):
             c, version_str
         )
     )
-    f.write("{}  {}\n".format(c, " ".join(sys.argv[1:])))
+    if argv is None:
+        argv = sys.argv[1:]
+    f.write("{}  {}\n".format(c, " ".join(argv)))
 
     if header == "full" or header is None:
         # getting username may fail in case of Docker containers,
@@ -61,16 +65,16 @@ def gen_comment_header(f, header, language):
     f.write("\n")
 
 
-def gen_comment_header_maybe(f, header, language):
+def gen_comment_header_maybe(f, header, language, argv=None):
     # Generate a comment header depending on the 'header' variable
     if header != 'none':
-        gen_comment_header(f, header, language)
+        gen_comment_header(f, header, language, argv)
 
 
-def gen_comment_header_maybe_version(f, header, language, version):
+def gen_comment_header_maybe_version(f, header, language, version, argv=None):
     # Generate a comment header with version identifier
     if header != 'none':
-        gen_comment_header(f, header, language)
+        gen_comment_header(f, header, language, argv)
         if version is not None:
             c = get_comment_token(language)
             f.write("{c}\n{c} Version: {ver}\n".format(c=c, ver=version))
@@ -11,26 +11,31 @@ import cheby.print_pretty
 import cheby.layout as layout
 from cheby.schemas_version import VERSIONS
 
-# If True, display ignored constructs.
-flag_ignore = False
 
-# Whether holes-preset is kept.
-# always: keep them
-# no-split: kept only if no-split attribute is also present.
-# never: discard them
-flag_keep_preset = 'no-split'
+class Flags(object):
+    """Options of the conversion (set from the command line)"""
+    def __init__(self):
+        # If True, display ignored constructs.
+        self.ignore = False
 
-# parse recursively
-flag_recurse = False
+        # Whether holes-preset is kept.
+        # always: keep them
+        # no-split: kept only if no-split attribute is also present.
+        # never: discard them
+        self.keep_preset = 'no-split'
 
-# autosave to file with .cheby extension
-flag_out_file = False
+        # parse recursively
+        self.recurse = False
 
-# do not display the result
-flag_quiet = False
+        # autosave to file with .cheby extension
+        self.out_file = False
+
+        # do not display the result
+        self.quiet = False
+
+        # If code-fields are converted to enumerations.
+        self.enums = True
 
-# If code-fields are converted to enumerations.
-flag_enums = True
 
 class AppException(Exception):
     "Exception defined for the application"
@@ -143,14 +148,14 @@ def warning(s):
     sys.stderr.write('warning: ' + s + '\n')
 
 
-def ignore_attr(attr, el):
-    if flag_ignore:
+def ignore_attr(flags, attr, el):
+    if flags.ignore:
         sys.stderr.write("note: ignored attribute '{}' in tag '{}'\n".format(
             attr, el.tag))
 
 
-def ignore_tag(tag, el):
-    if flag_ignore:
+def ignore_tag(flags, tag, el):
+    if flags.ignore:
         sys.stderr.write("note: ignored child tag '{}' in tag '{}'\n".format(
             tag, el.tag))
 
@@ -247,18 +252,18 @@ def adjust_common_dict(n):
     del n['note']
 
 
-def conv_codefield(parent, el):
+def conv_codefield(flags, parent, el):
     """Convert code-field as x-gena:code-field"""
-    if not flag_enums:
+    if not flags.enums:
         cf = parent.x_gena.get('code-field', [])
         cf.append({f: el.attrib[f] for f in ['name', 'code', 'description', 'comment', 'note']
                    if f in el.attrib})
         parent.x_gena['code-field'] = cf
 
 
-def conv_codefields(parent, el, width):
+def conv_codefields(flags, parent, el, width):
     """Convert code-field as x-enum"""
-    if not flag_enums:
+    if not flags.enums:
         return
     if not any([child.tag == 'code-field' for child in el]):
         return
@@ -303,7 +308,7 @@ def conv_configuration_val(parent, el):
     parent.x_fesa['configuration-value'] = cv
 
 
-def conv_bit_field_data(reg, el):
+def conv_bit_field_data(flags, reg, el):
     res = cheby.tree.Field(reg)
     res.x_gena = {}
     res.x_fesa = {}
@@ -351,16 +356,16 @@ def conv_bit_field_data(reg, el):
             raise UnknownAttribute(k)
     adjust_common(res)
     res.lo = int(attrs['bit'])
-    conv_codefields(res, el, 1)
+    conv_codefields(flags, res, el, 1)
     for child in el:
         if child.tag == 'code-field':
-            conv_codefield(res, child)
+            conv_codefield(flags, res, child)
         else:
             raise UnknownTag(child.tag)
     reg.children.append(res)
 
 
-def conv_sub_reg(reg, el):
+def conv_sub_reg(flags, reg, el):
     res = cheby.tree.Field(reg)
     res.x_gena = {}
     res.x_fesa = {}
@@ -426,16 +431,16 @@ def conv_sub_reg(reg, el):
     elif res.lo > res.hi:
         # Swap incorrect order.
         res.lo, res.hi = (res.hi, res.lo)
-    conv_codefields(res, el, 1 if res.hi is None else res.hi - res.lo + 1)
+    conv_codefields(flags, res, el, 1 if res.hi is None else res.hi - res.lo + 1)
     for child in el:
         if child.tag == 'code-field':
-            conv_codefield(res, child)
+            conv_codefield(flags, res, child)
         else:
             raise UnknownTag(child.tag)
     reg.children.append(res)
 
 
-def conv_register_data(parent, el):
+def conv_register_data(flags, parent, el):
     res = cheby.tree.Reg(parent)
     res.x_gena = {}
     res.x_fesa = {}
@@ -519,14 +524,14 @@ def conv_register_data(parent, el):
     if attrs['access-mode'] == 'rmw':
         res.x_gena['rmw'] = True
     res.access = conv_access(attrs['access-mode'])
-    conv_codefields(res, el, res.width // 2 if attrs['access-mode'] == 'rmw' else res.width)
+    conv_codefields(flags, res, el, res.width // 2 if attrs['access-mode'] == 'rmw' else res.width)
     for child in el:
         if child.tag == 'code-field':
-            conv_codefield(res, child)
+            conv_codefield(flags, res, child)
         elif child.tag == 'bit-field-data':
-            conv_bit_field_data(res, child)
+            conv_bit_field_data(flags, res, child)
         elif child.tag == 'sub-reg':
-            conv_sub_reg(res, child)
+            conv_sub_reg(flags, res, child)
         else:
             raise UnknownTag(child.tag)
     if not res.children:
@@ -560,8 +565,8 @@ def conv_register_data(parent, el):
                     f.preset = (preset >> f.lo) & mask
                 preset &= ~(mask << f.lo)
             if preset != 0:
-                if flag_keep_preset == 'always' \
-                   or (flag_keep_preset == 'no-split'
+                if flags.keep_preset == 'always' \
+                   or (flags.keep_preset == 'no-split'
                            and layout.get_gena_gen(res, 'no-split', False)):
                     res.x_gena['holes-preset'] = "0x{:x}".format(preset)
                 else:
@@ -730,7 +735,7 @@ def conv_memory_data(parent, el):
     parent.children.append(res)
 
 
-def conv_area(parent, el):
+def conv_area(flags, parent, el):
     res = cheby.tree.Block(parent)
     res.x_gena = {}
     attrs = el.attrib
@@ -757,7 +762,7 @@ def conv_area(parent, el):
                     raise UnknownGenAttribute(e, res)
             res.x_gena['gen'] = xg
         elif k in ('persistence',):
-            ignore_attr(k, el)
+            ignore_attr(flags, k, el)
         else:
             raise UnknownAttribute(k)
     adjust_common(res)
@@ -767,11 +772,11 @@ def conv_area(parent, el):
     res.size_val = conv_depth(res.size_str)
 
     for child in el:
-        conv_element(res, child)
+        conv_element(flags, res, child)
     parent.children.append(res)
 
 
-def conv_submap(parent, el):
+def conv_submap(flags, parent, el):
     res = cheby.tree.Submap(parent)
     res.x_gena = {}
     attrs = el.attrib
@@ -819,10 +824,10 @@ def conv_submap(parent, el):
 
     # process recursively
 
-    if flag_recurse:
+    if flags.recurse:
         try:
             base_path = Path(res.get_root().c_filename).parent
-            process_file(base_path / attrs["filename"])
+            process_file(flags, base_path / attrs["filename"])
         except Exception as excp:
             error(f"Failed to parse recursively file: {attrs['filename']} because: {excp}")
     res.name = attrs['name']
@@ -834,20 +839,20 @@ def conv_submap(parent, el):
     parent.children.append(res)
 
 
-def conv_element(parent, child):
+def conv_element(flags, parent, child):
     if child.tag == 'register-data':
-        conv_register_data(parent, child)
+        conv_register_data(flags, parent, child)
     elif child.tag == 'memory-data':
         conv_memory_data(parent, child)
     elif child.tag == 'area':
-        conv_area(parent, child)
+        conv_area(flags, parent, child)
     elif child.tag == 'submap':
-        conv_submap(parent, child)
+        conv_submap(flags, parent, child)
     else:
         raise UnknownTag(child.tag)
 
 
-def conv_root(root, filename):
+def conv_root(flags, root, filename):
     res = cheby.tree.Root()
     res.c_filename = filename
     res.x_gena = {}
@@ -943,21 +948,23 @@ def conv_root(root, filename):
         elif child.tag == 'configuration-value':
             conv_configuration_val(res, child)
         elif child.tag == 'fesa-class-properties':
-            ignore_tag(child.tag, root)
+            ignore_tag(flags, child.tag, root)
         else:
-            conv_element(res, child)
+            conv_element(flags, res, child)
     return res
 
 
-def convert(filename):
+def convert(filename, flags=None):
+    if flags is None:
+        flags = Flags()
     tree = ET.parse(filename)
     root = tree.getroot()
-    return conv_root(root, filename)
+    return conv_root(flags, root, filename)
 
 
-def process_file(filename):
+def process_file(flags, filename):
     try:
-        res = convert(filename)
+        res = convert(filename, flags)
     except UnknownGenAttribute as e:
         error("error: unknown 'gen=' attribute '{}' in {}".format(
             e.msg, e.node.get_path()))
@@ -973,8 +980,8 @@ def process_file(filename):
         error("error: unknown value '{}' for tag '{}'".format(
             e.val, e.name))
         raise
-    if not flag_quiet:
-        if flag_out_file:
+    if not flags.quiet:
+        if flags.out_file:
             new_filename = os.path.splitext(filename)[0] + '.cheby'
             with open(new_filename, 'w') as f:
                 cheby.print_pretty.pprint_cheby(f, res)
@@ -983,8 +990,6 @@ def process_file(filename):
 
 
 def main():
-    global flag_ignore, flag_keep_preset, flag_recurse, flag_out_file, flag_recurse, flag_quiet
-    global flag_enums
     aparser = argparse.ArgumentParser(
         description='Gena to Cheby converter',
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -1011,18 +1016,19 @@ def main():
                          help='Do not use enumeration for code-fields but x-gena extensions')
 
     args = aparser.parse_args()
-    flag_ignore = args.ignore
-    flag_keep_preset = args.keep_preset
-    flag_out_file = args.out_file
-    flag_recurse = args.recursive and flag_out_file
-    flag_quiet = args.quiet
-    flag_enums = args.enums
+    flags = Flags()
+    flags.ignore = args.ignore
+    flags.keep_preset = args.keep_preset
+    flags.out_file = args.out_file
+    flags.recurse = args.recursive and flags.out_file
+    flags.quiet = args.quiet
+    flags.enums = args.enums
 
     succeeded = True
 
     for file in args.FILE:
         try:
-            process_file(file)
+            process_file(flags, file)
         except AppException as e:
             if False:
                 print('error: {}'.format(e))
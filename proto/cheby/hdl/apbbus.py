@@ -18,7 +18,7 @@ from cheby.hdltree import (
 from cheby.hdl.busgen import BusGen
 import cheby.tree as tree
 import cheby.parser as parser
-from cheby.hdl.globals import gconfig, dirname
+from cheby.hdl.globals import dirname
 from cheby.hdl.ibus import add_bus
 from cheby.hdl.busparams import BusOptions
 
@@ -95,7 +95,7 @@ class APBBus(BusGen):
             ibus.wr_req_del = module.new_HDLSignal("wr_req_del")
 
             proc = HDLSync(
-                root.h_bus["clk"], root.h_bus["brst"], rst_sync=gconfig.rst_sync
+                root.h_bus["clk"], root.h_bus["brst"], rst_sync=root.h_options.rst_sync
             )
             proc.rst_stmts.append(HDLAssign(ibus.wr_req_del, bit_0))
             proc.sync_stmts.append(HDLAssign(ibus.wr_req_del, ibus.wr_req))
@@ -283,7 +283,7 @@ class APBBus(BusGen):
 
         # Internal request signal
         # Activate on incoming request, deactivate on acknowledge (prioritize)
-        proc = HDLSync(root.h_bus["clk"], root.h_bus["brst"], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus["clk"], root.h_bus["brst"], rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(n.h_wr_reg, bit_0))
         proc.rst_stmts.append(HDLAssign(n.h_rd_reg, bit_0))
 
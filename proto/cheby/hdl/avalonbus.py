@@ -6,7 +6,7 @@ from cheby.hdltree import (HDLPort,
                            HDLAnd, HDLOr, HDLNot, HDLEq,
                            HDLSlice, HDLParen)
 from cheby.hdl.busgen import BusGen
-from cheby.hdl.globals import gconfig, dirname
+from cheby.hdl.globals import dirname
 from cheby.hdl.ibus import add_bus
 import cheby.parser as parser
 import cheby.tree as tree
@@ -32,7 +32,7 @@ class AvalonBus(BusGen):
         # Set on rd or wr, cleared on ack
         wait = module.new_HDLSignal('wait_int')
         proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'],
-                       rst_sync=gconfig.rst_sync)
+                       rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(wait, bit_0))
         proc.sync_stmts.append(HDLAssign(
             wait, HDLAnd(HDLOr(wait, HDLParen(HDLOr(root.h_bus['rd'], root.h_bus['wr']))),
@@ -56,7 +56,7 @@ class AvalonBus(BusGen):
             )
         module.stmts.append(proc)
 
-        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(ibus.rd_req, bit_0))
         proc.rst_stmts.append(HDLAssign(ibus.wr_req, bit_0))
 
@@ -207,7 +207,7 @@ class AvalonBus(BusGen):
 
     def wire_bus_slave(self, root, module, n, ibus):
         stmts = module.stmts
-        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(n.h_rr, bit_0))
         proc.rst_stmts.append(HDLAssign(n.h_wr, bit_0))
         if root.h_bussplit:
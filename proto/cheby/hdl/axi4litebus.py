@@ -19,7 +19,7 @@ from cheby.hdltree import (
 from cheby.hdl.busgen import BusGen
 import cheby.tree as tree
 import cheby.parser as parser
-from cheby.hdl.globals import gconfig, dirname
+from cheby.hdl.globals import dirname
 from cheby.hdl.ibus import add_bus
 from cheby.hdl.busparams import BusOptions
 
@@ -83,7 +83,7 @@ class AXI4LiteBus(BusGen):
         module.stmts.append(HDLAssign(root.h_bus['wready'], HDLNot(axi_wset)))
         module.stmts.append(HDLAssign(root.h_bus['bvalid'], axi_wdone))
 
-        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(ibus.wr_req, bit_0))
         proc.rst_stmts.append(HDLAssign(axi_awset, bit_0))
         proc.rst_stmts.append(HDLAssign(axi_wset, bit_0))
@@ -200,7 +200,7 @@ class AXI4LiteBus(BusGen):
         module.stmts.append(HDLAssign(root.h_bus['arready'], HDLNot(axi_arset)))
         module.stmts.append(HDLAssign(root.h_bus['rvalid'], axi_rdone))
 
-        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(ibus.rd_req, bit_0))
         proc.rst_stmts.append(HDLAssign(axi_arset, bit_0))
         if opts.bus_error:
@@ -399,7 +399,7 @@ class AXI4LiteBus(BusGen):
         stmts.append(HDLAssign(n.h_bus['arprot'], HDLBinConst(0, 3)))
         stmts.append(HDLAssign(n.h_bus['rready'], bit_1))
 
-        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
         # Machine state for valid/ready AW and W channels
         # Set valid on request, clear valid on ready.
         # Set done on ready, clear done on ack.
@@ -6,7 +6,6 @@ from cheby.hdltree import (HDLComment, HDLComb, HDLSync,
                            HDLSwitch, HDLChoiceExpr, HDLChoiceDefault,
                            HDLAssign, HDLSlice, HDLReplicate, HDLInstance,
                            HDLNumber, bit_1, bit_0, bit_x, HDLBinConst)
-from cheby.hdl.globals import gconfig
 from cheby.layout import ilog2
 import cheby.tree as tree
 
@@ -226,7 +225,8 @@ class GenMemory(ElGen):
                 inst.conns.append(("rd_b_i", reg.h_rd))
                 inst.conns.append(("wr_b_i", bit_0))
 
-        proc = HDLSync(self.root.h_bus['clk'], self.root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(self.root.h_bus['clk'], self.root.h_bus['brst'],
+                       rst_sync=self.root.h_options.rst_sync)
         for i in range(reg.c_nwords):
             proc.rst_stmts.append(HDLAssign(reg.h_rack[i], bit_0))
             if self.root.h_bussplit and reg.access in ['rw', 'wo']:
@@ -1,7 +1,6 @@
 import cheby.tree as tree
 import cheby.layout as layout
 from cheby.hdl.elgen import ElGen
-from cheby.hdl.globals import gconfig
 from cheby.hdltree import (
     HDLAssign,
     HDLSync,
@@ -601,7 +600,7 @@ class GenReg(ElGen):
                 ffproc = HDLSync(
                     self.root.h_bus["clk"],
                     self.root.h_bus["vrst"],
-                    rst_sync=gconfig.rst_sync,
+                    rst_sync=self.root.h_options.rst_sync,
                 )
 
                 # Reset statements: Add each field with its preset
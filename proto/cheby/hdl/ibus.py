@@ -1,5 +1,4 @@
 from cheby.hdltree import HDLAssign, HDLSync, HDLComment, HDLBinConst, bit_0
-from cheby.hdl.globals import gconfig
 
 
 class Ibus:
@@ -71,7 +70,7 @@ class Ibus:
                       ('wr_err', c_wo, 'o', None, None)])
         module.stmts.append(HDLComment("pipelining for {}".format('+'.join(conds))))
         proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'],
-                       rst_sync=gconfig.rst_sync)
+                       rst_sync=root.h_options.rst_sync)
         for n, c, d, sz, lo in names:
             if n == 'wr_adr' and copy_wa:
                 # If wr_adr == rd_adr in both self and future res, do not create a signal,
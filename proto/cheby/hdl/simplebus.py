@@ -5,7 +5,7 @@ from cheby.hdltree import (HDLPort,
                            HDLAnd, HDLOr, HDLNot, HDLEq,
                            HDLSlice, HDLParen)
 from cheby.hdl.busgen import BusGen
-from cheby.hdl.globals import gconfig, dirname
+from cheby.hdl.globals import dirname
 from cheby.hdl.ibus import add_bus
 import cheby.parser as parser
 
@@ -181,7 +181,7 @@ class SimpleBus(BusGen):
 
         if root.h_bussplit:
             # Handle read requests.
-            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
             # Write requests set on WE, clear by RdDone
             proc.sync_stmts.append(
                 HDLAssign(n.h_wr,
@@ -219,7 +219,7 @@ class SimpleBus(BusGen):
             # Asymetric pipelining: add a mux to select the address.
             n.h_ws = module.new_HDLSignal(n.c_name + '_ws')
             n.h_wt = module.new_HDLSignal(n.c_name + '_wt')
-            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
             proc.sync_stmts.append(
                 HDLAssign(n.h_wt,
                           HDLAnd(HDLOr(n.h_wt, n.h_ws), HDLNot(n.h_bus['wack']))))
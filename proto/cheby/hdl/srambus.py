@@ -4,7 +4,6 @@ from cheby.hdltree import (HDLAssign, HDLSync, HDLComb,
                            HDLAnd, HDLOr, HDLNot, HDLEq,
                            HDLSlice)
 from cheby.hdl.busgen import BusGen
-from cheby.hdl.globals import gconfig
 import cheby.tree as tree
 
 
@@ -41,7 +40,7 @@ class SRAMBus(BusGen):
         stmts = module.stmts
         if n.c_bus_access in ('ro', 'rw'):
             # Acknowledge: delay rack by one cycle.
-            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
             proc.rst_stmts.append(HDLAssign(n.h_rack, bit_0))
             proc.sync_stmts.append(HDLAssign(n.h_rack, HDLAnd(n.h_re, HDLNot(n.h_rack))))
             stmts.append(proc)
@@ -51,7 +50,7 @@ class SRAMBus(BusGen):
             # Asymetric pipelining: add a mux to select the address.
             n.h_wp = module.new_HDLSignal(n.c_name + '_wp')
             n.h_we = module.new_HDLSignal(n.c_name + '_we')
-            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+            proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
             proc.sync_stmts.append(
                 HDLAssign(n.h_wp,
                           HDLAnd(HDLOr(ibus.wr_req, n.h_wp), ibus.rd_req)))
@@ -8,15 +8,10 @@ from cheby.hdltree import (HDLPackage,
                            HDLParen)
 from cheby.hdl.busgen import BusGen
 import cheby.tree as tree
-from cheby.hdl.globals import gconfig, dirname
+from cheby.hdl.globals import dirname
 
 
 class WBBus(BusGen):
-    # Package wishbone_pkg that contains the wishbone interface
-    wb_pkg = None
-    wb_itf = None
-    wb_ports = None
-
     def __init__(self, name):
         assert name.startswith('wb-')
 
@@ -27,7 +22,7 @@ class WBBus(BusGen):
         # and cleared on the ack.
         wb_xip = module.new_HDLSignal('wb_{}ip'.format(pfx))
         proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'],
-                       rst_sync=gconfig.rst_sync)
+                       rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(wb_xip, bit_0))
         proc.sync_stmts.append(HDLAssign(
             wb_xip, HDLAnd(HDLOr(wb_xip, HDLParen(stb)), HDLNot(ack))))
@@ -160,18 +155,18 @@ class WBBus(BusGen):
         res['dato'] = build_port('dat', data_bits, dir=out)
         return res
 
-    def gen_wishbone(self, module, ports, name, addr_bits, lo_addr,
+    def gen_wishbone(self, root, module, ports, name, addr_bits, lo_addr,
                      data_bits, comment, is_master, is_group):
         if is_group:
-            if WBBus.wb_pkg is None:
-                self.gen_wishbone_pkg()
+            if root.h_wb_pkg is None:
+                self.gen_wishbone_pkg(root)
                 module.deps.append(('work', 'wishbone_pkg'))
             # Add the interface modport to the ports
-            port = ports.add_modport(name, WBBus.wb_itf, is_master)
+            port = ports.add_modport(name, root.h_wb_itf, is_master)
             port.comment = comment
             res = {}
             # Fill res
-            for pname, sig in WBBus.wb_ports.items():
+            for pname, sig in root.h_wb_ports.items():
                 res[pname] = HDLInterfaceSelect(port, sig)
             if data_bits < 32:
                 res['dato'] = HDLSlice(res['dato'], 0, data_bits)
@@ -191,16 +186,16 @@ class WBBus(BusGen):
             res['cyc'].comment = comment
             return res
 
-    def gen_wishbone_pkg(self):
-        """Create the wishbone_pkg package, so that interface can be
-        referenced"""
-        assert WBBus.wb_pkg is None
-        WBBus.wb_pkg = HDLPackage('wishbone_pkg')
-        WBBus.wb_itf = HDLInterface('t_wishbone')
-        WBBus.wb_pkg.decls.append(WBBus.wb_itf)
-        WBBus.wb_ports = self.gen_wishbone_bus(
+    def gen_wishbone_pkg(self, root):
+        """Create the wishbone_pkg package (one per generation), so that
+        interface can be referenced"""
+        assert root.h_wb_pkg is None
+        root.h_wb_pkg = HDLPackage('wishbone_pkg')
+        root.h_wb_itf = HDLInterface('t_wishbone')
+        root.h_wb_pkg.decls.append(root.h_wb_itf)
+        root.h_wb_ports = self.gen_wishbone_bus(
             lambda n, sz, lo_idx=0, dir='IN':
-            WBBus.wb_itf.add_port(n, size=sz, lo_idx=lo_idx, dir=dir),
+            root.h_wb_itf.add_port(n, size=sz, lo_idx=lo_idx, dir=dir),
             32, 0, 32, True)
         return
 
@@ -212,7 +207,7 @@ class WBBus(BusGen):
         bus_error = root.get_extension('x_hdl', 'bus-error')
 
         root.h_bus.update(self.gen_wishbone(
-            module, module, 'wb', root.c_addr_bits, root.c_addr_word_bits,
+            root, module, module, 'wb', root.c_addr_bits, root.c_addr_word_bits,
             root.c_word_bits, None, False, busgroup is True))
         root.h_bussplit = False
 
@@ -226,7 +221,7 @@ class WBBus(BusGen):
         comment = '\n' + (n.comment or n.description or 'WB bus {}'.format(n.name))
         n.h_busgroup = opts.busgroup
         n.h_bus = self.gen_wishbone(
-            module, module, n.c_name,
+            root, module, module, n.c_name,
             n.c_addr_bits, root.c_addr_word_bits, root.c_word_bits,
             comment, True, opts.busgroup)
         # Internal signals
@@ -268,7 +263,7 @@ class WBBus(BusGen):
     def wire_bus_slave(self, root, module, n, ibus):
         stmts = module.stmts
         stmts.append(HDLAssign(n.h_tr, HDLOr(n.h_wt, n.h_rt)))
-        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=gconfig.rst_sync)
+        proc = HDLSync(root.h_bus['clk'], root.h_bus['brst'], rst_sync=root.h_options.rst_sync)
         proc.rst_stmts.append(HDLAssign(n.h_rt, bit_0))
         proc.rst_stmts.append(HDLAssign(n.h_wt, bit_0))
         if root.h_bussplit:
@@ -50,3 +50,17 @@ def compute_sensitivity(comb):
 
     extract_stmt_list(comb.stmts)
     comb.sensitivity = res
+
+
+class EmitterTable(dict):
+    """A dict from hdltree classes to emitter functions.
+    A class without its own entry uses the entry of its nearest base class;
+    the result is then stored so that the next lookup is a plain dict
+    access."""
+    def __missing__(self, cls):
+        for base in cls.__mro__[1:]:
+            res = self.get(base)
+            if res is not None:
+                self[cls] = res
+                return res
+        raise AssertionError("unhandled hdl node class {}".format(cls.__name__))
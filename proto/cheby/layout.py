@@ -9,13 +9,12 @@
 
 import sys
 import os.path
+import pickle
 import cheby.tree as tree
 import cheby.parser
+import cheby.profiling as profiling
+from cheby.options import Options
 
-# Command line option to override word-endianness
-# Can be: default, little, big
-# Apply to the whole design.
-word_endianness = 'default'
 
 def ilog2(val):
     "Return n such as 2**n >= val and 2**(n-1) < val"
@@ -60,13 +59,14 @@ def get_gena_gen(n, name, default=None):
 
 
 class Layout(tree.Visitor):
-    def __init__(self, root):
+    def __init__(self, root, options):
         super(Layout, self).__init__()
         self.root = root
+        self.options = options
         self.address = 0
 
     def duplicate(self):
-        res = Layout(self.root)
+        res = Layout(self.root, self.options)
         return res
 
     def compute_address(self, n):
@@ -355,10 +355,78 @@ def compute_submap_absolute_filename(sm):
     return filename
 
 
-def load_submap(blk):
+def load_submap(blk, options):
+    """Return the laid out submap of BLK"""
     sys.stderr.write('Loading {}...\n'.format(blk.filename))
     filename = compute_submap_absolute_filename(blk)
-    return cheby.parser.parse_yaml(filename)
+    if options.submap_cache is not None:
+        return options.submap_cache.load(filename, options)
+    with profiling.section(options.profiler, 'load-submap'):
+        submap = cheby.parser.parse_yaml(filename, options.document_cache)
+    layout_cheby_memmap(submap, options)
+    return submap
+
+
+class SubmapCache(object):
+    """Cache of the laid out submaps, indexed by filename.  A submap is
+    parsed and laid out again only if its file or the file of one of its
+    submaps (transitively) has been modified.  Used when the same maps are
+    generated again and again (see watch.py)."""
+    def __init__(self):
+        # (files, data) by (real path, word endian): the files read, as a
+        # list of (filename, stamp), and the pickled submap.
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_stamp(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self, filename, options):
+        key = (os.path.realpath(filename), options.word_endian)
+        ent = self.entries.get(key)
+        if ent is not None and all([self.get_stamp(f) == st for f, st in ent[0]]):
+            self.hits += 1
+            # The tree is modified by the next passes: use a copy.
+            return pickle.loads(ent[1])
+        self.misses += 1
+        # Before reading the file, so that a modification while it is read
+        # is not missed.
+        stamp = self.get_stamp(filename)
+        with profiling.section(options.profiler, 'load-submap'):
+            submap = cheby.parser.parse_yaml(filename, options.document_cache)
+        layout_cheby_memmap(submap, options)
+        files = [(filename, stamp)]
+        # The submaps of the submap have just been loaded in the cache.
+        for f in get_input_filenames(submap)[1:]:
+            files.append(self.entries[(os.path.realpath(f), options.word_endian)][0][0])
+        self.entries[key] = (files, pickle.dumps(submap, pickle.HIGHEST_PROTOCOL))
+        return submap
+
+
+def get_input_filenames(root):
+    """Return the list of the files read to build ROOT (once laid out): its
+    own file followed by the files of all the submaps (transitively).
+    There are no duplicates."""
+    res = [root.c_filename]
+
+    def walk(n):
+        if isinstance(n, tree.Submap):
+            if n.c_submap is not None:
+                if n.c_submap.c_filename not in res:
+                    res.append(n.c_submap.c_filename)
+                walk(n.c_submap)
+        elif isinstance(n, tree.CompositeNode):
+            for c in n.children:
+                walk(c)
+
+    walk(root)
+    return res
 
 
 def align_block(n):
@@ -394,8 +462,7 @@ def layout_submap(lo, n):
         if n.size_val is not None:
             raise LayoutException(
                 n, "size given for submap '{}'".format(n.get_path()))
-        submap = load_submap(n)
-        layout_cheby_memmap(submap)
+        submap = load_submap(n, lo.options)
         n.c_submap = submap
         n.c_size = n.c_submap.c_size
         n.c_align = n.c_submap.c_align
@@ -647,7 +714,7 @@ def layout_enums(root):
                         lit, "value is too large (needs a size of {})".format(lit_width))
 
 
-def layout_bus(root, name):
+def layout_bus(root, name, options):
     """Extract size/align from a bus, set:
        * c_word_size
        * c_word_endian
@@ -720,8 +787,8 @@ def layout_bus(root, name):
                 root.word_endian))
         root.c_word_endian = root.word_endian
     # Override by the command line
-    if word_endianness != 'default':
-        root.c_word_endian = word_endianness
+    if options.word_endian != 'default':
+        root.c_word_endian = options.word_endian
 
     # Number of bits in the address used by a word
     root.c_addr_word_bits = ilog2(root.c_word_size)
@@ -739,9 +806,9 @@ def copy_bus(dst, src):
     dst.c_word_bits = src.c_word_bits
 
 
-def layout_memmap_root(root):
+def layout_memmap_root(root, options):
     """Layout a memmap or a submap but not its children"""
-    layout_bus(root, root.bus)
+    layout_bus(root, root.bus, options)
 
     # version
     root.c_version = layout_semantic_version(root, root.version)
@@ -753,12 +820,12 @@ def layout_memmap_root(root):
     layout_enums(root)
 
 
-def layout_cheby_memmap(root):
+def layout_cheby_memmap(root, options):
     """Layout a memmap or a submap"""
-    layout_memmap_root(root)
+    layout_memmap_root(root, options)
 
     # A normal map/submap
-    lo = Layout(root)
+    lo = Layout(root, options)
     lo.visit(root)
 
 
@@ -781,23 +848,26 @@ def set_abs_address(n, base_addr):
         raise AssertionError
 
 
-def layout_cheby(root):
-    """Layout the root memmap"""
+def layout_cheby(root, options=None):
+    """Layout the root memmap.  OPTIONS (an Options object) are the
+    command line options"""
+    if options is None:
+        options = Options()
     if any([isinstance(c, tree.AddressSpace) for c in root.children]):
         root.c_address_spaces_map = {s.name: s for s in root.children}
-        layout_memmap_root(root)
+        layout_memmap_root(root, options)
         for space in root.children:
             if not isinstance(space, tree.AddressSpace):
                 raise LayoutException(space, "either all root children must be address-space or none")
             # By default use main bus
             copy_bus(space, root)
-            lo = Layout(root)
+            lo = Layout(root, options)
             lo.visit(space)
             set_abs_address(space, 0)
     else:
         # No address space, use a default one
         root.c_address_spaces_map = None
-        layout_cheby_memmap(root)
+        layout_cheby_memmap(root, options)
         set_abs_address(root, 0)
 
 def sort_tree(n):
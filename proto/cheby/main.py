@@ -3,43 +3,117 @@ import sys
 import os.path
 import time
 import argparse
-import cheby.parser
-import cheby.print_pretty as pprint
-import cheby.sprint as sprint
-import cheby.gen_c as gen_c
-import cheby.gen_laychk as gen_laychk
-import cheby.layout as layout
-import cheby.gen_hdl as gen_hdl
-import cheby.print_vhdl as print_vhdl
-import cheby.print_verilog as print_verilog
-import cheby.gen_edge as gen_edge
-import cheby.gen_edge3 as gen_edge3
-import cheby.gen_silecs as gen_silecs
-import cheby.gen_custom as gen_custom
-import cheby.expand_hdl as expand_hdl
-import cheby.gen_name as gen_name
-import cheby.gen_gena_memmap as gen_gena_memmap
-import cheby.gen_gena_regctrl as gen_gena_regctrl
-import cheby.gen_gena_dsp as gen_gena_dsp
-import cheby.gen_wbgen_hdl as gen_wbgen_hdl
-import cheby.print_html as print_html
-import cheby.print_markdown as print_markdown
-import cheby.print_rest as print_rest
-import cheby.print_latex as print_latex
-import cheby.print_consts as print_consts
-import cheby.gen_devicetree as gen_devicetree
-import cheby.gen_device_script as gen_device_script
-import cheby.gen_header as gen_header
-import cheby.hdl.globals
-
-
-def decode_args():
+import copy
+import importlib
+import cheby
+from cheby.options import Options
+
+
+class LazyModule(object):
+    """Stand-in for the module NAME, which is imported when one of its
+    attributes is first used.  The import machinery serializes the
+    concurrent first uses (so that no thread sees a module being
+    initialized), and then the globals of this module refer to the module
+    itself"""
+    def __init__(self, name):
+        self._name = name
+
+    def _load(self):
+        res = importlib.import_module(self._name)
+        g = globals()
+        for k, v in list(g.items()):
+            if v is self:
+                g[k] = res
+        return res
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return '<lazy module {}>'.format(self._name)
+
+
+def lazy_import(name):
+    """Return the module NAME, but load it only when one of its attributes
+    is used.  So a run imports only the modules of the requested outputs."""
+    res = sys.modules.get(name)
+    if res is not None:
+        return res
+    return LazyModule(name)
+
+
+def import_generators():
+    """Import all the passes and generators now"""
+    for m in GENERATOR_MODULES:
+        if isinstance(m, LazyModule):
+            m._load()
+
+
+# The passes and generators, loaded on demand.
+parser = lazy_import('cheby.parser')
+pprint = lazy_import('cheby.print_pretty')
+sprint = lazy_import('cheby.sprint')
+gen_c = lazy_import('cheby.gen_c')
+gen_laychk = lazy_import('cheby.gen_laychk')
+layout = lazy_import('cheby.layout')
+gen_hdl = lazy_import('cheby.gen_hdl')
+print_vhdl = lazy_import('cheby.print_vhdl')
+print_verilog = lazy_import('cheby.print_verilog')
+gen_edge = lazy_import('cheby.gen_edge')
+gen_edge3 = lazy_import('cheby.gen_edge3')
+gen_silecs = lazy_import('cheby.gen_silecs')
+gen_custom = lazy_import('cheby.gen_custom')
+expand_hdl = lazy_import('cheby.expand_hdl')
+gen_name = lazy_import('cheby.gen_name')
+gen_gena_memmap = lazy_import('cheby.gen_gena_memmap')
+gen_gena_regctrl = lazy_import('cheby.gen_gena_regctrl')
+gen_gena_dsp = lazy_import('cheby.gen_gena_dsp')
+gen_wbgen_hdl = lazy_import('cheby.gen_wbgen_hdl')
+print_html = lazy_import('cheby.print_html')
+print_markdown = lazy_import('cheby.print_markdown')
+print_rest = lazy_import('cheby.print_rest')
+print_latex = lazy_import('cheby.print_latex')
+print_consts = lazy_import('cheby.print_consts')
+gen_devicetree = lazy_import('cheby.gen_devicetree')
+gen_device_script = lazy_import('cheby.gen_device_script')
+gen_header = lazy_import('cheby.gen_header')
+GENERATOR_MODULES = [m for m in globals().values() if isinstance(m, LazyModule)]
+
+# The other modules, loaded on demand.
+output = lazy_import('cheby.output')
+depfile = lazy_import('cheby.depfile')
+batch = lazy_import('cheby.batch')
+pipeline = lazy_import('cheby.pipeline')
+profiling = lazy_import('cheby.profiling')
+watch = lazy_import('cheby.watch')
+server = lazy_import('cheby.server')
+artifact_cache = lazy_import('cheby.artifact_cache')
+
+
+class UsageException(Exception):
+    """Exception raised for arguments that are incorrect for the input"""
+    def __init__(self, msg):
+        super(UsageException, self).__init__()
+        self.msg = msg
+
+    def __str__(self):
+        return self.msg
+
+
+def get_arg_parser():
+    """Return the parser of the command line arguments"""
     aparser = argparse.ArgumentParser(description='cheby utility',
                                       prog='cheby')
-    aparser.add_argument('--version', action='version',
-                         version='%(prog)s ' + cheby.__version__)
-    aparser.add_argument('--example', action='store_true',
-                         help='print a simple example (for a starting point)')
+
+    def add_run_argument(*names, **kwargs):
+        # An argument of the run, not an option of the generation (so not
+        # available in cheby.api).
+        aparser.add_argument(*names, **kwargs).run_only = True
+
+    add_run_argument('--version', action='version',
+                     version='%(prog)s ' + cheby.__version__)
+    add_run_argument('--example', action='store_true',
+                     help='print a simple example (for a starting point)')
     aparser.add_argument('--print-pretty', nargs='?', const='-',
                          help='regenerate in YAML')
     aparser.add_argument('--print-simple', nargs='?', const='-',
@@ -136,182 +210,259 @@ def decode_args():
         + "generation",
         action="store_true",
     )
-    aparser.add_argument('--input', '-i',
-                         help='input file')
+    add_run_argument('--input', '-i',
+                     help='input file')
     aparser.add_argument('--ff-reset', choices=['sync', 'async'], default='sync',
                          help='select synchronous or asynchronous reset for flip-flops')
-    aparser.add_argument('--word-endian', choices=['default', 'big', 'little'], default='default',
-                         help='override the word-endianness in memmory maps')
+    add_run_argument('--word-endian', choices=['default', 'big', 'little'], default='default',
+                     help='override the word-endianness in memmory maps')
     aparser.add_argument('--address-space',
                          help='specify address space for --gen-hdl')
-    aparser.add_argument('--out-prefix', default='',
-                         help='specify path prefix for automatic output files')
+    add_run_argument('--out-prefix', default='',
+                     help='specify path prefix for automatic output files')
+    add_run_argument('--output-stats', action='store_true',
+                     help='report the number of unchanged and rewritten output files')
+    add_run_argument('--depfile',
+                     help='write a make/ninja dependency file for the outputs')
+    add_run_argument('--skip-if-up-to-date', nargs='?', const='mtime',
+                     choices=['mtime', 'hash'],
+                     help='do nothing if the outputs recorded by --depfile are up to date')
+    add_run_argument('--batch', metavar='MANIFEST',
+                     help='process all the inputs listed in MANIFEST (yaml or json)')
+    add_run_argument('--jobs', '-j', type=int, default=1,
+                     help='number of processes for --batch, or for the generators of an input')
+    add_run_argument('--profile', nargs='?', const='text', choices=['text', 'json'],
+                     help='report the time and memory used by each step on stderr')
+    add_run_argument('--profile-dump', metavar='DIR',
+                     help='with --profile, write the cProfile statistics of each step in DIR')
+    add_run_argument('--watch', action='store_true',
+                     help='regenerate the outputs when the input or its submaps change')
+    add_run_argument('--serve', metavar='SOCKET',
+                     help='serve generation requests on the unix socket SOCKET')
+    add_run_argument('--cache-dir', metavar='DIR',
+                     help='reuse the outputs of previous runs stored in DIR')
+    add_run_argument('--cache-max-size', metavar='MB', type=int, default=500,
+                     help='maximum size of the cache in MB (default: 500)')
+
+    return aparser
+
 
-    args = aparser.parse_args()
-    cheby.hdl.globals.gconfig.hdl_lang = args.hdl
-    cheby.hdl.globals.gconfig.rst_sync = (args.ff_reset != 'async')
-    layout.word_endianness = args.word_endian
+def decode_args(argv=None):
+    """Parse ARGV (by default the command line arguments)"""
+    aparser = get_arg_parser()
+    args = aparser.parse_args(argv)
+    args.argv = sys.argv[1:] if argv is None else argv
+    if args.skip_if_up_to_date is not None and args.depfile is None:
+        aparser.error('--skip-if-up-to-date requires --depfile')
+    if args.profile_dump is not None and args.profile is None:
+        aparser.error('--profile-dump requires --profile')
+    args.options = Options(hdl_lang=args.hdl,
+                           rst_sync=(args.ff_reset != 'async'),
+                           word_endian=args.word_endian)
+    if args.profile is not None:
+        args.options.profiler = profiling.Profiler(args.profile_dump)
 
     return args
 
-def print_hdl(out, lang, h):
+
+def print_hdl(out, lang, h, options=None):
     if lang == 'vhdl':
-        print_vhdl.print_vhdl(out, h)
+        print_vhdl.print_vhdl(out, h, options)
     elif lang == 'verilog' or lang == 'sv':
-        print_verilog.print_verilog(out, h)
+        print_verilog.print_verilog(out, h, options)
     else:
         raise AssertionError('unknown hdl language {}'.format(lang))
 
 
-class open_filename(object):
-    """Handle '-' as stdout, but wrap the file in a class so that it is not
-     closed at the exit of the 'with' statement."""
+def open_filename(name):
+    """Kept for user scripts: see output.open_output"""
+    return output.open_output(name)
 
-    def __init__(self, name):
-        self.name = name
-        self.fh = None
 
-    def __enter__(self):
-        if self.name == '-':
-            self.fh = sys.stdout
-        else:
-            self.fh = open(self.name, 'w')
-        return self.fh
-
-    def __exit__(self, etype, value, traceback):
-        if self.name != '-':
-            self.fh.close()
-
-    def __getattr__(self, val):
-        return getattr(self.fh, val)  # pass on
-
-def handle_file(args, filename):
-    t = cheby.parser.parse_yaml(filename)
-
-    layout.layout_cheby(t)
-
-    if args.print_pretty is not None:
-        with open_filename(args.print_pretty) as f:
-            pprint.pprint_cheby(f, t)
-    if args.print_memmap is not None:
-        with open_filename(args.print_memmap) as f:
-            sprint.sprint_cheby(f, t, False)
-    if args.print_simple is not None:
-        with open_filename(args.print_simple) as f:
-            sprint.sprint_cheby(f, t, True)
-    if args.gen_gena_memmap is not None:
-        with open_filename(args.gen_gena_memmap) as f:
-            h = gen_gena_memmap.gen_gena_memmap(t)
-            gen_header.gen_comment_header_maybe(f, args.header, args.hdl)
-            print_vhdl.print_vhdl(f, h)
-    if args.gen_silecs is not None:
-        with open_filename(args.gen_silecs) as f:
-            gen_silecs.generate_silecs(f, t)
-    if args.gen_custom is not None:
-        with open_filename(args.gen_custom) as f:
-            gen_custom.generate_custom(f, t, args.custom)
-    if args.gen_devicetree is not None:
-        with open_filename(args.gen_devicetree) as f:
-            gen_devicetree.generate_devicetree(f, t)
-    if args.gen_install_script is not None:
-        with open_filename(args.gen_install_script) as f:
-            gen_device_script.generate_device_script(f, t)
-    if args.gen_edge is not None:
-        with open_filename(args.gen_edge) as f:
-            gen_edge.generate_edge(f, t)
-    if args.gen_edge3 is not None:
-        with open_filename(args.gen_edge3) as f:
-            gen_edge3.generate_edge3(f, t)
+def stage_parse(args, _t):
+    return parser.parse_yaml(args.input, args.options.document_cache)
 
+
+def stage_layout(args, t):
+    layout.layout_cheby(t, args.options)
+    return t
+
+
+def stage_gena_memmap(_args, t):
+    gen_gena_memmap.gen_gena_memmap(t)
+    return t
+
+
+def stage_names(_args, t):
     # Generate names for C code (but do not expand)
     gen_name.gen_name_memmap(t)
+    return t
 
-    if args.print_memmap_verbose is not None:
-        with open_filename(args.print_memmap_verbose) as f:
-            sprint.sprint_cheby(f, t, False, True)
-    if args.gen_c is not None:
-        with open_filename(args.gen_c) as f:
-            gen_c.gen_c_cheby(f, t, args.c_style)
-    if args.gen_c_check_layout is not None:
-        with open_filename(args.gen_c_check_layout) as f:
-            gen_laychk.gen_chklayout_cheby(f, t)
 
+def stage_expand(_args, t):
     # Decode x-hdl, unroll
     expand_hdl.expand_hdl(t)
     # Regenerate names and sorted children after unrolling.
     gen_name.gen_name_memmap(t)
     layout.sort_tree(t)
+    return t
 
-    if args.print_simple_expanded is not None:
-        with open_filename(args.print_simple_expanded) as f:
-            sprint.sprint_cheby(f, t, True)
-    if args.print_pretty_expanded is not None:
-        with open_filename(args.print_pretty_expanded) as f:
-            pprint.pprint_cheby(f, t)
-    if args.gen_gena_regctrl is not None:
-        if not args.gen_gena_memmap:
-            gen_gena_memmap.gen_gena_memmap(t)
-        with open_filename(args.gen_gena_regctrl) as f:
-            h = gen_gena_regctrl.gen_gena_regctrl(t, args.gena_common_visual)
-            gen_header.gen_comment_header_maybe(f, args.header, args.hdl)
-            print_vhdl.print_vhdl(f, h)
-    if args.gen_gena_dsp_map is not None:
-        with open_filename(args.gen_gena_dsp_map) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, 'h')
-            gen_gena_dsp.gen_gena_dsp_map(f, t)
-    if args.gen_gena_dsp_h is not None:
-        with open_filename(args.gen_gena_dsp_h) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, 'h')
-            gen_gena_dsp.gen_gena_dsp_h(f, t)
-    if args.gen_gena_dsp_c is not None:
-        with open_filename(args.gen_gena_dsp_c) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, 'h')
-            gen_gena_dsp.gen_gena_dsp_c(f, t)
-    if args.gen_gena_dsp:
-        os.makedirs("DSP/include", exist_ok=True)
-        with open_filename("DSP/include/MemMapDSP_{}.h".format(t.name)) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, 'h')
-            gen_gena_dsp.gen_gena_dsp_map(f, t)
-        with open_filename("DSP/include/vmeacc_{}.h".format(t.name)) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, 'h')
-            gen_gena_dsp.gen_gena_dsp_h(f, t, 'h')
-        with open_filename("DSP/vmeacc_{}.c".format(t.name)) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, 'h')
-            gen_gena_dsp.gen_gena_dsp_c(f, t)
-    if args.gen_doc is not None:
-        with open_filename(args.gen_doc) as f:
-            if args.doc == 'html':
-                print_html.pprint(f, t, args.doc_include_js_dep)
-            elif args.doc == 'md':
-                print_markdown.print_markdown(f, t)
-            elif args.doc == 'rest':
-                print_rest.print_rest(f, t, args.rest_headers)
-            elif args.doc == 'latex':
-                print_latex.print_latex(f, t, not args.doc_no_reg_drawing)
-            else:
-                raise AssertionError('unknown doc format {}'.format(args.doc))
-    if args.doc_copy_template is not None:
-        # Copy template to filename specified as argument
-        with open_filename(args.doc_copy_template) as f:
-            if args.doc == 'latex':
-                print_latex.copy_template(f)
-            else:
-                raise AssertionError('Unknown doc format {} for template copying.'.format(args.doc))
-
-    if args.gen_consts is not None:
-        with open_filename(args.gen_consts) as f:
-            gen_header.gen_comment_header_maybe(f, args.header, args.consts_style)
-            print_consts.pconsts_cheby(f, t, args.consts_style)
-
-    if args.gen_wbgen_hdl is not None:
-        h = gen_wbgen_hdl.expand_hdl(t)
-        with open_filename(args.gen_wbgen_hdl) as f:
-            if args.header != 'none':
-                (basename, _) = os.path.splitext(os.path.basename(filename))
-                c = {'vhdl': '--', 'verilog': '//', 'sv': '//'}[args.hdl]
-                l = c[0] * 79
-                ext = {'vhdl': 'vhdl', 'verilog': 'v', 'sv': 'sv'}[args.hdl]
-                header = """{l}
+
+def gen_print_pretty(args, t, outputs):
+    with outputs.open(args.print_pretty) as f:
+        pprint.pprint_cheby(f, t)
+
+
+def gen_print_memmap(args, t, outputs):
+    with outputs.open(args.print_memmap) as f:
+        sprint.sprint_cheby(f, t, False)
+
+
+def gen_print_simple(args, t, outputs):
+    with outputs.open(args.print_simple) as f:
+        sprint.sprint_cheby(f, t, True)
+
+
+def gen_gena_memmap_file(args, t, outputs):
+    with outputs.open(args.gen_gena_memmap) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, args.hdl, args.argv)
+        print_vhdl.print_vhdl(f, t.h_gena_pkg)
+
+
+def gen_silecs_file(args, t, outputs):
+    with outputs.open(args.gen_silecs) as f:
+        gen_silecs.generate_silecs(f, t)
+
+
+def gen_custom_file(args, t, outputs):
+    with outputs.open(args.gen_custom) as f:
+        gen_custom.generate_custom(f, t, args.custom)
+
+
+def gen_devicetree_file(args, t, outputs):
+    with outputs.open(args.gen_devicetree) as f:
+        gen_devicetree.generate_devicetree(f, t)
+
+
+def gen_install_script(args, t, outputs):
+    with outputs.open(args.gen_install_script) as f:
+        gen_device_script.generate_device_script(f, t)
+
+
+def gen_edge_file(args, t, outputs):
+    with outputs.open(args.gen_edge) as f:
+        gen_edge.generate_edge(f, t)
+
+
+def gen_edge3_file(args, t, outputs):
+    with outputs.open(args.gen_edge3) as f:
+        gen_edge3.generate_edge3(f, t)
+
+
+def gen_print_memmap_verbose(args, t, outputs):
+    with outputs.open(args.print_memmap_verbose) as f:
+        sprint.sprint_cheby(f, t, False, True)
+
+
+def gen_c_file(args, t, outputs):
+    with outputs.open(args.gen_c) as f:
+        gen_c.gen_c_cheby(f, t, args.c_style)
+
+
+def gen_c_check_layout(args, t, outputs):
+    with outputs.open(args.gen_c_check_layout) as f:
+        gen_laychk.gen_chklayout_cheby(f, t)
+
+
+def gen_print_simple_expanded(args, t, outputs):
+    with outputs.open(args.print_simple_expanded) as f:
+        sprint.sprint_cheby(f, t, True)
+
+
+def gen_print_pretty_expanded(args, t, outputs):
+    with outputs.open(args.print_pretty_expanded) as f:
+        pprint.pprint_cheby(f, t)
+
+
+def gen_gena_regctrl_file(args, t, outputs):
+    if not args.gen_gena_memmap:
+        gen_gena_memmap.gen_gena_memmap(t)
+    with outputs.open(args.gen_gena_regctrl) as f:
+        h = gen_gena_regctrl.gen_gena_regctrl(t, args.gena_common_visual,
+                                              args.options)
+        gen_header.gen_comment_header_maybe(f, args.header, args.hdl, args.argv)
+        print_vhdl.print_vhdl(f, h)
+
+
+def gen_gena_dsp_map(args, t, outputs):
+    with outputs.open(args.gen_gena_dsp_map) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, 'h', args.argv)
+        gen_gena_dsp.gen_gena_dsp_map(f, t)
+
+
+def gen_gena_dsp_h(args, t, outputs):
+    with outputs.open(args.gen_gena_dsp_h) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, 'h', args.argv)
+        gen_gena_dsp.gen_gena_dsp_h(f, t)
+
+
+def gen_gena_dsp_c(args, t, outputs):
+    with outputs.open(args.gen_gena_dsp_c) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, 'h', args.argv)
+        gen_gena_dsp.gen_gena_dsp_c(f, t)
+
+
+def gen_gena_dsp_files(args, t, outputs):
+    os.makedirs("DSP/include", exist_ok=True)
+    with outputs.open("DSP/include/MemMapDSP_{}.h".format(t.name)) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, 'h', args.argv)
+        gen_gena_dsp.gen_gena_dsp_map(f, t)
+    with outputs.open("DSP/include/vmeacc_{}.h".format(t.name)) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, 'h', args.argv)
+        gen_gena_dsp.gen_gena_dsp_h(f, t, 'h')
+    with outputs.open("DSP/vmeacc_{}.c".format(t.name)) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, 'h', args.argv)
+        gen_gena_dsp.gen_gena_dsp_c(f, t)
+
+
+def gen_doc_file(args, t, outputs):
+    with outputs.open(args.gen_doc) as f:
+        if args.doc == 'html':
+            print_html.pprint(f, t, args.doc_include_js_dep)
+        elif args.doc == 'md':
+            print_markdown.print_markdown(f, t)
+        elif args.doc == 'rest':
+            print_rest.print_rest(f, t, args.rest_headers)
+        elif args.doc == 'latex':
+            print_latex.print_latex(f, t, not args.doc_no_reg_drawing)
+        else:
+            raise AssertionError('unknown doc format {}'.format(args.doc))
+
+
+def gen_doc_copy_template(args, _t, outputs):
+    # Copy template to filename specified as argument
+    with outputs.open(args.doc_copy_template) as f:
+        if args.doc == 'latex':
+            print_latex.copy_template(f)
+        else:
+            raise AssertionError('Unknown doc format {} for template copying.'.format(args.doc))
+
+
+def gen_consts_file(args, t, outputs):
+    with outputs.open(args.gen_consts) as f:
+        gen_header.gen_comment_header_maybe(f, args.header, args.consts_style, args.argv)
+        print_consts.pconsts_cheby(f, t, args.consts_style)
+
+
+def gen_wbgen_hdl_file(args, t, outputs):
+    h = gen_wbgen_hdl.expand_hdl(t)
+    with outputs.open(args.gen_wbgen_hdl) as f:
+        if args.header != 'none':
+            (basename, _) = os.path.splitext(os.path.basename(args.input))
+            c = {'vhdl': '--', 'verilog': '//', 'sv': '//'}[args.hdl]
+            l = c[0] * 79
+            ext = {'vhdl': 'vhdl', 'verilog': 'v', 'sv': 'sv'}[args.hdl]
+            header = """{l}
 {c} Title          : Wishbone slave core for {name}
 {l}
 {c} File           : {basename}.{ext}
@@ -324,35 +475,102 @@ def handle_file(args, filename):
 {l}
 
 """
-                f.write(header.format(name=t.description, basename=basename,
-                                      date=time.strftime("%a %b %d %X %Y"),
-                                      c=c, l=l, ext=ext))
-            print_vhdl.style = 'wbgen'
-            print_hdl(f, args.hdl, h)
-    if args.gen_hdl is not None:
-        if not t.c_address_spaces_map:
-            if not (args.address_space is None):
-                sys.stderr.write('error: --address-space not allowed (no address space)\n')
-                sys.exit(2)
-            top = t
-        else:
-            if args.address_space is None:
-                sys.stderr.write('error: --address-space required\n')
-                sys.exit(2)
-            top = t.c_address_spaces_map.get(args.address_space)
-            if top is None:
-                sys.stderr.write('error: no address space "{}"\n'.format(args.address_space))
-                sys.exit(2)
-        h = gen_hdl.generate_hdl(top)
+            f.write(header.format(name=t.description, basename=basename,
+                                  date=time.strftime("%a %b %d %X %Y"),
+                                  c=c, l=l, ext=ext))
+        print_hdl(f, args.hdl, h,
+                  args.options.replace(vhdl_style='wbgen'))
+
+
+def get_hdl_top(args, t):
+    """Return the tree for --gen-hdl: T, or its address space selected by
+    --address-space"""
+    if not t.c_address_spaces_map:
+        if not (args.address_space is None):
+            raise UsageException('--address-space not allowed (no address space)')
+        return t
+    if args.address_space is None:
+        raise UsageException('--address-space required')
+    top = t.c_address_spaces_map.get(args.address_space)
+    if top is None:
+        raise UsageException('no address space "{}"'.format(args.address_space))
+    return top
+
+
+def gen_hdl_file(args, t, outputs):
+    top = get_hdl_top(args, t)
+    profiler = args.options.profiler
+    with profiling.section(profiler, 'generate_hdl'):
+        h = gen_hdl.generate_hdl(top, args.options)
+    with profiling.section(profiler, 'print'):
         if args.gen_hdl == '+units':
             if args.hdl == 'verilog' or args.hdl == 'sv':
-                print_verilog.print_verilog_per_units(h, args.out_prefix)
+                print_verilog.print_verilog_per_units(h, args.out_prefix,
+                                                     outputs=outputs,
+                                                     options=args.options)
             else:
                 raise AssertionError('unhandled language {}'.format(args.hdl))
         else:
-            with open_filename(args.gen_hdl) as f:
-                gen_header.gen_comment_header_maybe_version(f, args.header, args.hdl, t.version)
-                print_hdl(f, args.hdl, h)
+            with outputs.open(args.gen_hdl) as f:
+                gen_header.gen_comment_header_maybe_version(f, args.header, args.hdl, t.version, args.argv)
+                print_hdl(f, args.hdl, h, args.options)
+
+
+def get_stages():
+    """The passes on the tree, in execution order"""
+    return [
+        pipeline.Stage('parse', [], stage_parse),
+        pipeline.Stage('layout', ['parse'], stage_layout),
+        pipeline.Stage('gena-memmap', ['layout'], stage_gena_memmap),
+        pipeline.Stage('names', ['layout'], stage_names),
+        pipeline.Stage('expand', ['names'], stage_expand),
+    ]
+
+
+def get_generators():
+    """The generators, in output order.  The name of a generator is the name
+    of its argument"""
+    return [
+        pipeline.Generator('print_pretty', 'layout', gen_print_pretty),
+        pipeline.Generator('print_memmap', 'layout', gen_print_memmap),
+        pipeline.Generator('print_simple', 'layout', gen_print_simple),
+        pipeline.Generator('gen_gena_memmap', 'gena-memmap', gen_gena_memmap_file),
+        pipeline.Generator('gen_silecs', 'layout', gen_silecs_file),
+        pipeline.Generator('gen_custom', 'layout', gen_custom_file),
+        pipeline.Generator('gen_devicetree', 'layout', gen_devicetree_file),
+        pipeline.Generator('gen_install_script', 'layout', gen_install_script),
+        pipeline.Generator('gen_edge', 'layout', gen_edge_file),
+        pipeline.Generator('gen_edge3', 'layout', gen_edge3_file),
+        pipeline.Generator('print_memmap_verbose', 'names', gen_print_memmap_verbose),
+        pipeline.Generator('gen_c', 'names', gen_c_file),
+        pipeline.Generator('gen_c_check_layout', 'names', gen_c_check_layout),
+        pipeline.Generator('print_simple_expanded', 'expand', gen_print_simple_expanded),
+        pipeline.Generator('print_pretty_expanded', 'expand', gen_print_pretty_expanded),
+        pipeline.Generator('gen_gena_regctrl', 'expand', gen_gena_regctrl_file),
+        pipeline.Generator('gen_gena_dsp_map', 'expand', gen_gena_dsp_map),
+        pipeline.Generator('gen_gena_dsp_h', 'expand', gen_gena_dsp_h),
+        pipeline.Generator('gen_gena_dsp_c', 'expand', gen_gena_dsp_c),
+        pipeline.Generator('gen_gena_dsp', 'expand', gen_gena_dsp_files,
+                           lambda args: args.gen_gena_dsp),
+        pipeline.Generator('gen_doc', 'expand', gen_doc_file),
+        pipeline.Generator('doc_copy_template', 'expand', gen_doc_copy_template),
+        pipeline.Generator('gen_consts', 'expand', gen_consts_file),
+        pipeline.Generator('gen_wbgen_hdl', 'expand', gen_wbgen_hdl_file),
+        pipeline.Generator('gen_hdl', 'expand', gen_hdl_file),
+    ]
+
+
+def handle_file(args, filename, outputs=None):
+    """Generate the requested outputs for FILENAME.  Only the stages
+    needed by these outputs are run.  Return the (laid out) tree"""
+    if outputs is None:
+        outputs = output.OutputSet()
+    if filename != args.input:
+        args = copy.copy(args)
+        args.input = filename
+    # A run without outputs still checks the input.
+    return pipeline.run(get_stages(), get_generators(), args, outputs,
+                        ['layout'], args.jobs)
 
 
 def print_example():
@@ -373,24 +591,90 @@ def print_example():
               range: 1
 """)
 
+
+def run(args):
+    """Generate the outputs for the decoded arguments ARGS.
+    Return the OutputSet of the run, or None if it was skipped because the
+    outputs are up to date.  With --cache-dir, the outputs are copied from
+    the cache when possible."""
+    if args.skip_if_up_to_date is not None \
+       and depfile.is_up_to_date(args.depfile, args.argv, args.skip_if_up_to_date):
+        return None
+    cache = None
+    if args.cache_dir is not None:
+        cache = artifact_cache.ArtifactCache(args.cache_dir,
+                                             args.cache_max_size << 20)
+        entry = cache.lookup(args)
+        if entry is not None:
+            outputs = output.OutputSet()
+            if cache.restore(entry, outputs):
+                outputs.cached = True
+                if args.options.profiler is not None:
+                    args.options.profiler.cached = True
+                if args.depfile is not None:
+                    depfile.write_depfile(args.depfile, outputs.files, entry['files'],
+                                          args.argv, outputs.stdout)
+                return outputs
+        outputs = artifact_cache.RecordingOutputSet()
+    else:
+        outputs = output.OutputSet()
+    profiler = args.options.profiler
+    if profiler is not None:
+        profiler.start()
+        # The imports are not charged to the first stage that uses a
+        # module.
+        with profiling.section(profiler, 'import'):
+            import_generators()
+    try:
+        t = handle_file(args, args.input, outputs)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+    inputs = layout.get_input_filenames(t)
+    if args.gen_custom is not None and os.path.isfile(args.custom):
+        inputs.append(args.custom)
+    if cache is not None:
+        cache.store(args, inputs, outputs.contents)
+    if args.depfile is not None:
+        depfile.write_depfile(args.depfile, outputs.files, inputs,
+                              args.argv, outputs.stdout)
+    return outputs
+
+
 def main():
     args = decode_args()
     if args.example:
         print_example()
         sys.exit(0)
+    if args.batch is not None:
+        sys.exit(batch.run_batch(args.batch, args.jobs))
+    if args.serve is not None:
+        sys.exit(server.run_server(args.serve))
 
     f = args.input
     if f is None:
         sys.stderr.write('error: argument --input/-i is required\n')
         sys.exit(2)
+    if args.watch:
+        sys.exit(watch.run_watch(args))
     try:
-        handle_file(args, f)
-    except cheby.parser.ParseException as e:
+        outputs = run(args)
+    except parser.ParseException as e:
         sys.stderr.write("{}:{}\n".format(f, e))
         sys.exit(2)
     except layout.LayoutException as e:
         sys.stderr.write(str(e) + '\n')
         sys.exit(2)
+    except UsageException as e:
+        sys.stderr.write('error: {}\n'.format(e))
+        sys.exit(2)
+    if args.profile is not None and outputs is not None:
+        args.options.profiler.report(sys.stderr, args.profile)
+    if args.output_stats:
+        if outputs is None:
+            sys.stderr.write('cheby: outputs are up to date\n')
+        else:
+            sys.stderr.write('cheby: {}\n'.format(outputs.summary()))
 
 
 if __name__ == '__main__':
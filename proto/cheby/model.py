@@ -0,0 +1,343 @@
+"""Behavioural model of the registers generated by gen_hdl, in memory.
+
+A Model is built from a laid out tree and is a UAL object (readl(ADDR),
+writel(ADDR, VAL)..., for the word size of the bus), so it can be used
+with cheby.ual or cheby.ual_remote to test software without hardware.  The
+model follows the access of the registers (a read-only register ignores
+the writes, a write-only register reads as 0), the presets, the constants,
+the x-hdl field types (an autoclear field reads as 0, writing 1 to an
+or-clr field clears the bit) and the word order of the bus.  Memories are
+stored in a buffer, and submaps are models too, or any UAL object attached
+to them (like another model, or a model of the IP).
+
+The hardware side is accessed through the RegModel and MemoryModel
+objects (attributes 'regs' and 'memories', by path like 'blk.chan[2].gain').
+
+The registers are flattened per word address, so that an access is just
+a dictionary lookup.  As the address spaces of a map all start at 0, a
+model is for one of them."""
+
+import bisect
+
+import cheby.parser
+import cheby.layout
+import cheby.tree as tree
+from cheby.ual import READ_METHODS, WRITE_METHODS, READ_BLOCK_METHODS, WRITE_BLOCK_METHODS
+from cheby.ual_mmap import BufferUAL
+
+
+def field_type(f):
+    """Return the x-hdl type of field F"""
+    reg = f.parent
+    res = f.get_extension('x_hdl', 'type', reg.get_extension('x_hdl', 'type'))
+    if res is not None:
+        return res
+    if reg.constant is not None:
+        return 'const'
+    return 'wire' if reg.access == 'ro' else 'reg'
+
+
+class RegModel(object):
+    """The model of a register, for the hardware side"""
+    def __init__(self, model, n, addr):
+        self.model = model
+        self.node = n
+        self.addr = addr
+        root = model.root
+        wsize = root.c_word_size
+        wbits = wsize * tree.BYTE_SIZE
+        nwords = n.c_nwords
+        # The words, as a list of (address, shift).
+        self.words = [(addr + (nwords - 1 - i if root.c_word_endian == 'big' else i) * wsize,
+                       i * wbits) for i in range(nwords)]
+        # The fields, as a dict from name to (shift, mask).
+        self.fields = {f.name: (f.lo, (1 << f.c_rwidth) - 1)
+                       for f in n.children if f.name is not None}
+        # Masks of the bits: written by the bus (and kept), cleared by
+        # writing 1, driven by the hardware.
+        self.wmask = 0
+        self.clrmask = 0
+        self.hwmask = 0
+        self.preset = 0
+        for f in n.children:
+            mask = ((1 << f.c_rwidth) - 1) << f.lo
+            typ = field_type(f)
+            if n.access == 'ro' or typ == 'wire':
+                self.hwmask |= mask
+            elif typ in ('reg', 'no-port'):
+                self.wmask |= mask
+            elif typ in ('or-clr', 'or-clr-out'):
+                self.hwmask |= mask
+                self.clrmask |= mask
+            if f.c_preset is not None:
+                self.preset |= f.c_preset << f.lo
+        if n.access == 'wo':
+            # Not readable.
+            self.wmask = 0
+            self.clrmask = 0
+            self.hwmask = 0
+        # Called with this object after a write to a word of the register.
+        self.callbacks = []
+
+    def split(self, val):
+        """Return VAL split in words, as a list of (address, word)"""
+        wmask = (1 << (self.model.word_size * tree.BYTE_SIZE)) - 1
+        return [(addr, (val >> shift) & wmask) for addr, shift in self.words]
+
+    def get_words(self, words):
+        res = 0
+        for addr, shift in self.words:
+            res |= words.get(addr, 0) << shift
+        return res
+
+    @property
+    def value(self):
+        """The value of the register (as read by the bus, or the last value
+        written for a write-only register)"""
+        if self.node.access == 'wo':
+            return self.written
+        return self.get_words(self.model.rvals)
+
+    @property
+    def written(self):
+        """The last value written by the bus (the preset if none)"""
+        return self.get_words(self.model.wvals)
+
+    def set(self, val):
+        """Drive the bits of the register that are inputs of the hardware
+        (read-only fields, wire fields), and set the bits of the or-clr
+        fields"""
+        rvals = self.model.rvals
+        for (addr, shift), (_, w) in zip(self.words, self.split(val)):
+            hw = (self.hwmask >> shift) & ~(self.clrmask >> shift)
+            clr = self.clrmask >> shift
+            rvals[addr] = (rvals[addr] & ~hw) | (w & hw) | (w & clr)
+
+    def get_field(self, name):
+        shift, mask = self.fields[name]
+        return (self.value >> shift) & mask
+
+    def set_field(self, name, val):
+        """Drive field NAME (see set())"""
+        shift, mask = self.fields[name]
+        self.set((self.value & ~(mask << shift)) | ((val & mask) << shift))
+
+    def on_write(self, callback):
+        """Call CALLBACK with this object after each write to the register
+        (to model the behaviour of the hardware)"""
+        self.callbacks.append(callback)
+        for addr, _ in self.words:
+            self.model.hooks[addr] = self
+
+    def reset(self):
+        rvals = self.model.rvals
+        for addr, w in self.split(self.preset):
+            rvals[addr] = w if self.node.access != 'wo' else 0
+            self.model.wvals[addr] = w
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self.node.name, self.addr)
+
+
+class MemoryModel(object):
+    """The model of a memory.  The content is in 'data' (a BufferUAL,
+    relative to the memory), also for the hardware side"""
+    def __init__(self, model, n, addr):
+        self.node = n
+        self.addr = addr
+        self.word_size = model.word_size
+        self.data = BufferUAL(bytearray(n.c_size))
+        self.read_word = getattr(self.data, READ_METHODS[self.word_size])
+        self.write_word = getattr(self.data, WRITE_METHODS[self.word_size])
+        # An element smaller than a word uses a word.
+        self.stride = n.c_size // n.c_depth
+        # Access of each word of an element, from the bus.
+        self.readable = [False] * (self.stride // self.word_size)
+        self.writable = [False] * (self.stride // self.word_size)
+        for r in n.children:
+            for i in range(r.c_nwords):
+                w = r.c_address // self.word_size + i
+                self.readable[w] = r.access != 'wo'
+                self.writable[w] = r.access != 'ro'
+
+    def read(self, addr):
+        if self.readable[(addr % self.stride) // self.word_size]:
+            return self.read_word(addr)
+        return 0
+
+    def write(self, addr, val):
+        if self.writable[(addr % self.stride) // self.word_size]:
+            self.write_word(addr, val)
+
+    def reset(self):
+        self.data.whole[:] = bytes(len(self.data.whole))
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self.node.name, self.addr)
+
+
+class Model(object):
+    """The model of the registers of ROOT (laid out), or of its address
+    space SPACE (required if ROOT has address spaces).  An access to an
+    address without register reads 0 and is ignored, or raises ValueError
+    if STRICT"""
+    def __init__(self, root, strict=False, space=None):
+        self.root = root
+        self.strict = strict
+        self.word_size = root.c_word_size
+        # Value read by the bus and last value written by the bus, per word
+        # address.
+        self.rvals = {}
+        self.wvals = {}
+        # Bits written, kept and cleared by a write, per word address.
+        self.wspecs = {}
+        # The registers with callbacks, per word address.
+        self.hooks = {}
+        self.regs = {}
+        self.memories = {}
+        # The submaps (with their model, None for a bus) by path, and the
+        # address ranges of the memories and of the submaps, as (address,
+        # end, object, read, write), sorted.
+        self.submaps = {}
+        self.submap_nodes = {}
+        self.ranges = []
+        self.bases = []
+        if not root.c_address_spaces_map:
+            if space is not None:
+                raise ValueError('{} has no address spaces'.format(root.name))
+            self.build(root.children, 0, '')
+        elif space is None:
+            raise ValueError('{} has address spaces ({}), select one with space='.format(
+                root.name, ', '.join(root.c_address_spaces_map)))
+        elif space not in root.c_address_spaces_map:
+            raise ValueError('no address space {} in {}'.format(space, root.name))
+        else:
+            self.build(root.c_address_spaces_map[space].children, 0, '')
+        self.reset()
+        # The UAL methods for the word size of the bus.
+        wsize = self.word_size
+        setattr(self, READ_METHODS[wsize], self.read)
+        setattr(self, WRITE_METHODS[wsize], self.write)
+        setattr(self, READ_BLOCK_METHODS[wsize], self.read_block)
+        setattr(self, WRITE_BLOCK_METHODS[wsize], self.write_block)
+
+    def build(self, children, base, prefix):
+        for n in children:
+            addr = base + n.c_address
+            path = prefix + n.name
+            if isinstance(n, tree.Reg):
+                r = RegModel(self, n, addr)
+                self.regs[path] = r
+                wmask = (1 << (self.word_size * tree.BYTE_SIZE)) - 1
+                for a, shift in r.words:
+                    wr = (r.wmask >> shift) & wmask
+                    clr = (r.clrmask >> shift) & wmask
+                    # Bits kept by a write.
+                    keep = wmask & ~wr
+                    self.wspecs[a] = (keep, wr, clr)
+            elif isinstance(n, tree.Repeat):
+                for i in range(n.count):
+                    self.build(n.children, addr + i * n.c_elsize, '{}[{}].'.format(path, i))
+            elif isinstance(n, tree.Memory):
+                m = MemoryModel(self, n, addr)
+                self.memories[path] = m
+                self.ranges.append((addr, addr + n.c_size, m, m.read, m.write))
+                self.ranges.sort(key=lambda r: r[0])
+                self.bases = [r[0] for r in self.ranges]
+            elif isinstance(n, tree.Submap):
+                self.submaps[path] = None
+                self.submap_nodes[path] = (n, addr)
+                if n.filename is not None:
+                    self.attach(path, Model(n.c_submap, self.strict))
+            elif isinstance(n, tree.Block):
+                self.build(n.children, addr, path + '.')
+            else:
+                raise AssertionError(n)
+
+    def attach(self, path, ual):
+        """Use UAL (any UAL object, like a Model) for the submap PATH, with
+        addresses relative to the submap.  UAL is accessed with the word
+        size of the bus"""
+        if path not in self.submaps:
+            raise ValueError('no submap {}'.format(path))
+        if isinstance(ual, Model) and ual.word_size != self.word_size:
+            raise ValueError('submap {}: word size of {} bytes instead of {}'.format(
+                path, ual.word_size, self.word_size))
+        read = getattr(ual, READ_METHODS[self.word_size], None)
+        write = getattr(ual, WRITE_METHODS[self.word_size], None)
+        if read is None or write is None:
+            raise ValueError('submap {}: no {}/{} methods (for the word size of {} bytes)'.format(
+                path, READ_METHODS[self.word_size], WRITE_METHODS[self.word_size],
+                self.word_size))
+        n, addr = self.submap_nodes[path]
+        self.submaps[path] = ual
+        self.ranges = [r for r in self.ranges if r[0] != addr]
+        self.ranges.append((addr, addr + n.c_size, ual, read, write))
+        self.ranges.sort(key=lambda r: r[0])
+        self.bases = [r[0] for r in self.ranges]
+
+    def reset(self):
+        """Reset the registers and clear the memories (and the submaps that
+        are models)"""
+        for r in self.regs.values():
+            r.reset()
+        for m in self.memories.values():
+            m.reset()
+        for s in self.submaps.values():
+            if isinstance(s, Model):
+                s.reset()
+
+    def find_range(self, addr):
+        i = bisect.bisect_right(self.bases, addr) - 1
+        if i >= 0:
+            r = self.ranges[i]
+            if addr < r[1] and r[2] is not None:
+                return r
+        if self.strict:
+            raise ValueError('no register at 0x{:x}'.format(addr))
+        return None
+
+    def read(self, addr):
+        try:
+            return self.rvals[addr]
+        except KeyError:
+            pass
+        r = self.find_range(addr)
+        return 0 if r is None else r[3](addr - r[0])
+
+    def write(self, addr, val):
+        spec = self.wspecs.get(addr)
+        if spec is None:
+            r = self.find_range(addr)
+            if r is not None:
+                r[4](addr - r[0], val)
+            return
+        keep, wr, clr = spec
+        rvals = self.rvals
+        if clr:
+            rvals[addr] = (rvals[addr] & keep & ~(val & clr)) | (val & wr)
+        else:
+            rvals[addr] = (rvals[addr] & keep) | (val & wr)
+        self.wvals[addr] = val
+        if addr in self.hooks:
+            reg = self.hooks[addr]
+            for cb in reg.callbacks:
+                cb(reg)
+
+    def read_block(self, addr, count):
+        read = self.read
+        wsize = self.word_size
+        return [read(addr + i * wsize) for i in range(count)]
+
+    def write_block(self, addr, words):
+        write = self.write
+        wsize = self.word_size
+        for i, w in enumerate(words):
+            write(addr + i * wsize, w)
+
+
+def create_model(filename, strict=False, space=None):
+    root = cheby.parser.parse_yaml(filename)
+    cheby.layout.layout_cheby(root)
+
+    return Model(root, strict, space)
@@ -0,0 +1,45 @@
+"""Options of a generation.
+
+The options are given explicitly to the layout, to the HDL generator and
+to the HDL printers (there is no module variable), so that generations
+with different options can run in the same process, even concurrently in
+several threads."""
+
+import copy
+
+
+class Options(object):
+    def __init__(self, hdl_lang=None, rst_sync=True, word_endian='default',
+                 vhdl_style=None, document_cache=None, profiler=None,
+                 submap_cache=None):
+        # HDL language to generate for ('vhdl', 'verilog' or 'sv').
+        # Used to distinguish between Verilog and SystemVerilog.
+        self.hdl_lang = hdl_lang
+
+        # Used by all HDLSync processes.
+        # When true, the flip-flop reset is synchronous.
+        self.rst_sync = rst_sync
+
+        # Override the word endianness of the buses ('default' to keep it).
+        self.word_endian = word_endian
+
+        # VHDL printing style: None, or 'wbgen' to be compatible with wbgen.
+        self.vhdl_style = vhdl_style
+
+        # If set, a parser.DocumentCache used to read the files.
+        self.document_cache = document_cache
+
+        # If set, a profiling.Profiler measuring the steps of the generation.
+        self.profiler = profiler
+
+        # If set, a layout.SubmapCache used to load the submaps.
+        self.submap_cache = submap_cache
+
+    def replace(self, **kwargs):
+        """Return a copy of the options, with KWARGS changed"""
+        res = copy.copy(self)
+        for k, v in kwargs.items():
+            if not hasattr(res, k):
+                raise AttributeError("unknown option '{}'".format(k))
+            setattr(res, k, v)
+        return res
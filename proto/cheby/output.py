@@ -0,0 +1,169 @@
+"""Output layer for the generators.
+
+A generated file is first written to memory.  When it is complete, its
+content is compared with the existing file (if any), and the file is
+replaced atomically only when the content has changed.  This keeps the
+modification time of unchanged outputs, so that build tools don't rebuild
+what depends on them."""
+
+import hashlib
+import io
+import locale
+import os
+import sys
+
+
+def content_digest(data):
+    """Return the sha256 digest of DATA (bytes)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(filename):
+    """Return the sha256 digest of file FILENAME, or None if the file cannot
+    be read."""
+    h = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def encode_text(content):
+    """Convert CONTENT to the bytes that a text-mode 'w' file would write."""
+    if os.linesep != '\n':
+        content = content.replace('\n', os.linesep)
+    return content.encode(locale.getpreferredencoding(False))
+
+
+def _create_temp(dirname):
+    """Create a new temporary file in DIRNAME, with the default mode (0666
+    less the umask, applied by the system).  Return its descriptor and its
+    name"""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    while True:
+        name = os.path.join(dirname, '.{}.tmp'.format(os.urandom(8).hex()))
+        try:
+            return os.open(name, flags, 0o666), name
+        except FileExistsError:
+            pass
+
+
+def write_file(filename, data):
+    """Atomically replace FILENAME with DATA (bytes).  The mode of an
+    existing file is kept."""
+    dirname = os.path.dirname(filename) or '.'
+    fd, tmpname = _create_temp(dirname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        try:
+            mode = os.stat(filename).st_mode & 0o7777
+        except OSError:
+            # A new file, keep the default mode.
+            mode = None
+        if mode is not None:
+            os.chmod(tmpname, mode)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def write_if_changed(filename, data):
+    """Write DATA (bytes) to FILENAME unless the file already has this
+    content.  The file is replaced atomically.
+    Return True if the file was (re)written."""
+    if os.path.isfile(filename) \
+       and os.path.getsize(filename) == len(data) \
+       and file_digest(filename) == content_digest(data):
+        return False
+    write_file(filename, data)
+    return True
+
+
+class OutputSet(object):
+    """The files generated by a run, with the number of files that were
+    kept unchanged and of files that were rewritten."""
+
+    # If false, output '-' is directly written to stdout.
+    buffer_stdout = False
+
+    def __init__(self):
+        self.unchanged = []
+        self.rewritten = []
+        # All the files, in generation order.
+        self.files = []
+        # True if an output was sent to stdout.
+        self.stdout = False
+        # True if the outputs were copied from the artifact cache.
+        self.cached = False
+
+    def open(self, name):
+        return open_output(name, self)
+
+    def commit(self, name, content):
+        """Write CONTENT (a string) to file NAME."""
+        self.files.append(name)
+        if write_if_changed(name, encode_text(content)):
+            self.rewritten.append(name)
+        else:
+            self.unchanged.append(name)
+
+    def summary(self):
+        return "{} unchanged, {} rewritten{}".format(
+            len(self.unchanged), len(self.rewritten),
+            " (from cache)" if self.cached else "")
+
+
+class BufferedOutputSet(OutputSet):
+    """Keep the outputs (including stdout) in memory.  Used by the worker
+    processes, which send the list of (name, content) to the main process."""
+
+    # Output '-' is also buffered.
+    buffer_stdout = True
+
+    def __init__(self):
+        super(BufferedOutputSet, self).__init__()
+        self.contents = []
+
+    def commit(self, name, content):
+        self.contents.append((name, content))
+
+
+def replay(outputs, contents):
+    """Write CONTENTS (from a BufferedOutputSet) to OUTPUTS"""
+    for name, content in contents:
+        if name == '-':
+            outputs.stdout = True
+            sys.stdout.write(content)
+        else:
+            outputs.commit(name, content)
+
+
+class open_output(object):
+    """Handle '-' as stdout.  Otherwise return a memory buffer, which is
+    written to the file at the exit of the 'with' statement (but only if
+    its content has changed, and not if an exception was raised)."""
+
+    def __init__(self, name, outputs=None):
+        self.name = name
+        self.outputs = outputs if outputs is not None else OutputSet()
+        self.fh = None
+
+    def __enter__(self):
+        if self.name == '-' and not self.outputs.buffer_stdout:
+            self.outputs.stdout = True
+            self.fh = sys.stdout
+        else:
+            self.fh = io.StringIO()
+        return self.fh
+
+    def __exit__(self, etype, value, traceback):
+        if self.fh is not sys.stdout and etype is None:
+            self.outputs.commit(self.name, self.fh.getvalue())
+
+    def __getattr__(self, val):
+        return getattr(self.fh, val)  # pass on
@@ -1,5 +1,9 @@
 # pyright: reportShadowedImports=false
+import collections
+import copy
+import os
 import sys
+import threading
 import cheby.yamlread as yamlread
 import cheby.tree as tree
 
@@ -410,14 +414,88 @@ def parse_c_header(root, el):
             error("unhandled '{}' in x-c-header {}".format(k, root.get_path()))
 
 
-def parse_yaml(filename):
+class DocumentCache(object):
+    """Cache of the yaml documents read, indexed by filename.  A document
+    is read again if its file has been modified.  Used when many maps (that
+    often share submaps) are processed by the same process.
+    With MAX_SIZE, only the MAX_SIZE most recently used documents are kept.
+    The cache can be used by several threads."""
+    def __init__(self, max_size=None):
+        self.docs = collections.OrderedDict()
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, filename):
+        st = os.stat(filename)
+        key = os.path.realpath(filename)
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self.lock:
+            ent = self.docs.get(key)
+            if ent is not None and ent[0] == stamp:
+                self.hits += 1
+                self.docs.move_to_end(key)
+            else:
+                self.misses += 1
+                ent = None
+        if ent is None:
+            with open(filename) as f:
+                ent = (stamp, yamlread.load(f))
+            with self.lock:
+                self.docs[key] = ent
+                if self.max_size is not None:
+                    while len(self.docs) > self.max_size:
+                        self.docs.popitem(last=False)
+        # The tree references parts of the document (like x-hdl), which
+        # may be modified by later passes.
+        return copy.deepcopy(ent[1])
+
+    def refresh(self, filename):
+        """Read FILENAME again if it has been modified.  Return False if
+        its document is known and hasn't changed (the file may have been
+        modified only in its comments or its layout)"""
+        key = os.path.realpath(filename)
+        with self.lock:
+            old = self.docs.pop(key, None)
+        try:
+            doc = self.load(filename)
+        except (IOError, yamlread.ScanException):
+            # Reported by the next parse.
+            return True
+        return old is None or old[1] != doc
+
+
+def load_document(filename, cache=None):
+    if cache is not None:
+        return cache.load(filename)
+    with open(filename) as f:
+        return yamlread.load(f)
+
+
+def parse_yaml(filename, cache=None):
+    """Parse FILENAME.  CACHE is an optional DocumentCache"""
     try:
-        el = yamlread.load(open(filename))
+        el = load_document(filename, cache)
     except IOError as e:
         raise ParseException(str(e))
     except yamlread.ScanException as e:
         raise ParseException(str(e))
+    return parse_document(el, filename)
+
+
+def parse_yaml_string(text, filename='<string>'):
+    """Parse TEXT (a yaml document).  FILENAME is used for the messages and
+    for the location of the submaps"""
+    try:
+        el = yamlread.load(text)
+    except yamlread.ScanException as e:
+        raise ParseException(str(e))
+    return parse_document(el, filename)
+
 
+def parse_document(el, filename):
+    """Parse EL, the yaml document read from FILENAME"""
     if not isinstance(el, dict):
         error("open error: {}: bad format (not yaml)".format(filename))
     if 'memory-map' not in el:
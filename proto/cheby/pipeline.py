@@ -0,0 +1,141 @@
+"""Run the passes and the generators of an input as a graph of stages.
+
+A stage transforms the tree (parse, layout, expand...) and requires other
+stages.  A generator writes some outputs from the tree once a stage has
+been run.  Only the stages required by the requested generators are run,
+in their declaration order (which must be a topological order).
+
+With several jobs, each generator runs in a worker process on a snapshot
+(pickled copy) of the tree taken just after its stage, so that the
+generators are independent and the main process can continue with the
+next stages.  The outputs are written by the main process, in the order
+of the generators (also without jobs: the outputs of a generator that is
+run before an earlier generator are kept in memory until they can be
+written).
+
+When profiling, everything is run in the main process and each stage and
+each generator is a profiling section."""
+
+import contextlib
+import copy
+import io
+import pickle
+import sys
+
+import cheby.output as output
+import cheby.profiling as profiling
+
+
+class Stage(object):
+    def __init__(self, name, requires, func):
+        self.name = name
+        # Names of the stages that must be run before this one.
+        self.requires = requires
+        # FUNC(args, t) returns the new tree (T is None for the first stage).
+        self.func = func
+
+
+class Generator(object):
+    def __init__(self, name, requires, func, enabled=None):
+        self.name = name
+        # Name of the stage after which the generator is run.
+        self.requires = requires
+        # FUNC(args, t, outputs) writes the outputs using OUTPUTS.open().
+        self.func = func
+        # ENABLED(args) is true if the generator is requested.  By default,
+        # the argument NAME is set.
+        self.enabled = enabled or (lambda args: getattr(args, name) is not None)
+
+
+def needed_stages(stages, names):
+    """Return the set of names of the stages required to run the stages
+    NAMES (including them)"""
+    by_name = {s.name: s for s in stages}
+    res = set()
+    todo = list(names)
+    while todo:
+        name = todo.pop()
+        if name not in res:
+            res.add(name)
+            todo.extend(by_name[name].requires)
+    return res
+
+
+def run_generator(func, args, snapshot):
+    """Run a generator in a worker process.  Return the list of
+    (name, content) of its outputs and its messages on stdout and stderr,
+    or None in case of error"""
+    out = io.StringIO()
+    err = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            t = pickle.loads(snapshot)
+            outputs = output.BufferedOutputSet()
+            func(args, t, outputs)
+        return outputs.contents, out.getvalue(), err.getvalue()
+    except BaseException:
+        # The error is reported by running the generator again in the main
+        # process, like without jobs.
+        return None
+
+
+def run(stages, generators, args, outputs, always=(), jobs=1, t=None, done=()):
+    """Run the requested GENERATORS and the STAGES they need (and the stages
+    ALWAYS), and write their results to OUTPUTS.  Return the tree.
+    T is the tree once the stages DONE have already been run on it"""
+    gens = [g for g in generators if g.enabled(args)]
+    needed = needed_stages(stages, [g.requires for g in gens] + list(always))
+    profiler = args.options.profiler
+    pool = None
+    if jobs > 1 and len(gens) > 1 and profiler is None:
+        # Slow to import, so only when used.
+        import concurrent.futures
+        pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(jobs, len(gens)))
+        # The caches are not useful in the workers.
+        wargs = copy.copy(args)
+        wargs.options = args.options.replace(document_cache=None, submap_cache=None)
+    pending = []
+    # Without jobs, the outputs of the generators run out of order (by
+    # index), and the index of the next generator to write.
+    early = {}
+    nxt = 0
+    try:
+        for s in stages:
+            if s.name not in needed:
+                continue
+            if s.name not in done:
+                with profiling.section(profiler, s.name):
+                    t = s.func(args, t)
+            ready = [(i, g) for i, g in enumerate(gens) if g.requires == s.name]
+            if pool is None:
+                for i, g in ready:
+                    with profiling.section(profiler, g.name):
+                        if i == nxt:
+                            g.func(args, t, outputs)
+                            nxt += 1
+                        else:
+                            early[i] = output.BufferedOutputSet()
+                            g.func(args, t, early[i])
+                    while nxt in early:
+                        output.replay(outputs, early.pop(nxt).contents)
+                        nxt += 1
+            elif ready:
+                snapshot = pickle.dumps(t, pickle.HIGHEST_PROTOCOL)
+                for i, g in ready:
+                    fut = pool.submit(run_generator, g.func, wargs, snapshot)
+                    pending.append((i, g, fut, snapshot))
+        pending.sort(key=lambda p: p[0])
+        for _, g, fut, snapshot in pending:
+            res = fut.result()
+            if res is None:
+                g.func(args, pickle.loads(snapshot), outputs)
+            else:
+                contents, out, err = res
+                sys.stdout.write(out)
+                sys.stderr.write(err)
+                output.replay(outputs, contents)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return t
@@ -1,11 +1,10 @@
 """Generate Verilog from HDL tree"""
 
+import functools
 import cheby.hdltree as hdltree
-from cheby.wrutils import w, wln, windent
-from cheby.hdl.globals import gconfig
-
-
-style = None
+from cheby.hdlutils import EmitterTable
+from cheby.wrutils import w, wln, windent, StringList
+from cheby.output import OutputSet
 
 
 def generate_header(_fd, _module):
@@ -150,23 +149,27 @@ def generate_constant(fd, s, indent):
     wln(fd)
 
 
+def generate_comment(fd, n, indent):
+    if n.nl:
+        wln(fd)
+    if n.comment is not None:
+        windent(fd, indent)
+        wln(fd, "// {}".format(n.comment))
+
+
+decl_emitters = EmitterTable({
+    hdltree.HDLSignal: generate_signal,
+    hdltree.HDLConstant: generate_constant,
+    hdltree.HDLComponent: lambda fd, d, indent: None,
+    hdltree.HDLComponentSpec: lambda fd, d, indent: None,
+    hdltree.HDLComment: generate_comment,
+    hdltree.HDLInterface: generate_interface,
+    hdltree.HDLInterfaceArray: generate_interface_array,
+})
+
+
 def generate_decl(fd, d, indent):
-    if isinstance(d, hdltree.HDLSignal):
-        generate_signal(fd, d, indent)
-    elif isinstance(d, hdltree.HDLConstant):
-        generate_constant(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComponent):
-        pass
-    elif isinstance(d, hdltree.HDLComponentSpec):
-        pass
-    elif isinstance(d, hdltree.HDLComment):
-        generate_comment(fd, d, indent)
-    elif isinstance(d, hdltree.HDLInterface):
-        generate_interface(fd, d, indent)
-    elif isinstance(d, hdltree.HDLInterfaceArray):
-        generate_interface_array(fd, d, indent)
-    else:
-        raise AssertionError(d)
+    decl_emitters[type(d)](fd, d, indent)
 
 
 operator = {hdltree.HDLAnd: (' & ', 4),
@@ -179,6 +182,22 @@ operator = {hdltree.HDLAnd: (' & ', 4),
             hdltree.HDLLe:  (' <= ', 5)}
 
 
+@functools.lru_cache(maxsize=4096)
+def generate_hex_const(val, size):
+    assert (size > 0 and (size % 4) == 0)
+    return "{}'h{:0{}X}".format(size, val & ((1 << size) - 1), size // 4)
+
+
+@functools.lru_cache(maxsize=4096)
+def generate_bin_const(val, size):
+    if size is None:
+        # A bit.
+        return "1'b{}".format(val)
+    if size == 0:
+        return "0'b"
+    return "{}'b{:0{}b}".format(size, val & ((1 << size) - 1), size)
+
+
 def generate_concat_inner(e):
     assert isinstance(e, hdltree.HDLConcat)
     # Try to linearize nested concatenations (at least on the lhs)
@@ -190,13 +209,8 @@ def generate_concat_inner(e):
     return res
 
 
-def generate_expr(e, prio=-1):
-    if isinstance(e, hdltree.HDLObject):
-        return e.name
-    elif isinstance(e, hdltree.HDLConcat):
-        return '{' + generate_concat_inner(e) + '}'
-    elif isinstance(e, hdltree.HDLBinary):
-        opname, opprio = operator[type(e)]
+def make_binary_emitter(opname, opprio):
+    def emit(e, prio):
         res = ''.join([generate_expr(e.left, opprio),
                        opname,
                        generate_expr(e.right, opprio)])
@@ -204,66 +218,64 @@ def generate_expr(e, prio=-1):
             return "({})".format(res)
         else:
             return res
-    elif isinstance(e, hdltree.HDLUnary):
-        opname, opprio = operator[type(e)]
+    return emit
+
+
+def make_unary_emitter(opname, opprio):
+    def emit(e, prio):
         res = "{}{}".format(opname, generate_expr(e.expr, opprio))
         if opprio <= prio:
             return "({})".format(res)
         else:
             return res
-    elif isinstance(e, hdltree.HDLParen):
-        return "({})".format(generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLReplicate):
-        if e.expr == hdltree.bit_0:
-            return "{}'b0".format(e.num)
-        return "{{{}{{{}}}}}".format(e.num, generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLZext):
-        return generate_expr(e.expr)
-    elif isinstance(e, hdltree.HDLSext):
-        return generate_expr(e.expr)
-    elif isinstance(e, hdltree.HDLBit):
-        return "1'b{}".format(e.val)
-    elif isinstance(e, hdltree.HDLUndef):
-        return "1'bx"
-    elif isinstance(e, hdltree.HDLHexConst):
-        assert (e.size > 0 and (e.size % 4) == 0)
-        res = "{}'h".format(e.size)
-        for i in range(e.size - 4, -1, -4):
-            res += '{:X}'.format((e.val >> i) & 15)
-        return res
-    elif isinstance(e, hdltree.HDLConst) or isinstance(e, hdltree.HDLBinConst):
-        if e.size is None:
-            # A bit.
-            return "1'b{}".format(e.val)
-
-        # Certainly overkill, patches welcome!
-        res = "{}'b".format(e.size)
-        for i in range(e.size - 1, -1, -1):
-            res += '1' if ((e.val >> i) & 1) == 1 else '0'
-        return res
-    elif isinstance(e, hdltree.HDLNumber):
-        return "{}".format(e.val)
-    elif isinstance(e, hdltree.HDLBool):
-        if e.val:
-            return "1'b1"
-        else:
-            return "1'b0"
-    elif isinstance(e, hdltree.HDLSlice):
-        if e.size is None:
-            return "{}[{}]".format(generate_expr(e.prefix), e.index)
-        else:
-            return "{}[{}:{}]".format(
-                generate_expr(e.prefix), e.index + e.size - 1, e.index)
-    elif isinstance(e, hdltree.HDLIndex):
-        return "{}[{}]".format(generate_expr(e.prefix), e.index)
-    elif isinstance(e, hdltree.HDLInterfaceSelect):
-        return "{}.{}".format(generate_expr(e.prefix), e.subport.name)
-    elif isinstance(e, hdltree.HDLInterfaceIndex):
+    return emit
+
+
+def generate_expr_replicate(e, _prio):
+    if e.expr == hdltree.bit_0:
+        return "{}'b0".format(e.num)
+    return "{{{}{{{}}}}}".format(e.num, generate_expr(e.expr))
+
+
+def generate_expr_slice(e, _prio):
+    if e.size is None:
         return "{}[{}]".format(generate_expr(e.prefix), e.index)
-    elif isinstance(e, hdltree.HDLInterfaceInstance):
-        return "{}".format(e.name)
     else:
-        assert False, "unhandled hdl expr {}".format(e)
+        return "{}[{}:{}]".format(
+            generate_expr(e.prefix), e.index + e.size - 1, e.index)
+
+
+expr_emitters = EmitterTable({
+    hdltree.HDLObject: lambda e, _prio: e.name,
+    hdltree.HDLConcat: lambda e, _prio: '{' + generate_concat_inner(e) + '}',
+    hdltree.HDLParen: lambda e, _prio: "({})".format(generate_expr(e.expr)),
+    hdltree.HDLReplicate: generate_expr_replicate,
+    hdltree.HDLZext: lambda e, _prio: generate_expr(e.expr),
+    hdltree.HDLSext: lambda e, _prio: generate_expr(e.expr),
+    hdltree.HDLBit: lambda e, _prio: generate_bin_const(e.val, None),
+    hdltree.HDLUndef: lambda e, _prio: "1'bx",
+    hdltree.HDLHexConst: lambda e, _prio: generate_hex_const(e.val, e.size),
+    hdltree.HDLConst: lambda e, _prio: generate_bin_const(e.val, e.size),
+    hdltree.HDLBinConst: lambda e, _prio: generate_bin_const(e.val, e.size),
+    hdltree.HDLNumber: lambda e, _prio: "{}".format(e.val),
+    hdltree.HDLBool: lambda e, _prio: "1'b1" if e.val else "1'b0",
+    hdltree.HDLSlice: generate_expr_slice,
+    hdltree.HDLIndex: lambda e, _prio: "{}[{}]".format(generate_expr(e.prefix), e.index),
+    hdltree.HDLInterfaceSelect: lambda e, _prio: "{}.{}".format(
+        generate_expr(e.prefix), e.subport.name),
+    hdltree.HDLInterfaceIndex: lambda e, _prio: "{}[{}]".format(
+        generate_expr(e.prefix), e.index),
+    hdltree.HDLInterfaceInstance: lambda e, _prio: "{}".format(e.name),
+})
+for _cls, (_opname, _opprio) in operator.items():
+    if issubclass(_cls, hdltree.HDLBinary):
+        expr_emitters[_cls] = make_binary_emitter(_opname, _opprio)
+    else:
+        expr_emitters[_cls] = make_unary_emitter(_opname, _opprio)
+
+
+def generate_expr(e, prio=-1):
+    return expr_emitters[type(e)](e, prio)
 
 
 def get_base_name(s):
@@ -308,63 +320,69 @@ def generate_seq_block(fd, stmts, is_comb, level):
         wln(fd, indent + "end")
 
 
-def generate_seq(fd, s, is_comb, level):
+def generate_seq_assign(fd, s, is_comb, level):
+    targ = generate_expr(s.target)
+    expr = generate_expr(s.expr)
+    # Use blocking '=' for combinational logic, non-blocking '<=' for sync logic
+    assign_op = ' = ' if is_comb else ' <= '
+    wln(fd, '  ' * level + targ + assign_op + expr + ';')
+
+
+def generate_seq_ifelse(fd, s, is_comb, level):
     indent = '  ' * level
-    if isinstance(s, hdltree.HDLAssign):
+    w(fd, indent)
+    while True:
+        wln(fd, "if ({})".format(generate_expr(s.cond)))
+        generate_seq_block(fd, s.then_stmts, is_comb, level + 1)
+        if s.else_stmts is None:
+            break
         w(fd, indent)
-        targ = generate_expr(s.target)
-        expr = generate_expr(s.expr)
-        # Use blocking '=' for combinational logic, non-blocking '<=' for sync logic
-        assign_op = '=' if is_comb else '<='
-        wln(fd, "{} {} {};".format(targ, assign_op, expr))
-    elif isinstance(s, hdltree.HDLIfElse):
-        w(fd, indent)
-        while True:
-            wln(fd, "if ({})".format(generate_expr(s.cond)))
-            generate_seq_block(fd, s.then_stmts, is_comb, level + 1)
-            if s.else_stmts is None:
-                break
-            w(fd, indent)
-            if len(s.else_stmts) == 1 \
-               and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
-                w(fd, "else ")
-                s = s.else_stmts[0]
-            else:
-                wln(fd, "else")
-                generate_seq_block(fd, s.else_stmts, is_comb, level + 1)
-                break
-    elif isinstance(s, hdltree.HDLSwitch):
-        w(fd, indent)
-        wln(fd, "case ({})".format(generate_expr(s.expr)))
-        for c in s.choices:
-            w(fd, indent)
-            if isinstance(c, hdltree.HDLChoiceExpr):
-                wln(fd, "{}:".format(generate_expr(c.expr)))
-            elif isinstance(c, hdltree.HDLChoiceDefault):
-                wln(fd, "default:")
-            generate_seq_block(fd, c.stmts, is_comb, level + 1)
-        wln(fd, indent + "endcase")
-    elif isinstance(s, hdltree.HDLComment):
+        if len(s.else_stmts) == 1 \
+           and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
+            w(fd, "else ")
+            s = s.else_stmts[0]
+        else:
+            wln(fd, "else")
+            generate_seq_block(fd, s.else_stmts, is_comb, level + 1)
+            break
+
+
+def generate_seq_switch(fd, s, is_comb, level):
+    indent = '  ' * level
+    w(fd, indent)
+    wln(fd, "case ({})".format(generate_expr(s.expr)))
+    for c in s.choices:
         w(fd, indent)
-        wln(fd, "// {}".format(s.comment))
-    else:
-        assert False, "unhandled hdl seq {}".format(s)
+        if isinstance(c, hdltree.HDLChoiceExpr):
+            wln(fd, "{}:".format(generate_expr(c.expr)))
+        elif isinstance(c, hdltree.HDLChoiceDefault):
+            wln(fd, "default:")
+        generate_seq_block(fd, c.stmts, is_comb, level + 1)
+    wln(fd, indent + "endcase")
 
 
-def generate_comment(fd, n, indent):
-    if n.nl:
-        wln(fd)
-    if n.comment is not None:
-        windent(fd, indent)
-        wln(fd, "// {}".format(n.comment))
+def generate_seq_comment(fd, s, _is_comb, level):
+    wln(fd, '  ' * level + "// {}".format(s.comment))
+
 
+seq_emitters = EmitterTable({
+    hdltree.HDLAssign: generate_seq_assign,
+    hdltree.HDLIfElse: generate_seq_ifelse,
+    hdltree.HDLSwitch: generate_seq_switch,
+    hdltree.HDLComment: generate_seq_comment,
+})
 
-def generate_comb(fd, s, indent=0):
+
+def generate_seq(fd, s, is_comb, level):
+    seq_emitters[type(s)](fd, s, is_comb, level)
+
+
+def generate_comb(fd, s, indent, lang):
     windent(fd, indent)
     if s.name is not None:
         w(fd, "{}: ".format(s.name))
 
-    if gconfig.hdl_lang and gconfig.hdl_lang == "sv":
+    if lang == "sv":
         # SystemVerilog
         wln(fd, "always_comb")
     else:
@@ -382,7 +400,7 @@ def generate_comb(fd, s, indent=0):
     generate_seq_block(fd, s.stmts, True, indent)
 
 
-def generate_sync(fd, s, indent=0):
+def generate_sync(fd, s, indent, lang):
     windent(fd, indent)
     if s.name is not None:
         w(fd, "{}: ".format(s.name))
@@ -396,7 +414,7 @@ def generate_sync(fd, s, indent=0):
             rst_edge = "posedge({})".format(rst_expr)
             rst_cond = "{}".format(rst_expr)
 
-    if gconfig.hdl_lang and gconfig.hdl_lang == "sv":
+    if lang == "sv":
         # SystemVerilog
         always = "always_ff"
     else:
@@ -431,56 +449,67 @@ def generate_sync(fd, s, indent=0):
     wln(fd, "end")
 
 
-def generate_stmts(fd, stmts, indent):
+def generate_stmt_assign(fd, s, indent, _lang):
+    w(fd, "  " * indent)
+    generate_assign(fd, s)
+
+
+def generate_instance(fd, s, indent, _lang):
     sindent = "  " * indent
-    gen_num = 0
-    for s in stmts:
-        if isinstance(s, hdltree.HDLComment):
-            generate_comment(fd, s, indent)
+    w(fd, sindent + "{}".format(s.module_name))
+
+    def generate_map(mapping, indent):
+        first = True
+        for p, e in mapping:
+            if first:
+                first = False
+            else:
+                wln(fd, ",")
+            w(fd, "  " * indent)
+            w(fd, "  .{}({})".format(p, generate_expr(e)))
+        wln(fd)
+    if s.params:
+        wln(fd, " #(")
+        generate_map(s.params, indent + 1)
+        wln(fd, sindent + "  )")
+    w(fd, sindent + "{}".format(s.name))
+    if s.conns:
+        wln(fd, " (")
+        generate_map(s.conns, indent + 1)
+        wln(fd, sindent + "  );")
+    wln(fd, sindent)
+
+
+def generate_genif(fd, s, indent, gen_num, lang):
+    sindent = "  " * indent
+    wln(fd, sindent + "genblock_{}: if ({}) generate".format(
+        gen_num, generate_expr(s.cond)))
+    generate_stmts(fd, s.stmts, indent + 1, lang)
+    wln(fd, sindent + "end generate genblock_{};".format(gen_num))
 
-        elif isinstance(s, hdltree.HDLAssign):
-            w(fd, sindent)
-            generate_assign(fd, s)
 
-        elif isinstance(s, hdltree.HDLComb):
-            generate_comb(fd, s, indent)
+def generate_stmt_comment(fd, s, indent, _lang):
+    generate_comment(fd, s, indent)
 
-        elif isinstance(s, hdltree.HDLSync):
-            generate_sync(fd, s, indent)
-
-        elif isinstance(s, hdltree.HDLInstance):
-            w(fd, sindent + "{}".format(s.module_name))
-
-            def generate_map(mapping, indent):
-                first = True
-                for p, e in mapping:
-                    if first:
-                        first = False
-                    else:
-                        wln(fd, ",")
-                    w(fd, "  " * indent)
-                    w(fd, "  .{}({})".format(p, generate_expr(e)))
-                wln(fd)
-            if s.params:
-                wln(fd, " #(")
-                generate_map(s.params, indent + 1)
-                wln(fd, sindent + "  )")
-            w(fd, sindent + "{}".format(s.name))
-            if s.conns:
-                wln(fd, " (")
-                generate_map(s.conns, indent + 1)
-                wln(fd, sindent + "  );")
-            wln(fd, sindent)
-
-        elif isinstance(s, hdltree.HDLGenIf):
-            wln(fd, sindent + "genblock_{}: if ({}) generate".format(
-                gen_num, generate_expr(s.cond)))
-            generate_stmts(fd, s.stmts, indent + 1)
-            wln(fd, sindent + "end generate genblock_{};".format(gen_num))
-            gen_num += 1
 
+stmt_emitters = EmitterTable({
+    hdltree.HDLComment: generate_stmt_comment,
+    hdltree.HDLAssign: generate_stmt_assign,
+    hdltree.HDLComb: generate_comb,
+    hdltree.HDLSync: generate_sync,
+    hdltree.HDLInstance: generate_instance,
+})
+
+
+def generate_stmts(fd, stmts, indent, lang=None):
+    gen_num = 0
+    for s in stmts:
+        if isinstance(s, hdltree.HDLGenIf):
+            # Generate blocks are numbered within their statement list.
+            generate_genif(fd, s, indent, gen_num, lang)
+            gen_num += 1
         else:
-            assert False, "unhandled hdl stmt {}".format(s)
+            stmt_emitters[type(s)](fd, s, indent, lang)
 
 
 def print_interface_name(fd, itf, is_master, name):
@@ -592,7 +621,7 @@ def extract_reg_module(module):
             extract_reg_seq(s.stmts)
 
 
-def print_module_declaration(fd, module):
+def print_module_declaration(fd, module, lang=None):
     generate_header(fd, module)
     wln(fd)
     wln(fd, "module {}".format(module.name))
@@ -600,27 +629,34 @@ def print_module_declaration(fd, module):
     print_inters_list(fd, module.ports, "", 1)
     for s in module.decls:
         generate_decl(fd, s, 1)
-    generate_stmts(fd, module.stmts, 1)
+    generate_stmts(fd, module.stmts, 1, lang)
     wln(fd, "endmodule")
 
 
-def print_module(fd, module):
+def print_module(fd, module, lang=None):
     extract_reg_module(module)
     if module.global_decls:
         for s in module.global_decls:
             generate_decl(fd, s, 0)
         wln(fd)
-    print_module_declaration(fd, module)
+    print_module_declaration(fd, module, lang)
 
 
-def print_verilog(fd, n):
+def print_verilog(fd, n, options=None):
+    lang = options.hdl_lang if options is not None else None
+    buf = StringList()
     if isinstance(n, hdltree.HDLModule):
-        print_module(fd, n)
+        print_module(buf, n, lang)
     else:
         raise AssertionError
+    fd.write(buf.getvalue())
 
-def print_verilog_per_units(module, prefix="", write_hdr=None):
+def print_verilog_per_units(module, prefix="", write_hdr=None, outputs=None,
+                            options=None):
     assert isinstance(module, hdltree.HDLModule)
+    lang = options.hdl_lang if options is not None else None
+    if outputs is None:
+        outputs = OutputSet()
     extract_reg_module(module)
     if module.global_decls:
         for s in module.global_decls:
@@ -628,11 +664,15 @@ def print_verilog_per_units(module, prefix="", write_hdr=None):
                 s = s.prefix
             filename = prefix + s.name + '.sv'
             print('Writing {}'.format(filename))
-            with open(filename, 'w') as fd:
-                generate_decl(fd, s, 0)
+            buf = StringList()
+            generate_decl(buf, s, 0)
+            with outputs.open(filename) as fd:
+                fd.write(buf.getvalue())
     filename = prefix + module.name + '.sv'
     print('Writing {}'.format(filename))
-    with open(filename, 'w') as fd:
-        if write_hdr is not None:
-            write_hdr(fd)
-        print_module_declaration(fd, module)
+    buf = StringList()
+    if write_hdr is not None:
+        write_hdr(buf)
+    print_module_declaration(buf, module, lang)
+    with outputs.open(filename) as fd:
+        fd.write(buf.getvalue())
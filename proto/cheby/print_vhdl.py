@@ -1,11 +1,9 @@
 """Generate VHDL from HDL tree"""
 
+import functools
 import cheby.hdltree as hdltree
-from cheby.wrutils import w, wln, windent
-import io
-
-
-style = None
+from cheby.hdlutils import EmitterTable
+from cheby.wrutils import w, wln, windent, StringList
 
 
 def generate_header(fd, module):
@@ -183,23 +181,27 @@ def generate_component_spec(fd, spec, indent):
     wln(fd, "for all : {} use entity {};".format(spec.comp.name, spec.bind))
 
 
+def generate_comment(fd, n, indent):
+    if n.nl:
+        wln(fd)
+    if n.comment is not None:
+        windent(fd, indent)
+        wln(fd, "-- {}".format(n.comment))
+
+
+decl_emitters = EmitterTable({
+    hdltree.HDLSignal: generate_signal,
+    hdltree.HDLConstant: generate_constant,
+    hdltree.HDLComponent: generate_component,
+    hdltree.HDLComponentSpec: generate_component_spec,
+    hdltree.HDLComment: generate_comment,
+    hdltree.HDLInterface: generate_interface,
+    hdltree.HDLInterfaceArray: generate_interface_array,
+})
+
+
 def generate_decl(fd, d, indent):
-    if isinstance(d, hdltree.HDLSignal):
-        generate_signal(fd, d, indent)
-    elif isinstance(d, hdltree.HDLConstant):
-        generate_constant(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComponent):
-        generate_component(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComponentSpec):
-        generate_component_spec(fd, d, indent)
-    elif isinstance(d, hdltree.HDLComment):
-        generate_comment(fd, d, indent)
-    elif isinstance(d, hdltree.HDLInterface):
-        generate_interface(fd, d, indent)
-    elif isinstance(d, hdltree.HDLInterfaceArray):
-        generate_interface_array(fd, d, indent)
-    else:
-        raise AssertionError(d)
+    decl_emitters[type(d)](fd, d, indent)
 
 
 def generate_name_interface(itf, dirn):
@@ -223,11 +225,24 @@ operator = {hdltree.HDLAnd: (' and ', 4),
             hdltree.HDLLe:  (' <= ', 5)}
 
 
-def generate_expr(e, prio=-1):
-    if isinstance(e, hdltree.HDLObject):
-        return e.name
-    elif isinstance(e, hdltree.HDLBinary):
-        opname, opprio = operator[type(e)]
+@functools.lru_cache(maxsize=4096)
+def generate_hex_const(val, size):
+    assert (size > 0 and (size % 4) == 0)
+    return 'X"{:0{}X}"'.format(val & ((1 << size) - 1), size // 4)
+
+
+@functools.lru_cache(maxsize=4096)
+def generate_bin_const(val, size):
+    if size is None:
+        # A bit.
+        return "'{}'".format(val)
+    if size == 0:
+        return '""'
+    return '"{:0{}b}"'.format(val & ((1 << size) - 1), size)
+
+
+def make_binary_emitter(opname, opprio):
+    def emit(e, prio):
         res = ''.join([generate_expr(e.left, opprio),
                        opname,
                        generate_expr(e.right, opprio)])
@@ -235,74 +250,71 @@ def generate_expr(e, prio=-1):
             return "({})".format(res)
         else:
             return res
-    elif isinstance(e, hdltree.HDLUnary):
-        opname, opprio = operator[type(e)]
+    return emit
+
+
+def make_unary_emitter(opname, opprio):
+    def emit(e, prio):
         res = "{} {}".format(opname, generate_expr(e.expr, opprio))
         if opprio <= prio:
             return "({})".format(res)
         else:
             return res
-    elif isinstance(e, hdltree.HDLParen):
-        return "({})".format(generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLReplicate):
-        if e.with_others:
-            return "(others => {})".format(generate_expr(e.expr))
-        else:
-            return "({} downto 0 => {})".format(e.num - 1,
-                                                generate_expr(e.expr))
-    elif isinstance(e, hdltree.HDLZext):
-        return "std_logic_vector(resize(unsigned({}), {}))".format(
-            generate_expr(e.expr), e.size)
-    elif isinstance(e, hdltree.HDLSext):
-        return "std_logic_vector(resize(signed({}), {}))".format(
-            generate_expr(e.expr), e.size)
-    elif isinstance(e, hdltree.HDLBit):
-        return "'{}'".format(e.val)
-    elif isinstance(e, hdltree.HDLUndef):
-        return "'X'"
-    elif isinstance(e, hdltree.HDLHexConst):
-        assert (e.size > 0 and (e.size % 4) == 0)
-        res = 'X"'
-        for i in range(e.size - 4, -1, -4):
-            res += '{:X}'.format((e.val >> i) & 15)
-        res += '"'
-        return res
-    elif isinstance(e, hdltree.HDLConst) or isinstance(e, hdltree.HDLBinConst):
-        if e.size is None:
-            # A bit.
-            return "'{}'".format(e.val)
-
-        # Certainly overkill, patches welcome!
-        res = '"'
-        for i in range(e.size - 1, -1, -1):
-            res += '1' if ((e.val >> i) & 1) == 1 else '0'
-        res += '"'
-        return res
-    elif isinstance(e, hdltree.HDLNumber):
-        return "{}".format(e.val)
-    elif isinstance(e, hdltree.HDLBool):
-        if e.val:
-            return "true"
-        else:
-            return "false"
-    elif isinstance(e, hdltree.HDLSlice):
-        if e.size is None:
-            return "{}({})".format(generate_expr(e.prefix), e.index)
-        else:
-            return "{}({} downto {})".format(
-                generate_expr(e.prefix), e.index + e.size - 1, e.index)
-    elif isinstance(e, hdltree.HDLIndex):
+    return emit
+
+
+def generate_expr_replicate(e, _prio):
+    if e.with_others:
+        return "(others => {})".format(generate_expr(e.expr))
+    else:
+        return "({} downto 0 => {})".format(e.num - 1, generate_expr(e.expr))
+
+
+def generate_expr_slice(e, _prio):
+    if e.size is None:
         return "{}({})".format(generate_expr(e.prefix), e.index)
-    elif isinstance(e, hdltree.HDLInterfaceSelect):
-        # is_master means the direction is not reversed.
-        if e.subport.dir == 'EXT':
-            return "{}_i".format(e.subport.name)
-        else:
-            return "{}.{}".format(generate_name_interface(e.prefix, e.subport.dir), e.subport.name)
-    elif isinstance(e, hdltree.HDLExternalName):
-        return e.name
     else:
-        raise AssertionError("unhandled hdl expr {}".format(e))
+        return "{}({} downto {})".format(
+            generate_expr(e.prefix), e.index + e.size - 1, e.index)
+
+
+def generate_expr_interface_select(e, _prio):
+    # is_master means the direction is not reversed.
+    if e.subport.dir == 'EXT':
+        return "{}_i".format(e.subport.name)
+    else:
+        return "{}.{}".format(generate_name_interface(e.prefix, e.subport.dir), e.subport.name)
+
+
+expr_emitters = EmitterTable({
+    hdltree.HDLObject: lambda e, _prio: e.name,
+    hdltree.HDLParen: lambda e, _prio: "({})".format(generate_expr(e.expr)),
+    hdltree.HDLReplicate: generate_expr_replicate,
+    hdltree.HDLZext: lambda e, _prio: "std_logic_vector(resize(unsigned({}), {}))".format(
+        generate_expr(e.expr), e.size),
+    hdltree.HDLSext: lambda e, _prio: "std_logic_vector(resize(signed({}), {}))".format(
+        generate_expr(e.expr), e.size),
+    hdltree.HDLBit: lambda e, _prio: generate_bin_const(e.val, None),
+    hdltree.HDLUndef: lambda e, _prio: "'X'",
+    hdltree.HDLHexConst: lambda e, _prio: generate_hex_const(e.val, e.size),
+    hdltree.HDLConst: lambda e, _prio: generate_bin_const(e.val, e.size),
+    hdltree.HDLBinConst: lambda e, _prio: generate_bin_const(e.val, e.size),
+    hdltree.HDLNumber: lambda e, _prio: "{}".format(e.val),
+    hdltree.HDLBool: lambda e, _prio: "true" if e.val else "false",
+    hdltree.HDLSlice: generate_expr_slice,
+    hdltree.HDLIndex: lambda e, _prio: "{}({})".format(generate_expr(e.prefix), e.index),
+    hdltree.HDLInterfaceSelect: generate_expr_interface_select,
+    hdltree.HDLExternalName: lambda e, _prio: e.name,
+})
+for _cls, (_opname, _opprio) in operator.items():
+    if issubclass(_cls, hdltree.HDLBinary):
+        expr_emitters[_cls] = make_binary_emitter(_opname, _opprio)
+    else:
+        expr_emitters[_cls] = make_unary_emitter(_opname, _opprio)
+
+
+def generate_expr(e, prio=-1):
+    return expr_emitters[type(e)](e, prio)
 
 
 def get_base_name(s):
@@ -316,74 +328,80 @@ def get_base_name(s):
         return None
 
 
-def generate_assign(fd, s):
-    base_targ = get_base_name(s.target)
-    base_expr = get_base_name(s.expr)
+def generate_assign_line(s):
+    """Return the assignment S, without indentation nor newline"""
     targ = generate_expr(s.target)
     expr = generate_expr(s.expr)
-    if base_expr is not None and base_targ.typ != base_expr.typ:
-        wln(fd, "{} <= {}({});".format(
-            targ, generate_type_mark(base_targ), expr))
-    else:
-        wln(fd, "{} <= {};".format(targ, expr))
+    base_expr = get_base_name(s.expr)
+    if base_expr is not None:
+        base_targ = get_base_name(s.target)
+        if base_targ.typ != base_expr.typ:
+            return "{} <= {}({});".format(targ, generate_type_mark(base_targ), expr)
+    return targ + " <= " + expr + ";"
 
 
-def generate_seq(fd, s, level):
+def generate_seq_assign(fd, s, level, _style):
+    wln(fd, '  ' * level + generate_assign_line(s))
+
+
+def generate_seq_ifelse(fd, s, level, style):
     indent = '  ' * level
-    if isinstance(s, hdltree.HDLAssign):
-        w(fd, indent)
-        generate_assign(fd, s)
-    elif isinstance(s, hdltree.HDLIfElse):
-        w(fd, indent)
-        while True:
-            wln(fd, "if {} then".format(generate_expr(s.cond)))
-            for s1 in s.then_stmts:
-                generate_seq(fd, s1, level + 1)
-            if s.else_stmts is not None:
-                w(fd, indent)
-                if style != 'wbgen' \
-                   and len(s.else_stmts) == 1 \
-                   and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
-                    w(fd, "els")
-                    s = s.else_stmts[0]
-                else:
-                    wln(fd, "else")
-                    for s1 in s.else_stmts:
-                        generate_seq(fd, s1, level + 1)
-                    break
+    w(fd, indent)
+    while True:
+        wln(fd, "if {} then".format(generate_expr(s.cond)))
+        for s1 in s.then_stmts:
+            generate_seq(fd, s1, level + 1, style)
+        if s.else_stmts is not None:
+            w(fd, indent)
+            if style != 'wbgen' \
+               and len(s.else_stmts) == 1 \
+               and isinstance(s.else_stmts[0], hdltree.HDLIfElse):
+                w(fd, "els")
+                s = s.else_stmts[0]
             else:
+                wln(fd, "else")
+                for s1 in s.else_stmts:
+                    generate_seq(fd, s1, level + 1, style)
                 break
+        else:
+            break
+    w(fd, indent)
+    wln(fd, "end if;")
+
+
+def generate_seq_switch(fd, s, level, style):
+    indent = '  ' * level
+    w(fd, indent)
+    wln(fd, "case {} is".format(generate_expr(s.expr)))
+    for c in s.choices:
         w(fd, indent)
-        wln(fd, "end if;")
-    elif isinstance(s, hdltree.HDLSwitch):
-        w(fd, indent)
-        wln(fd, "case {} is".format(generate_expr(s.expr)))
-        for c in s.choices:
-            w(fd, indent)
-            if isinstance(c, hdltree.HDLChoiceExpr):
-                wln(fd, "when {} =>".format(generate_expr(c.expr)))
-            elif isinstance(c, hdltree.HDLChoiceDefault):
-                wln(fd, "when others =>")
-            for s1 in c.stmts:
-                generate_seq(fd, s1, level + 1)
-        w(fd, indent)
-        wln(fd, "end case;")
-    elif isinstance(s, hdltree.HDLComment):
-        w(fd, indent)
-        wln(fd, "-- {}".format(s.comment))
-    else:
-        raise AssertionError("unhandled hdl seq {}".format(s))
+        if isinstance(c, hdltree.HDLChoiceExpr):
+            wln(fd, "when {} =>".format(generate_expr(c.expr)))
+        elif isinstance(c, hdltree.HDLChoiceDefault):
+            wln(fd, "when others =>")
+        for s1 in c.stmts:
+            generate_seq(fd, s1, level + 1, style)
+    w(fd, indent)
+    wln(fd, "end case;")
 
 
-def generate_comment(fd, n, indent):
-    if n.nl:
-        wln(fd)
-    if n.comment is not None:
-        windent(fd, indent)
-        wln(fd, "-- {}".format(n.comment))
+def generate_seq_comment(fd, s, level, _style):
+    wln(fd, '  ' * level + "-- {}".format(s.comment))
+
 
+seq_emitters = EmitterTable({
+    hdltree.HDLAssign: generate_seq_assign,
+    hdltree.HDLIfElse: generate_seq_ifelse,
+    hdltree.HDLSwitch: generate_seq_switch,
+    hdltree.HDLComment: generate_seq_comment,
+})
 
-def generate_sync(fd, s, indent):
+
+def generate_seq(fd, s, level, style):
+    seq_emitters[type(s)](fd, s, level, style)
+
+
+def generate_sync(fd, s, indent, style):
     sindent = "  " * indent
     w(fd, sindent)
     if s.name is not None:
@@ -409,26 +427,26 @@ def generate_sync(fd, s, indent):
                 generate_expr(s.clk)))
             wln(fd, sindent + "    if {} then".format(rst_cond))
             for s1 in s.rst_stmts:
-                generate_seq(fd, s1, indent + 3)
+                generate_seq(fd, s1, indent + 3, style)
             wln(fd, sindent + "    else")
             for s1 in s.sync_stmts:
-                generate_seq(fd, s1, indent + 3)
+                generate_seq(fd, s1, indent + 3, style)
             wln(fd, sindent + "    end if;")
             wln(fd, sindent + "  end if;")
         else:
             wln(fd, sindent + "  if {} then".format(rst_cond))
             for s1 in s.rst_stmts:
-                generate_seq(fd, s1, indent + 2)
+                generate_seq(fd, s1, indent + 2, style)
             wln(fd, sindent + "  elsif rising_edge({}) then".format(
                 generate_expr(s.clk)))
             for s1 in s.sync_stmts:
-                generate_seq(fd, s1, indent + 2)
+                generate_seq(fd, s1, indent + 2, style)
             wln(fd, sindent + "  end if;")
     else:
         wln(fd, sindent + "  if rising_edge({}) then".format(
             generate_expr(s.clk)))
         for s1 in s.sync_stmts:
-            generate_seq(fd, s1, indent + 2)
+            generate_seq(fd, s1, indent + 2, style)
         wln(fd, sindent + "  end if;")
     w(fd, sindent + "end process")
     if s.name is not None:
@@ -436,84 +454,105 @@ def generate_sync(fd, s, indent):
     wln(fd, ";")
 
 
-def generate_stmts(fd, stmts, indent):
+def generate_stmt_assign(fd, s, indent, _style):
+    wln(fd, "  " * indent + generate_assign_line(s))
+
+
+def generate_comb(fd, s, indent, style):
+    # Print processes only if they contain statements
+    if not s.stmts:
+        return
+
     sindent = "  " * indent
-    gen_num = 0
-    for s in stmts:
-        if isinstance(s, hdltree.HDLComment):
-            generate_comment(fd, s, indent)
-        elif isinstance(s, hdltree.HDLAssign):
-            w(fd, sindent)
-            generate_assign(fd, s)
-        elif isinstance(s, hdltree.HDLComb):
-            # Print processes only if they contain statements
-            if not s.stmts:
-                continue
+    w(fd, sindent)
+    if s.name is not None:
+        w(fd, '{}: '.format(s.name))
+    w(fd, "process (")
+    first = True
+    l = 0
+    for e in s.sensitivity:
+        se = generate_expr(e)
+        if first:
+            first = False
+        else:
+            w(fd, ',')
+            if style == 'wbgen' or (l == 0 or l + len(se) < 64):
+                w(fd, " ")
+            else:
+                w(fd, "\n           ")
+                l = 0
+        l += len(se)
+        w(fd, se)
+    if style == 'wbgen':
+        wln(fd, "  )")
+        w(fd, sindent)
+    else:
+        w(fd, ") ")
+    wln(fd, "begin")
+    # wln(fd, "  begin")
+    for s1 in s.stmts:
+        generate_seq(fd, s1, 2, style)
+    w(fd, "  end process")
+    if s.name is not None:
+        w(fd, ' {}'.format(s.name))
+    wln(fd, ";")
+
 
-            w(fd, sindent)
-            if s.name is not None:
-                w(fd, '{}: '.format(s.name))
-            w(fd, "process (")
-            first = True
-            l = 0
-            for e in s.sensitivity:
-                se = generate_expr(e)
-                if first:
-                    first = False
-                else:
-                    w(fd, ',')
-                    if style == 'wbgen' or (l == 0 or l + len(se) < 64):
-                        w(fd, " ")
-                    else:
-                        w(fd, "\n           ")
-                        l = 0
-                l += len(se)
-                w(fd, se)
-            if style == 'wbgen':
-                wln(fd, "  )")
-                w(fd, sindent)
+def generate_instance(fd, s, indent, _style):
+    sindent = "  " * indent
+    wln(fd, sindent + "{}: {}".format(s.name, s.module_name))
+
+    def generate_map(mapping, indent):
+        first = True
+        for p, e in mapping:
+            if first:
+                first = False
             else:
-                w(fd, ") ")
-            wln(fd, "begin")
-            # wln(fd, "  begin")
-            for s1 in s.stmts:
-                generate_seq(fd, s1, 2)
-            w(fd, "  end process")
-            if s.name is not None:
-                w(fd, ' {}'.format(s.name))
-            wln(fd, ";")
-        elif isinstance(s, hdltree.HDLSync):
-            generate_sync(fd, s, indent)
-        elif isinstance(s, hdltree.HDLInstance):
-            wln(fd, sindent + "{}: {}".format(s.name, s.module_name))
-
-            def generate_map(mapping, indent):
-                first = True
-                for p, e in mapping:
-                    if first:
-                        first = False
-                    else:
-                        wln(fd, ",")
-                    w(fd, "  " * indent)
-                    w(fd, "  {:<20} => {}".format(p, generate_expr(e)))
-                wln(fd)
-            if s.params:
-                wln(fd, sindent + "  generic map (")
-                generate_map(s.params, indent + 1)
-                wln(fd, sindent + "  )")
-            if s.conns:
-                wln(fd, sindent + "  port map (")
-                generate_map(s.conns, indent + 1)
-                wln(fd, sindent + "  );")
-            wln(fd, sindent)
-        elif isinstance(s, hdltree.HDLGenIf):
-            wln(fd, sindent + "genblock_{}: if ({}) generate".format(
-                gen_num, generate_expr(s.cond)))
-            generate_stmts(fd, s.stmts, indent + 1)
-            wln(fd, sindent + "end generate genblock_{};".format(gen_num))
+                wln(fd, ",")
+            w(fd, "  " * indent)
+            w(fd, "  {:<20} => {}".format(p, generate_expr(e)))
+        wln(fd)
+    if s.params:
+        wln(fd, sindent + "  generic map (")
+        generate_map(s.params, indent + 1)
+        wln(fd, sindent + "  )")
+    if s.conns:
+        wln(fd, sindent + "  port map (")
+        generate_map(s.conns, indent + 1)
+        wln(fd, sindent + "  );")
+    wln(fd, sindent)
+
+
+def generate_genif(fd, s, indent, gen_num, style):
+    sindent = "  " * indent
+    wln(fd, sindent + "genblock_{}: if ({}) generate".format(
+        gen_num, generate_expr(s.cond)))
+    generate_stmts(fd, s.stmts, indent + 1, style)
+    wln(fd, sindent + "end generate genblock_{};".format(gen_num))
+
+
+def generate_stmt_comment(fd, s, indent, _style):
+    generate_comment(fd, s, indent)
+
+
+stmt_emitters = EmitterTable({
+    hdltree.HDLComment: generate_stmt_comment,
+    hdltree.HDLAssign: generate_stmt_assign,
+    hdltree.HDLComb: generate_comb,
+    hdltree.HDLSync: generate_sync,
+    hdltree.HDLInstance: generate_instance,
+})
+
+
+def generate_stmts(fd, stmts, indent, style=None):
+    gen_num = 0
+    for s in stmts:
+        if isinstance(s, hdltree.HDLGenIf):
+            # Generate blocks are numbered within their statement list.
+            generate_genif(fd, s, indent, gen_num, style)
             gen_num += 1
         else:
-            assert False, "unhandled hdl stmt {}".format(s)
+            stmt_emitters[type(s)](fd, s, indent, style)
 
 
 def get_interface_name(inter, is_master, is_out):
@@ -532,7 +571,7 @@ def print_inters_list(fd, lst, name, indent):
     if not lst:
         return
 
-    buffer = io.StringIO()
+    buffer = StringList()
 
     windent(buffer, indent)
     wln(buffer, "{} (".format(name))
@@ -602,7 +641,7 @@ def print_attributes(fd, ports, indent):
             windent(fd, indent + 1)
             wln(fd, "\"{}\";".format(v))
 
-def print_module(fd, module):
+def print_module(fd, module, style=None):
     if module.global_decls:
         generate_header(fd, module)
         wln(fd)
@@ -632,7 +671,7 @@ def print_module(fd, module):
     # even if this is not allowed by vhdl...
     print_attributes(fd, module.ports, 1)
     wln(fd, "begin")
-    generate_stmts(fd, module.stmts, 1)
+    generate_stmts(fd, module.stmts, 1, style)
     wln(fd, "end syn;")
 
 
@@ -645,10 +684,13 @@ def print_package(fd, n):
     wln(fd, "end {};".format(n.name))
 
 
-def print_vhdl(fd, n):
+def print_vhdl(fd, n, options=None):
+    style = options.vhdl_style if options is not None else None
+    buf = StringList()
     if isinstance(n, hdltree.HDLModule):
-        print_module(fd, n)
+        print_module(buf, n, style)
     elif isinstance(n, hdltree.HDLPackage):
-        print_package(fd, n)
+        print_package(buf, n)
     else:
         raise AssertionError
+    fd.write(buf.getvalue())
@@ -0,0 +1,169 @@
+"""Profiling of a run (option --profile).
+
+The run is split in sections: the pipeline stages and the generators, and
+inside them some steps (submap loading, generate_hdl, hdlopt, printing).
+For each section, the wall time, the CPU time and the peak of the memory
+traced by tracemalloc are recorded.  A section is identified by its path
+(like 'gen_hdl/generate_hdl/hdlopt'); the measures of the sections with
+the same path are added (the peak is the maximum).
+
+Optionally, the top-level sections are also profiled with cProfile and
+the statistics are dumped to DIR/NAME.prof (see the pstats module).  The
+memory tracing can be disabled, as it slows down the run."""
+
+import os
+import time
+import tracemalloc
+
+
+class Record(object):
+    def __init__(self, path):
+        self.path = path
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        # Peak of the traced memory (in bytes).
+        self.peak = 0
+
+
+class Profiler(object):
+    def __init__(self, dump_dir=None, memory=True):
+        # If set, directory for the cProfile dumps.
+        self.dump_dir = dump_dir
+        # If true, trace the memory.
+        self.memory = memory
+        # Records, by path, in order of first use.
+        self.records = {}
+        # Paths of the current sections.
+        self.stack = []
+        # Peak of the traced memory of the current sections.
+        self.peaks = []
+        self.own_tracing = False
+        self.start_wall = None
+        self.start_cpu = None
+        self.wall = 0.0
+        self.cpu = 0.0
+        # True if the outputs were copied from the artifact cache (so
+        # nothing was generated).
+        self.cached = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.own_tracing = True
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def stop(self):
+        self.wall += time.perf_counter() - self.start_wall
+        self.cpu += time.process_time() - self.start_cpu
+        if self.own_tracing:
+            tracemalloc.stop()
+            self.own_tracing = False
+
+    def section(self, name):
+        return Section(self, name)
+
+    def enter(self, name):
+        path = '/'.join(self.stack + [name])
+        if path not in self.records:
+            self.records[path] = Record(path)
+        if self.memory:
+            if self.peaks:
+                # The peak is reset for the new section: save the one of
+                # the enclosing section.
+                self.peaks[-1] = max(self.peaks[-1],
+                                     tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self.stack.append(name)
+        self.peaks.append(0)
+        return path
+
+    def leave(self, path, wall, cpu):
+        peak = self.peaks.pop()
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        self.stack.pop()
+        if self.peaks:
+            self.peaks[-1] = max(self.peaks[-1], peak)
+        r = self.records[path]
+        r.calls += 1
+        r.wall += wall
+        r.cpu += cpu
+        r.peak = max(r.peak, peak)
+
+    def to_json(self):
+        return {'cached': self.cached,
+                'wall': self.wall,
+                'cpu': self.cpu,
+                'sections': [{'name': r.path, 'calls': r.calls,
+                              'wall': r.wall, 'cpu': r.cpu,
+                              'peak': r.peak if self.memory else None}
+                             for r in self.records.values()]}
+
+    def report(self, fd, fmt='text'):
+        if fmt == 'json':
+            import json
+            fd.write(json.dumps(self.to_json(), indent=1) + '\n')
+            return
+        if self.cached:
+            fd.write("cached, no generation\n")
+            return
+        fd.write("{:<40} {:>6} {:>10} {:>10} {:>10}\n".format(
+            'section', 'calls', 'wall (ms)', 'cpu (ms)', 'peak (MB)'))
+        for r in self.records.values():
+            depth = r.path.count('/')
+            name = '  ' * depth + r.path.rsplit('/', 1)[-1]
+            fd.write("{:<40} {:>6} {:>10.1f} {:>10.1f} {:>10.2f}\n".format(
+                name, r.calls, r.wall * 1e3, r.cpu * 1e3, r.peak / 1e6))
+        fd.write("{:<40} {:>6} {:>10.1f} {:>10.1f}\n".format(
+            'total', '', self.wall * 1e3, self.cpu * 1e3))
+
+
+class Section(object):
+    """Context manager measuring a section"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.path = None
+        self.cprofile = None
+
+    def __enter__(self):
+        p = self.profiler
+        if p.dump_dir is not None and not p.stack:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+        self.path = p.enter(self.name)
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        self.profiler.leave(self.path, wall, cpu)
+        if self.cprofile is not None:
+            os.makedirs(self.profiler.dump_dir, exist_ok=True)
+            self.cprofile.dump_stats(
+                os.path.join(self.profiler.dump_dir, self.name + '.prof'))
+
+
+class NullSection(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        pass
+
+
+def section(profiler, name):
+    """Return a context manager to measure section NAME with PROFILER
+    (which can be None)"""
+    if profiler is None:
+        return NullSection()
+    return profiler.section(name)
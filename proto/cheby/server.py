@@ -0,0 +1,229 @@
+"""Generation server (option --serve).
+
+The server listens on a Unix-domain socket.  A client sends requests and
+receives responses, each one being a JSON object on one line.  A
+connection can be used for several requests.
+
+  {"op": "generate", "input": "a.cheby", "outputs": ["gen-hdl", "gen-c"],
+   "options": {"hdl": "verilog"}}
+  -> {"status": "ok", "outputs": {"gen-hdl": "...", "gen-c": "..."}}
+
+Instead of "input", the request can give the "content" of the map (with
+an optional "filename" used to find its submaps).  The outputs and the
+options are those of cheby.api.  An optional "word_endian" is given to
+the layout.  On error, the response is {"status": "error", "error": MSG}.
+
+  {"op": "stats"}     -> {"status": "ok", "stats": {...}}
+  {"op": "shutdown"}  -> {"status": "ok"} and the server stops.
+
+The yaml documents read and the laid out maps are kept in memory, with a
+LRU eviction.  A map is used again only if none of its files (input and
+submaps) has been modified.  Requests are handled concurrently, each
+connection by its own thread."""
+
+import collections
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+
+import cheby.api as api
+import cheby.main
+import cheby.parser as parser
+import cheby.layout as layout
+
+
+# Number of latencies kept for the statistics.
+NBR_LATENCIES = 1000
+
+
+def get_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def percentile(values, q):
+    """Return the Q-quantile (between 0 and 1) of sorted VALUES"""
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Server(object):
+    """The state of the server: the caches and the statistics"""
+
+    def __init__(self, max_maps=64, max_documents=256):
+        self.cache = parser.DocumentCache(max_documents)
+        # The laid out maps, as (stamps of their files, map).
+        self.maps = collections.OrderedDict()
+        self.max_maps = max_maps
+        self.lock = threading.Lock()
+        self.map_hits = 0
+        self.map_misses = 0
+        self.requests = 0
+        self.errors = 0
+        # Duration of the last requests (in seconds).
+        self.latencies = collections.deque(maxlen=NBR_LATENCIES)
+        self.start = time.time()
+
+    def get_map(self, req):
+        word_endian = req.get('word_endian', 'default')
+        if 'content' in req:
+            content = req['content']
+            filename = req.get('filename', '<string>')
+            digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+            key = ('content', digest, filename, word_endian)
+        else:
+            filename = req['input']
+            key = ('input', os.path.realpath(filename), word_endian)
+        with self.lock:
+            ent = self.maps.get(key)
+            if ent is not None and all(get_stamp(f) == s for f, s in ent[0].items()):
+                self.map_hits += 1
+                self.maps.move_to_end(key)
+                return ent[1]
+            self.map_misses += 1
+        if 'content' in req:
+            m = api.loads(content, filename, word_endian, self.cache)
+        else:
+            m = api.load(filename, word_endian, self.cache)
+        stamps = {f: get_stamp(f) for f in layout.get_input_filenames(m.tree)}
+        with self.lock:
+            self.maps[key] = (stamps, m)
+            while len(self.maps) > self.max_maps:
+                self.maps.popitem(last=False)
+        return m
+
+    def generate(self, req):
+        outputs = req.get('outputs', [])
+        options = req.get('options', {})
+        if not isinstance(outputs, list) or not isinstance(options, dict):
+            raise api.ApiException("'outputs' must be a list and 'options' an object")
+        m = self.get_map(req)
+        return {'status': 'ok', 'outputs': m.generate(outputs, **options)}
+
+    def stats(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+            maps = len(self.maps)
+        res = {'uptime': time.time() - self.start,
+               'requests': self.requests,
+               'errors': self.errors,
+               'maps': maps,
+               'map_hits': self.map_hits,
+               'map_misses': self.map_misses,
+               'documents': len(self.cache.docs),
+               'document_hits': self.cache.hits,
+               'document_misses': self.cache.misses}
+        for name, hits, misses in [('map', self.map_hits, self.map_misses),
+                                   ('document', self.cache.hits, self.cache.misses)]:
+            res[name + '_hit_rate'] = hits / (hits + misses) if hits + misses else None
+        if lat:
+            res['latency_ms'] = {name: percentile(lat, q) * 1e3
+                                 for name, q in [('p50', 0.5), ('p90', 0.9),
+                                                 ('p99', 0.99), ('max', 1.0)]}
+        return res
+
+    def handle(self, req):
+        """Handle request REQ (a decoded JSON object).  Return the response"""
+        start = time.perf_counter()
+        try:
+            if not isinstance(req, dict):
+                raise api.ApiException('a request must be an object')
+            op = req.get('op', 'generate')
+            if op == 'generate':
+                res = self.generate(req)
+            elif op == 'stats':
+                res = {'status': 'ok', 'stats': self.stats()}
+            else:
+                raise api.ApiException("unknown op '{}'".format(op))
+        except parser.ParseException as e:
+            res = {'status': 'error', 'error': str(e)}
+        except layout.LayoutException as e:
+            res = {'status': 'error', 'error': str(e)}
+        except api.ApiException as e:
+            res = {'status': 'error', 'error': str(e)}
+        except KeyError as e:
+            res = {'status': 'error', 'error': 'missing {} in request'.format(e)}
+        except SystemExit as e:
+            res = {'status': 'error', 'error': 'exit with status {}'.format(e.code)}
+        except Exception as e:
+            res = {'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)}
+        with self.lock:
+            self.requests += 1
+            if res['status'] != 'ok':
+                self.errors += 1
+            self.latencies.append(time.perf_counter() - start)
+        return res
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+            except ValueError as e:
+                res = {'status': 'error', 'error': 'bad json: {}'.format(e)}
+            else:
+                if isinstance(req, dict) and req.get('op') == 'shutdown':
+                    self.wfile.write(b'{"status": "ok"}\n')
+                    # Cannot be called from the thread of serve_forever.
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                res = self.server.cheby.handle(req)
+            self.wfile.write(json.dumps(res).encode('utf-8') + b'\n')
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def request(path, req):
+    """Send request REQ to the server listening on PATH.  Return the
+    response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps(req).encode('utf-8') + b'\n')
+        with s.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def make_server(path, server=None):
+    """Create the socket server listening on PATH (a stale socket file is
+    removed)"""
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        # Don't remove a socket in use.
+        try:
+            request(path, {'op': 'stats'})
+        except ConnectionRefusedError:
+            os.unlink(path)
+    srv = UnixServer(path, RequestHandler)
+    srv.cheby = server or Server()
+    # Not on the first requests, which are handled concurrently.
+    cheby.main.import_generators()
+    return srv
+
+
+def run_server(path):
+    """Serve requests on socket PATH until a shutdown request or an
+    interruption.  Return the exit status"""
+    try:
+        srv = make_server(path)
+    except OSError as e:
+        sys.stderr.write("error: cannot listen on {}: {}\n".format(path, e))
+        return 2
+    sys.stderr.write("cheby: listening on {}\n".format(path))
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+        os.unlink(path)
+    return 0
@@ -1,14 +1,82 @@
+import collections
+import sys
+import weakref
+
 import cheby.parser
 import cheby.layout
 import cheby.tree as tree
 
 
+# Methods of the UAL object, per word size.
+READ_METHODS = {1: 'readb', 2: 'readw', 4: 'readl'}
+WRITE_METHODS = {1: 'writeb', 2: 'writew', 4: 'writel'}
+# Optional methods of the UAL object for block transfers: read COUNT words
+# from ADDR (return a sequence of words), write a sequence of words at ADDR.
+READ_BLOCK_METHODS = {1: 'readb_block', 2: 'readw_block', 4: 'readl_block'}
+WRITE_BLOCK_METHODS = {1: 'writeb_block', 2: 'writew_block', 4: 'writel_block'}
+
+# The namedtuple of the fields of a register, per register.
+_fields_types = weakref.WeakKeyDictionary()
+
+
+def fields_type(reg):
+    """Return the namedtuple type for the fields of REG (as returned by
+    read_fields)"""
+    res = _fields_types.get(reg)
+    if res is None:
+        names = [f.name for f in reg.children if f.name is not None]
+        res = collections.namedtuple(reg.name + '_fields', names, rename=True)
+        _fields_types[reg] = res
+    return res
+
+
+# x-hdl types of the fields modified by the hardware: an autoclear field is
+# cleared after a write, and writing 1 to an or-clr field clears the bits
+# set by the hardware.
+VOLATILE_TYPES = ('autoclear', 'or-clr', 'or-clr-out')
+
+
+def volatile_mask(reg):
+    """Return the mask of the bits of the fields of REG modified by the
+    hardware"""
+    reg_type = reg.get_extension('x_hdl', 'type')
+    res = 0
+    for f in reg.children:
+        if f.get_extension('x_hdl', 'type', reg_type) in VOLATILE_TYPES:
+            res |= ((1 << f.c_rwidth) - 1) << f.lo
+    return res
+
+
+def preset_value(reg):
+    """Return the value of REG after a reset"""
+    res = 0
+    for f in reg.children:
+        if f.c_preset is not None:
+            res |= f.c_preset << f.lo
+    return res
+
+
 class UALValue(object):
-    def __init__(self, ual, root, node, offset):
+    def __init__(self, ual, root, node, offset, cache=None):
         self._ual = ual
         self._root = root
         self._node = node
         self._offset = offset
+        # The ShadowCache, or None.
+        self._cache = cache
+
+    # For the ShadowCache.
+    @property
+    def _addr(self):
+        return self._offset
+
+    @property
+    def _volatile(self):
+        return volatile_mask(self._node)
+
+    @property
+    def _preset(self):
+        return preset_value(self._node)
 
     def _get_child(self, name, children):
         els = [el for el in children if el.name == name]
@@ -16,74 +84,828 @@ class UALValue(object):
             raise AttributeError("no {} in {}".format(name, self._node.name))
         return els[0]
 
+    def _word_offsets(self):
+        """Return the list of (address, shift) of the words of the register"""
+        word_size = self._root.c_word_size
+        word_bits = word_size * tree.BYTE_SIZE
+        nwords = self._node.c_nwords
+        res = []
+        for i in range(nwords):
+            if self._root.c_word_endian == 'big':
+                off = nwords - 1 - i
+            else:
+                off = i
+            res.append((self._offset + off * word_size, i * word_bits))
+        return res
+
     def _read_val(self):
         res = 0
-        word_size = self._root.c_word_size * tree.BYTE_SIZE
-        # FIXME: assume LE
-        for i in range(self._node.width // word_size):
-            addr = self._offset + i * word_size
-            if word_size == 16:
-                v = self._ual.readw(addr)
-            elif word_size == 32:
-                v = self._ual.readl(addr)
-            else:
-                raise AssertionError
-            res |= v << (i * word_size)
+        read = getattr(self._ual, READ_METHODS[self._root.c_word_size])
+        for addr, shift in self._word_offsets():
+            res |= read(addr) << shift
         return res
 
     def _write_val(self, val):
-        word_size = self._root.c_word_size * tree.BYTE_SIZE
-        # FIXME: assume LE
-        for i in range(self._node.width // word_size):
-            addr = self._offset + i * word_size
-            v = (val >> (i * word_size)) & ((1 << word_size) - 1)
-            if word_size == 16:
-                self._ual.writew(addr, v)
-            elif word_size == 32:
-                self._ual.writel(addr, v)
-            else:
-                raise AssertionError
+        word_mask = (1 << (self._root.c_word_size * tree.BYTE_SIZE)) - 1
+        write = getattr(self._ual, WRITE_METHODS[self._root.c_word_size])
+        for addr, shift in self._word_offsets():
+            write(addr, (val >> shift) & word_mask)
+
+    def read(self):
+        """Read the register"""
+        if not isinstance(self._node, tree.Reg):
+            raise TypeError("{} is not a register".format(self._node.name))
+        return self._read_val()
+
+    def write(self, val):
+        """Write the register"""
+        if not isinstance(self._node, tree.Reg):
+            raise TypeError("{} is not a register".format(self._node.name))
+        self._write_val(val)
+        if self._cache is not None:
+            self._cache.store(self, val)
+
+    def read_fields(self):
+        """Read the register once and return the values of its fields, as
+        a namedtuple"""
+        val = self.read()
+        return fields_type(self._node)._make(
+            [(val >> f.lo) & ((1 << f.c_rwidth) - 1)
+             for f in self._node.children if f.name is not None])
 
     def __getattr__(self, name):
-        if isinstance(self._node, (tree.Root, tree.Block, tree.Array)):
+        if name[0] == '_':
+            raise AttributeError(name)
+        if isinstance(self._node, tree.Submap) and self._node.filename is not None:
+            el = self._get_child(name, self._node.c_submap.children)
+            return UALValue(self._ual, self._node.c_submap, el,
+                            self._offset + el.c_address, self._cache)
+        elif isinstance(self._node, (tree.Root, tree.Block, tree.Repeat,
+                                     tree.Memory, tree.AddressSpace)):
             el = self._get_child(name, self._node.children)
             return UALValue(self._ual, self._root, el,
-                            self._offset + el.c_address)
-        elif isinstance(self._node, tree.Reg) and self._node.type is None:
-            raise AttributeError
-#            el = self._get_child(name)
-#            val = self.read_reg()
+                            self._offset + el.c_address, self._cache)
+        elif isinstance(self._node, tree.Reg):
+            el = self._get_child(name, self._node.children)
+            val = self._read_val()
+            return (val >> el.lo) & ((1 << el.c_rwidth) - 1)
         else:
-            raise AttributeError
+            raise AttributeError("no '{}' in {}".format(name, self._node.name))
 
     def __setattr__(self, name, value):
         if name[0] == '_':
             object.__setattr__(self, name, value)
-        elif isinstance(self._node, tree.Reg) and self._node.type is None:
+        elif isinstance(self._node, tree.Reg):
             el = self._get_child(name, self._node.children)
-            val = self._read_val()
-            mask = ((1 << el.c_width) - 1) << el.lo
-            val &= ~mask
-            val |= (value << el.lo) & mask
+            mask = ((1 << el.c_rwidth) - 1) << el.lo
+            bits = (value << el.lo) & mask
+            val = None
+            if self._cache is not None:
+                val = self._cache.update(self, mask, bits)
+            if val is None:
+                # The bits modified by the hardware are written as 0.
+                val = (self._read_val() & ~(mask | self._volatile)) | bits
             self._write_val(val)
         else:
-            print(self._node)
             raise AttributeError("no '{}' in {}".format(name, self._node.name))
 
     def __getitem__(self, key):
         if not isinstance(key, int):
             raise KeyError
-        if isinstance(self._node, tree.Array):
-            if key >= self._node.repeat:
-                raise IndexError
-            return UALValue(self._ual, self._root, self._node,
-                            self._offset + key * self._node.c_elsize)
+        if isinstance(self._node, tree.Repeat):
+            count = self._node.count
+            step = self._node.c_elsize
+        elif isinstance(self._node, tree.Memory):
+            count = self._node.c_depth
+            # An element smaller than a word uses a word.
+            step = self._node.c_size // count
         else:
             raise TypeError
+        if key < 0 or key >= count:
+            raise IndexError
+        return UALValue(self._ual, self._root, self._node,
+                        self._offset + key * step, self._cache)
 
 
-def create_ual_access(ual, filename):
+def create_ual_access(ual, filename, cache=None):
     root = cheby.parser.parse_yaml(filename)
     cheby.layout.layout_cheby(root)
 
-    return UALValue(ual, root, root, 0)
+    return UALValue(ual, root, root, 0, cache)
+
+
+# Compiled access.
+#
+# The access tree is generated as python classes, one per node of the map,
+# with the offsets, masks and shifts as constants.  The objects of the
+# tree are created once (with their absolute addresses), so an access is
+# just an attribute lookup and a call to the UAL object.
+
+
+class RegAccess(object):
+    """Base class of the compiled register accessors.  The generated
+    classes define read(), write(val) and read_fields(), and a property per
+    field"""
+    __slots__ = ('_ual', '_addr', '_rd', '_wr', '_sh')
+
+    # The register node and the fields, as a dict from name to (shift, mask).
+    _node = None
+    _fields = {}
+    # The words of the register, as a list of (offset, shift), and their size.
+    _words = ()
+    _word_size = None
+    # The RegValue subclass for the values of the register.
+    _value_type = None
+    # For the ShadowCache: the bits modified by the hardware and the value
+    # after reset.
+    _volatile = 0
+    _preset = 0
+
+    def __init__(self, ual, addr, sh=None):
+        self._ual = ual
+        self._addr = addr
+        self._sh = sh
+
+    def set(self, **fields):
+        """Set FIELDS (read-modify-write, or just a write with a shadow
+        cache)"""
+        mask = 0
+        bits = 0
+        for name, v in fields.items():
+            if name not in self._fields:
+                raise AttributeError("no field '{}' in {}".format(name, self._node.name))
+            shift, m = self._fields[name]
+            mask |= m << shift
+            bits |= (v & m) << shift
+        val = None
+        if self._sh is not None:
+            val = self._sh.update(self, mask, bits)
+        if val is None:
+            # The bits modified by the hardware are written as 0.
+            val = (self.read() & ~(mask | self._volatile)) | bits
+        self.write(val)
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self._node.name, self._addr)
+
+
+class BlockAccess(object):
+    """Base class of the compiled accessors for the root, the blocks, the
+    submaps and the elements of repeats and memories.  The children are
+    attributes.  The registers use the ShadowCache SH (if not None)"""
+    _node = None
+
+    def __init__(self, ual, base, sh=None):
+        self._ual = ual
+        self._base = base
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self._node.name, self._base)
+
+
+class RepeatAccess(tuple):
+    """The elements of a repeat"""
+    __slots__ = ()
+    _node = None
+
+
+class MemoryAccess(object):
+    """Base class of the accessors for memories.  The elements are created
+    on demand by indexing.  The memory can also be transferred as numpy
+    arrays"""
+    __slots__ = ('_ual', '_base')
+
+    _node = None
+    # Distance between two elements (an element smaller than a word uses a
+    # word).
+    _stride = None
+    _depth = None
+    _word_size = None
+    _element = None
+    # The registers of an element, as a list of (name, width, signed,
+    # offset, words), where words is a list of (index of the word in the
+    # element, shift).
+    _regs = ()
+    # The named fields of the registers of an element, as a dict from the
+    # name of the register to a list of (name, shift, width).
+    _fields = {}
+    # True if the layout of the element in memory is the one of the dtype
+    # (for a little-endian host).
+    _direct = False
+
+    def __init__(self, ual, base):
+        self._ual = ual
+        self._base = base
+
+    def __len__(self):
+        return self._depth
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, int):
+            raise TypeError('memory index must be an integer')
+        if idx < 0:
+            idx += self._depth
+        if idx < 0 or idx >= self._depth:
+            raise IndexError('memory index out of range')
+        return self._element(self._ual, self._base + idx * self._stride)
+
+    def view(self):
+        """Return a view of the memory without copy, as a sequence of words
+        (an element smaller than a word uses a word), for the UAL objects
+        that support it (like cheby.ual_mmap.MmapUAL)"""
+        return self._ual.view(self._base, self._node.c_size, self._word_size)
+
+    @property
+    def dtype(self):
+        """The numpy dtype of the elements: an integer for an element with
+        one register, a structured dtype with a member per register
+        otherwise"""
+        import numpy
+        if len(self._regs) == 1 and self._regs[0][3] == 0:
+            _, width, signed, _, _ = self._regs[0]
+            return numpy.dtype('{}{}'.format('i' if signed else 'u', width // tree.BYTE_SIZE))
+        return numpy.dtype({
+            'names': [r[0] for r in self._regs],
+            'formats': ['{}{}'.format('i' if r[2] else 'u', r[1] // tree.BYTE_SIZE)
+                        for r in self._regs],
+            'offsets': [r[3] for r in self._regs],
+            'itemsize': self._stride})
+
+    @property
+    def fields_dtype(self):
+        """The numpy dtype of the fields of the elements (see
+        read_fields()): a structured dtype with a member per field for an
+        element with one register, and a member per register (with a
+        member per field) otherwise.  The registers without named fields
+        are not included"""
+        import numpy
+
+        def reg_dtype(fields):
+            return numpy.dtype([(name, 'u{}'.format(uint_size(width)))
+                                for name, _, width in fields])
+        if len(self._regs) == 1:
+            return reg_dtype(self._fields[self._regs[0][0]])
+        return numpy.dtype([(r[0], reg_dtype(self._fields[r[0]]))
+                            for r in self._regs if self._fields[r[0]]])
+
+    def read_fields(self, start=0, count=None):
+        """Read COUNT elements (by default until the end) from element START
+        with one block read, like read(), and return their fields, as a
+        numpy array of fields_dtype"""
+        import numpy
+        values = self.read(start, count)
+        res = numpy.empty(len(values), self.fields_dtype)
+        for r in self._regs:
+            fields = self._fields[r[0]]
+            if not fields:
+                continue
+            val = values if values.dtype.names is None else values[r[0]]
+            val = val.astype(numpy.int64 if val.dtype.kind == 'i' else numpy.uint64)
+            val = val.view(numpy.uint64)
+            dest = res if len(self._regs) == 1 else res[r[0]]
+            for name, shift, width in fields:
+                dest[name] = (val >> numpy.uint64(shift)) & numpy.uint64((1 << width) - 1)
+        return res
+
+    def _check_range(self, start, count):
+        if start < 0 or count < 0 or start + count > self._depth:
+            raise IndexError('elements {}-{} out of memory {} of depth {}'.format(
+                start, start + count - 1, self._node.name, self._depth))
+        if any(r[1] > 64 for r in self._regs):
+            raise ValueError('cannot transfer registers wider than 64 bits')
+
+    def read(self, start=0, count=None):
+        """Read COUNT elements (by default until the end) from element START
+        with one block read.  Return a numpy array of dtype"""
+        import numpy
+        if count is None:
+            count = self._depth - start
+        self._check_range(start, count)
+        wsize = self._word_size
+        nwords = self._stride // wsize
+        addr = self._base + start * self._stride
+        if hasattr(self._ual, 'view'):
+            # Without an intermediate list (the words are copied below).
+            words = self._ual.view(addr, count * nwords * wsize, wsize)
+        else:
+            words = read_words(self._ual, wsize, addr, count * nwords)
+        words = numpy.asarray(words, dtype='u{}'.format(wsize)).reshape(count, nwords)
+        dtype = self.dtype
+        res = numpy.empty(count, dtype)
+        for name, width, signed, _, rwords in self._regs:
+            val = numpy.zeros(count, numpy.uint64)
+            for idx, shift in rwords:
+                val |= words[:, idx].astype(numpy.uint64) << numpy.uint64(shift)
+            if width < 64:
+                val &= numpy.uint64((1 << width) - 1)
+            if signed and width < 64:
+                # Sign extension.
+                sign = numpy.uint64(1 << (width - 1))
+                val = (val ^ sign) - sign
+            val = val.view(numpy.int64) if signed else val
+            if dtype.names is None:
+                res[:] = val
+            else:
+                res[name] = val
+        return res
+
+    def write(self, start, values):
+        """Write the elements of VALUES (an array of dtype) from element
+        START, with one block write"""
+        import numpy
+        values = numpy.asarray(values)
+        count = len(values)
+        self._check_range(start, count)
+        wsize = self._word_size
+        nwords = self._stride // wsize
+        wmask = numpy.uint64((1 << (wsize * tree.BYTE_SIZE)) - 1)
+        words = numpy.zeros((count, nwords), dtype='u{}'.format(wsize))
+        for name, width, _, _, rwords in self._regs:
+            val = values if values.dtype.names is None else values[name]
+            val = val.astype(numpy.int64 if val.dtype.kind == 'i' else numpy.uint64)
+            val = val.view(numpy.uint64)
+            if width < 64:
+                val = val & numpy.uint64((1 << width) - 1)
+            for idx, shift in rwords:
+                words[:, idx] |= ((val >> numpy.uint64(shift)) & wmask).astype(words.dtype)
+        words = words.reshape(-1)
+        if not hasattr(self._ual, 'view'):
+            # Only the UAL objects over a memory mapping take a buffer.
+            words = words.tolist()
+        write_words(self._ual, wsize, self._base + start * self._stride, words)
+
+    def array(self):
+        """Return the memory as a numpy array of dtype without copy, for the
+        UAL objects with view() and when the layout of the elements in
+        memory is the one of the dtype"""
+        import numpy
+        if not self._direct or sys.byteorder != 'little':
+            raise ValueError('memory {} cannot be viewed with its dtype'.format(self._node.name))
+        return numpy.frombuffer(self.view(), dtype=self.dtype)
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self._node.name, self._base)
+
+
+class AccessCompiler(object):
+    """Generate the source of the accessor classes for a map"""
+    def __init__(self):
+        self.lines = []
+        # List of (class name, node, extra attributes) to set once compiled.
+        self.classes = []
+        # Namespace of the generated code.
+        self.ns = {'RegAccess': RegAccess, 'BlockAccess': BlockAccess,
+                   'RepeatAccess': RepeatAccess, 'MemoryAccess': MemoryAccess,
+                   '_tuple_new': tuple.__new__}
+
+    def new_class(self, kind, node, extra=None):
+        name = '{}_{}'.format(kind, len(self.classes))
+        self.classes.append((name, node, extra or {}))
+        return name
+
+    def gen_reg(self, root, n):
+        wsize = root.c_word_size
+        wbits = wsize * tree.BYTE_SIZE
+        wmask = (1 << wbits) - 1
+        nwords = n.c_nwords
+        big = root.c_word_endian == 'big'
+
+        def word_off(i):
+            """Offset of the word containing bits i*wbits"""
+            return (nwords - 1 - i if big else i) * wsize
+
+        fields = {}
+        for f in n.children:
+            if f.name is not None:
+                fields[f.name] = (f.lo, (1 << f.c_rwidth) - 1)
+        words = tuple((word_off(i), i * wbits) for i in range(nwords))
+        vol = volatile_mask(n)
+        name = self.new_class('Reg', n, {'_fields': fields, '_words': words,
+                                         '_word_size': wsize,
+                                         '_value_type': value_type(n.name, fields),
+                                         '_volatile': vol,
+                                         '_preset': preset_value(n)})
+        ln = self.lines
+        ln.append('class {}(RegAccess):'.format(name))
+        ln.append('    __slots__ = ()')
+        ln.append('    def __init__(self, ual, addr, sh=None):')
+        ln.append('        self._ual = ual')
+        ln.append('        self._addr = addr')
+        ln.append('        self._sh = sh')
+        ln.append('        self._rd = ual.{}'.format(READ_METHODS[wsize]))
+        ln.append('        self._wr = ual.{}'.format(WRITE_METHODS[wsize]))
+        if nwords == 1:
+            ln.append('    def read(self):')
+            ln.append('        return self._rd(self._addr)')
+            ln.append('    def write(self, val):')
+            ln.append('        self._wr(self._addr, val)')
+        else:
+            ln.append('    def read(self):')
+            ln.append('        rd = self._rd')
+            ln.append('        a = self._addr')
+            ln.append('        return ' + ' | '.join(
+                '(rd(a + {}) << {})'.format(word_off(i), i * wbits) for i in range(nwords)))
+            ln.append('    def write(self, val):')
+            ln.append('        wr = self._wr')
+            ln.append('        a = self._addr')
+            for i in range(nwords):
+                ln.append('        wr(a + {}, (val >> {}) & 0x{:x})'.format(
+                    word_off(i), i * wbits, wmask))
+        ln.append('        if self._sh is not None:')
+        ln.append('            self._sh.store(self, val)')
+        for i, f in enumerate(n.children):
+            if f.name is None:
+                continue
+            mask = (1 << f.c_rwidth) - 1
+            hi = f.lo + f.c_rwidth - 1
+            if f.lo // wbits == hi // wbits:
+                # The field is within one word: access only this word.
+                w = f.lo // wbits
+                off = word_off(w)
+                shift = f.lo - w * wbits
+                # The bits kept: not the field, nor the bits modified by
+                # the hardware (written as 0).
+                wfmask = wmask & ~(mask << shift) & ~(vol >> (w * wbits))
+                ln.append('    def _get_{}(self):'.format(i))
+                ln.append('        return (self._rd(self._addr + {}) >> {}) & 0x{:x}'.format(
+                    off, shift, mask))
+                ln.append('    def _set_{}(self, val):'.format(i))
+                ln.append('        if self._sh is not None:')
+                ln.append('            v = self._sh.update(self, 0x{:x}, (val & 0x{:x}) << {})'.format(
+                    mask << f.lo, mask, f.lo))
+                ln.append('            if v is not None:')
+                ln.append('                self._wr(self._addr + {}, (v >> {}) & 0x{:x})'.format(
+                    off, w * wbits, wmask))
+                ln.append('                return')
+                ln.append('        a = self._addr + {}'.format(off))
+                ln.append('        self._wr(a, (self._rd(a) & 0x{:x}) | ((val & 0x{:x}) << {}))'.format(
+                    wfmask, mask, shift))
+            else:
+                ln.append('    def _get_{}(self):'.format(i))
+                ln.append('        return (self.read() >> {}) & 0x{:x}'.format(f.lo, mask))
+                ln.append('    def _set_{}(self, val):'.format(i))
+                ln.append('        self.set(**{{{!r}: val}})'.format(f.name))
+        # Decode all the fields from one read.
+        ftype = name + '_fields'
+        self.ns[ftype] = fields_type(n)
+        ln.append('    def read_fields(self):')
+        if nwords == 1:
+            ln.append('        v = self._rd(self._addr)')
+        else:
+            ln.append('        v = self.read()')
+        # Bypass the argument checks of the namedtuple.
+        ln.append('        return _tuple_new({}, ({}))'.format(ftype, ''.join(
+            '(v >> {}) & 0x{:x}, '.format(f.lo, (1 << f.c_rwidth) - 1)
+            for f in n.children if f.name is not None)))
+        for i, f in enumerate(n.children):
+            if f.name is not None and not hasattr(RegAccess, f.name) \
+               and f.name not in ('read', 'write', 'read_fields'):
+                ln.append('setattr({0}, {1!r}, property({0}._get_{2}, {0}._set_{2}))'.format(
+                    name, f.name, i))
+        return name
+
+    def memory_layout(self, root, n):
+        """Return the attributes of the accessor class of memory N"""
+        wsize = root.c_word_size
+        wbits = wsize * tree.BYTE_SIZE
+        stride = n.c_size // n.c_depth
+        regs = []
+        fields = {}
+        direct = stride == n.c_elsize
+        for r in n.children:
+            fields[r.name] = [(f.name, f.lo, f.c_rwidth) for f in r.children
+                              if f.name is not None]
+            words = []
+            for i in range(r.c_nwords):
+                off = r.c_nwords - 1 - i if root.c_word_endian == 'big' else i
+                words.append((r.c_address // wsize + off, i * wbits))
+            regs.append((r.name, r.width, r.c_type == 'signed', r.c_address, words))
+            if r.c_nwords > 1 and root.c_word_endian == 'big':
+                direct = False
+        return {'_stride': stride, '_depth': n.c_depth, '_word_size': wsize,
+                '_regs': regs, '_fields': fields, '_direct': direct}
+
+    def gen_child(self, root, n, base):
+        """Return the expression to create the accessor of N, at BASE"""
+        if isinstance(n, tree.Reg):
+            return '{}(ual, {}, sh)'.format(self.gen_reg(root, n), base)
+        elif isinstance(n, tree.Repeat):
+            el = self.gen_block(root, n, n.children)
+            name = self.new_class('Rep', n)
+            self.lines.append('class {}(RepeatAccess):'.format(name))
+            self.lines.append('    __slots__ = ()')
+            return '{}({}(ual, {} + i * 0x{:x}, sh) for i in range({}))'.format(
+                name, el, base, n.c_elsize, n.count)
+        elif isinstance(n, tree.Memory):
+            el = self.gen_block(root, n, n.children)
+            name = self.new_class('Mem', n, self.memory_layout(root, n))
+            self.lines.append('class {}(MemoryAccess):'.format(name))
+            self.lines.append('    __slots__ = ()')
+            self.lines.append('    _element = {}'.format(el))
+            return '{}(ual, {})'.format(name, base)
+        elif isinstance(n, tree.Submap):
+            if n.filename is None:
+                # A bus, nothing to access.
+                return None
+            sub = n.c_submap
+            return '{}(ual, {}, sh)'.format(self.gen_block(sub, n, sub.children), base)
+        elif isinstance(n, (tree.Block, tree.AddressSpace)):
+            return '{}(ual, {}, sh)'.format(self.gen_block(root, n, n.children), base)
+        else:
+            raise AssertionError(n)
+
+    def gen_block(self, root, n, children):
+        inits = []
+        for c in children:
+            expr = self.gen_child(root, c, 'base + 0x{:x}'.format(c.c_address))
+            if expr is not None:
+                inits.append((c.name, expr))
+        name = self.new_class('Block', n)
+        ln = self.lines
+        ln.append('class {}(BlockAccess):'.format(name))
+        ln.append('    def __init__(self, ual, base, sh=None):')
+        ln.append('        self._ual = ual')
+        ln.append('        self._base = base')
+        ln.append('        d = self.__dict__')
+        for cname, expr in inits:
+            ln.append('        d[{!r}] = {}'.format(cname, expr))
+        return name
+
+    def compile(self, root):
+        """Return the accessor class of ROOT"""
+        name = self.gen_block(root, root, root.children)
+        src = '\n'.join(self.lines) + '\n'
+        ns = self.ns
+        exec(compile(src, '<ual {}>'.format(root.name), 'exec'), ns)
+        for cname, node, extra in self.classes:
+            cls = ns[cname]
+            cls._node = node
+            for k, v in extra.items():
+                setattr(cls, k, v)
+        return ns[name]
+
+
+def compile_access(root):
+    """Return the class of the compiled accessor for ROOT (laid out).  It
+    is instantiated with the UAL object, the base address and optionally a
+    ShadowCache"""
+    return AccessCompiler().compile(root)
+
+
+def create_compiled_access(ual, filename, cache=None):
+    root = cheby.parser.parse_yaml(filename)
+    cheby.layout.layout_cheby(root)
+
+    return compile_access(root)(ual, 0, cache)
+
+
+# Block transfers.
+
+class RegValue(int):
+    """The value of a register in a snapshot.  The fields are attributes"""
+    __slots__ = ()
+    _fields = {}
+
+    def __getattr__(self, name):
+        try:
+            shift, mask = self._fields[name]
+        except KeyError:
+            raise AttributeError("no field '{}'".format(name))
+        return (self >> shift) & mask
+
+
+def uint_size(width):
+    """Return the size in bytes of the smallest unsigned integer of numpy
+    for WIDTH bits"""
+    res = 1
+    while res * tree.BYTE_SIZE < width:
+        res *= 2
+    return res
+
+
+def value_type(name, fields):
+    """Return the RegValue subclass for a register NAME with FIELDS"""
+    return type(str(name) + '_value', (RegValue,), {'__slots__': (), '_fields': fields})
+
+
+class BlockSnapshot(object):
+    """The values of the registers of a block, as attributes: a RegValue for
+    a register, a BlockSnapshot for a block and a tuple for a repeat"""
+    def __init__(self, name):
+        self._name = name
+
+    def __repr__(self):
+        return '<snapshot of {}>'.format(self._name)
+
+
+def read_words(ual, word_size, addr, count):
+    """Read COUNT words from ADDR, with one block read if possible"""
+    read_block = getattr(ual, READ_BLOCK_METHODS[word_size], None)
+    if read_block is not None:
+        return read_block(addr, count)
+    read = getattr(ual, READ_METHODS[word_size])
+    return [read(addr + i * word_size) for i in range(count)]
+
+
+def write_words(ual, word_size, addr, words):
+    """Write the sequence WORDS at ADDR, with one block write if possible"""
+    if len(words) == 1:
+        getattr(ual, WRITE_METHODS[word_size])(addr, int(words[0]))
+        return
+    write_block = getattr(ual, WRITE_BLOCK_METHODS[word_size], None)
+    if write_block is not None:
+        write_block(addr, words)
+        return
+    write = getattr(ual, WRITE_METHODS[word_size])
+    for i, w in enumerate(words):
+        write(addr + i * word_size, w)
+
+
+def get_ranges(addrs, word_size):
+    """Return the list of (address, number of words) of the contiguous
+    ranges of the sorted word addresses ADDRS"""
+    res = []
+    for a in addrs:
+        if res and res[-1][0] + res[-1][1] * word_size == a:
+            res[-1][1] += 1
+        else:
+            res.append([a, 1])
+    return res
+
+
+def collect_regs(acc, res, readable=True):
+    """Append to RES the register accessors of ACC (a block or a repeat),
+    without the memories.  Only the readable ones if READABLE"""
+    if isinstance(acc, RegAccess):
+        if not readable or acc._node.access != 'wo':
+            res.append(acc)
+    elif isinstance(acc, RepeatAccess):
+        for el in acc:
+            collect_regs(el, res, readable)
+    elif isinstance(acc, BlockAccess):
+        for k, c in acc.__dict__.items():
+            if k[0] != '_':
+                collect_regs(c, res, readable)
+
+
+class SnapshotPlan(object):
+    """The block reads for a snapshot of the register accessors REGS, and
+    how to decode the registers from the words read"""
+    def __init__(self, regs):
+        # The ranges for each word size.
+        self.ranges = []
+        # For each register: (accessor, index of the range, list of
+        # (index in the range, shift)).
+        self.regs = []
+        for wsize in sorted(set(r._word_size for r in regs)):
+            wregs = [r for r in regs if r._word_size == wsize]
+            addrs = sorted(set(r._addr + off for r in wregs for off, _ in r._words))
+            first = len(self.ranges)
+            ranges = get_ranges(addrs, wsize)
+            self.ranges.extend((wsize, a, n) for a, n in ranges)
+            # Index of the range and position in the range of each word.
+            where = {}
+            for i, (a, n) in enumerate(ranges):
+                for j in range(n):
+                    where[a + j * wsize] = (first + i, j)
+            for r in wregs:
+                words = [(where[r._addr + off], shift) for off, shift in r._words]
+                self.regs.append((r, words[0][0][0], [(w[1], shift) for w, shift in words]))
+
+    def run(self, ual):
+        """Read the ranges.  Return a dict from register accessor to value"""
+        return self.decode([read_words(ual, wsize, a, n) for wsize, a, n in self.ranges])
+
+    def decode(self, data):
+        """Return a dict from register accessor to value, from the words
+        read for each range"""
+        res = {}
+        for r, rng, words in self.regs:
+            d = data[rng]
+            val = 0
+            for j, shift in words:
+                val |= d[j] << shift
+            res[r] = r._value_type(val)
+        return res
+
+
+def build_snapshot(acc, values):
+    if isinstance(acc, RegAccess):
+        return values.get(acc)
+    elif isinstance(acc, RepeatAccess):
+        return tuple(build_snapshot(el, values) for el in acc)
+    elif isinstance(acc, BlockAccess):
+        res = BlockSnapshot(acc._node.name)
+        for k, c in acc.__dict__.items():
+            if k[0] != '_' and not isinstance(c, MemoryAccess):
+                v = build_snapshot(c, values)
+                if v is not None:
+                    res.__dict__[k] = v
+        return res
+    else:
+        return None
+
+
+def read_all(acc):
+    """Read the registers of ACC (a block or a repeat) with block reads.
+    Return a dict from register accessor to value"""
+    plan = acc.__dict__.get('_plan') if isinstance(acc, BlockAccess) else None
+    if plan is None:
+        regs = []
+        collect_regs(acc, regs)
+        plan = SnapshotPlan(regs)
+        if isinstance(acc, BlockAccess):
+            acc.__dict__['_plan'] = plan
+    ual = acc[0]._ual if isinstance(acc, RepeatAccess) else acc._ual
+    return plan.run(ual)
+
+
+def snapshot(acc):
+    """Read all the registers of ACC (a compiled block accessor, or a
+    repeat) with the minimal number of block reads, and return their
+    values (as a BlockSnapshot, or a tuple for a repeat).  Memories and
+    write-only registers are not read"""
+    return build_snapshot(acc, read_all(acc))
+
+
+def bulk_write(writes):
+    """Write the registers of WRITES, a list of (register accessor, value).
+    The contiguous words are written with one block write, in the order of
+    the addresses (so the order of WRITES is not kept)"""
+    # Words to write, per (ual, word size).
+    groups = {}
+    for r, val in writes:
+        wsize = r._word_size
+        mask = (1 << (wsize * tree.BYTE_SIZE)) - 1
+        words = groups.setdefault((r._ual, wsize), {})
+        for off, shift in r._words:
+            words[r._addr + off] = (val >> shift) & mask
+        if r._sh is not None:
+            r._sh.store(r, val)
+    for (ual, wsize), words in groups.items():
+        for a, n in get_ranges(sorted(words), wsize):
+            write_words(ual, wsize, a, [words[a + i * wsize] for i in range(n)])
+
+
+# Shadow registers.
+
+class ShadowCache(object):
+    """The last values written to the registers, so that a field is updated
+    with just a write instead of a read-modify-write (a write-only register
+    cannot be read).  A register not written yet is read once, or is at its
+    reset value if write-only.  The cache must be invalidated if the
+    registers are written by someone else (or reset).
+
+    The bits of the fields modified by the hardware (x-hdl type autoclear,
+    or-clr or or-clr-out) are never cached, and are written as 0 when
+    another field of the register is updated (which doesn't change them).
+    With POLICY 'mask' the other bits of these registers are cached, with
+    POLICY 'bypass' these registers are not cached (read-modify-write)."""
+    def __init__(self, policy='mask'):
+        if policy not in ('mask', 'bypass'):
+            raise ValueError("incorrect shadow policy '{}'".format(policy))
+        self.policy = policy
+        # The values of the registers, by address.
+        self.values = {}
+
+    def cached(self, reg):
+        """True if the value of REG (a register accessor) is cached"""
+        return reg._node.access != 'ro' and not (reg._volatile and self.policy == 'bypass')
+
+    def store(self, reg, val):
+        """Record VAL as written to REG"""
+        if self.cached(reg):
+            self.values[reg._addr] = val & ~reg._volatile
+
+    def update(self, reg, mask, bits):
+        """Return the value to write to REG to set the bits of MASK to BITS,
+        and record it.  Return None if REG is not cached"""
+        if not self.cached(reg):
+            return None
+        vol = reg._volatile
+        val = self.values.get(reg._addr)
+        if val is None:
+            val = reg._preset if reg._node.access == 'wo' else reg.read()
+        val = (val & ~(mask | vol)) | bits
+        self.values[reg._addr] = val & ~vol
+        return val
+
+    def invalidate(self, acc=None):
+        """Forget the values of the registers of ACC (a register, a block or
+        a repeat accessor), or of all the registers"""
+        if acc is None:
+            self.values.clear()
+        elif isinstance(acc, (BlockAccess, RepeatAccess)):
+            regs = []
+            collect_regs(acc, regs, False)
+            for r in regs:
+                self.values.pop(r._addr, None)
+        else:
+            self.values.pop(acc._addr, None)
+
+    def sync(self, acc):
+        """Read the values of the read-write registers of ACC (a block or a
+        repeat accessor), with block reads"""
+        for r, val in read_all(acc).items():
+            if r._node.access == 'rw':
+                self.store(r, val)
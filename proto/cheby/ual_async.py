@@ -0,0 +1,313 @@
+"""Asynchronous access to the registers (asyncio).
+
+The access tree is built once from a laid out tree, like the compiled
+access of cheby.ual, but the accesses are coroutines:
+
+  board = cheby.ual_async.create_access(ual, 'board.cheby')
+  status = await board.status.read()
+  await board.ctrl.set(en=1)
+
+The UAL object must have the coroutine methods readl(ADDR) and
+writel(ADDR, VAL) (readb, readw... for the other word sizes), and
+optionally readl_block(ADDR, COUNT) and writel_block(ADDR, WORDS) for the
+block transfers.  The accesses are not serialized: several accesses to one
+UAL object (pipelined) or to several UAL objects can be in flight, for
+example with asyncio.gather()."""
+
+import asyncio
+import weakref
+
+import cheby.parser
+import cheby.layout
+import cheby.tree as tree
+from cheby.ual import (READ_METHODS, WRITE_METHODS, READ_BLOCK_METHODS,
+                       WRITE_BLOCK_METHODS, BlockSnapshot, SnapshotPlan,
+                       fields_type, value_type, volatile_mask)
+
+
+class AsyncReg(object):
+    """Base class of the register accessors.  A subclass is built once per
+    register node (see reg_class), its instances only bind the address"""
+    __slots__ = ('_ual', '_addr', '_rd', '_wr')
+
+    # The register node and the fields, as a dict from name to (shift, mask).
+    _node = None
+    _fields = {}
+    # The words of the register, as a list of (offset, shift), and their size.
+    _words = ()
+    _word_size = None
+    # The RegValue subclass for the values of the register.
+    _value_type = None
+    # The bits modified by the hardware.
+    _volatile = 0
+
+    def __init__(self, ual, addr):
+        self._ual = ual
+        self._addr = addr
+        self._rd = getattr(ual, READ_METHODS[self._word_size])
+        self._wr = getattr(ual, WRITE_METHODS[self._word_size])
+
+    async def read(self):
+        """Read the register"""
+        if len(self._words) == 1:
+            return await self._rd(self._addr)
+        words = await asyncio.gather(*[self._rd(self._addr + off) for off, _ in self._words])
+        res = 0
+        for w, (_, shift) in zip(words, self._words):
+            res |= w << shift
+        return res
+
+    async def write(self, val):
+        """Write the register"""
+        if len(self._words) == 1:
+            await self._wr(self._addr, val)
+            return
+        mask = (1 << (self._word_size * tree.BYTE_SIZE)) - 1
+        await asyncio.gather(*[self._wr(self._addr + off, (val >> shift) & mask)
+                               for off, shift in self._words])
+
+    async def read_fields(self):
+        """Read the register once and return the values of its fields, as
+        a namedtuple"""
+        val = await self.read()
+        return fields_type(self._node)._make(
+            [(val >> shift) & mask for shift, mask in self._fields.values()])
+
+    async def set(self, **fields):
+        """Set FIELDS (read-modify-write)"""
+        mask = 0
+        bits = 0
+        for name, v in fields.items():
+            if name not in self._fields:
+                raise AttributeError("no field '{}' in {}".format(name, self._node.name))
+            shift, m = self._fields[name]
+            mask |= m << shift
+            bits |= (v & m) << shift
+        val = await self.read()
+        # The bits modified by the hardware are written as 0.
+        await self.write((val & ~(mask | self._volatile)) | bits)
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self._node.name, self._addr)
+
+
+_reg_classes = weakref.WeakKeyDictionary()
+
+
+def reg_class(root, n):
+    """Return the AsyncReg subclass for the register N of ROOT"""
+    res = _reg_classes.get(n)
+    if res is None:
+        wsize = root.c_word_size
+        wbits = wsize * tree.BYTE_SIZE
+        nwords = n.c_nwords
+        fields = {f.name: (f.lo, (1 << f.c_rwidth) - 1)
+                  for f in n.children if f.name is not None}
+        words = tuple(((nwords - 1 - i if root.c_word_endian == 'big' else i) * wsize,
+                       i * wbits) for i in range(nwords))
+        res = type('AsyncReg', (AsyncReg,),
+                   {'__slots__': (), '_node': n, '_fields': fields, '_words': words,
+                    '_word_size': wsize, '_value_type': value_type(n.name, fields),
+                    '_volatile': volatile_mask(n)})
+        _reg_classes[n] = res
+    return res
+
+
+class AsyncBlock(object):
+    """Accessor of the root, of a block, of a submap or of an element of a
+    repeat or of a memory.  The children (ACCESSORS, a dict from name to
+    accessor) are attributes"""
+    def __init__(self, ual, n, base, accessors):
+        self._ual = ual
+        self._node = n
+        self._base = base
+        self.__dict__.update(accessors)
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self._node.name, self._base)
+
+
+class AsyncRepeat(tuple):
+    """The elements of a repeat"""
+    __slots__ = ()
+
+
+class AsyncMemory(object):
+    """Accessor of a memory.  The elements are created on demand by
+    indexing"""
+    def __init__(self, ual, root, n, base):
+        self._ual = ual
+        self._node = n
+        self._base = base
+        # An element smaller than a word uses a word.
+        self._stride = n.c_size // n.c_depth
+        # The registers of an element, as a list of (name, class, offset).
+        self._regs = [(r.name, reg_class(root, r), r.c_address) for r in n.children]
+
+    def __len__(self):
+        return self._node.c_depth
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, int):
+            raise TypeError
+        if idx < 0 or idx >= self._node.c_depth:
+            raise IndexError
+        ual = self._ual
+        addr = self._base + idx * self._stride
+        return AsyncBlock(ual, self._node, addr,
+                          {name: cls(ual, addr + off) for name, cls, off in self._regs})
+
+    def __repr__(self):
+        return '<{} {} at 0x{:x}>'.format(type(self).__name__, self._node.name, self._base)
+
+
+def build_block(ual, root, n, children, base):
+    """Return the accessor of N (a block) with CHILDREN at BASE"""
+    accessors = {}
+    for c in children:
+        acc = build_access(ual, root, c, base + c.c_address)
+        if acc is not None:
+            accessors[c.name] = acc
+    return AsyncBlock(ual, n, base, accessors)
+
+
+def build_access(ual, root, n, base):
+    """Return the accessor of N at BASE (None for a submap without
+    file)"""
+    if isinstance(n, tree.Reg):
+        return reg_class(root, n)(ual, base)
+    elif isinstance(n, tree.Repeat):
+        return AsyncRepeat(build_block(ual, root, n, n.children, base + i * n.c_elsize)
+                           for i in range(n.count))
+    elif isinstance(n, tree.Memory):
+        return AsyncMemory(ual, root, n, base)
+    elif isinstance(n, tree.Submap):
+        if n.filename is None:
+            # A bus, nothing to access.
+            return None
+        return build_block(ual, n.c_submap, n, n.c_submap.children, base)
+    elif isinstance(n, (tree.Block, tree.AddressSpace)):
+        return build_block(ual, root, n, n.children, base)
+    else:
+        raise AssertionError(n)
+
+
+def access(ual, root, base=0):
+    """Return the asynchronous accessor of ROOT (laid out) at BASE"""
+    return build_block(ual, root, root, root.children, base)
+
+
+def create_access(ual, filename):
+    root = cheby.parser.parse_yaml(filename)
+    cheby.layout.layout_cheby(root)
+
+    return access(ual, root)
+
+
+# Block transfers.
+
+async def read_words(ual, word_size, addr, count):
+    """Read COUNT words from ADDR, with one block read if possible (or
+    with pipelined word reads)"""
+    read_block = getattr(ual, READ_BLOCK_METHODS[word_size], None)
+    if read_block is not None:
+        return await read_block(addr, count)
+    read = getattr(ual, READ_METHODS[word_size])
+    return await asyncio.gather(*[read(addr + i * word_size) for i in range(count)])
+
+
+async def write_words(ual, word_size, addr, words):
+    """Write the sequence WORDS at ADDR, with one block write if possible"""
+    write_block = getattr(ual, WRITE_BLOCK_METHODS[word_size], None)
+    if write_block is not None and len(words) > 1:
+        await write_block(addr, words)
+        return
+    write = getattr(ual, WRITE_METHODS[word_size])
+    await asyncio.gather(*[write(addr + i * word_size, w) for i, w in enumerate(words)])
+
+
+def collect_regs(acc, res):
+    """Append to RES the readable register accessors of ACC (a block or a
+    repeat), without the memories"""
+    if isinstance(acc, AsyncReg):
+        if acc._node.access != 'wo':
+            res.append(acc)
+    elif isinstance(acc, AsyncRepeat):
+        for el in acc:
+            collect_regs(el, res)
+    elif isinstance(acc, AsyncBlock):
+        for k, c in acc.__dict__.items():
+            if k[0] != '_':
+                collect_regs(c, res)
+
+
+def build_snapshot(acc, values):
+    if isinstance(acc, AsyncReg):
+        return values.get(acc)
+    elif isinstance(acc, AsyncRepeat):
+        return tuple(build_snapshot(el, values) for el in acc)
+    elif isinstance(acc, AsyncBlock):
+        res = BlockSnapshot(acc._node.name)
+        for k, c in acc.__dict__.items():
+            if k[0] != '_' and not isinstance(c, AsyncMemory):
+                v = build_snapshot(c, values)
+                if v is not None:
+                    res.__dict__[k] = v
+        return res
+    else:
+        return None
+
+
+async def snapshot(acc):
+    """Read all the registers of ACC (a block accessor, or a repeat) with
+    concurrent block reads, and return their values (as a
+    cheby.ual.BlockSnapshot, or a tuple for a repeat).  Memories and
+    write-only registers are not read"""
+    plan = acc.__dict__.get('_plan') if isinstance(acc, AsyncBlock) else None
+    if plan is None:
+        regs = []
+        collect_regs(acc, regs)
+        plan = SnapshotPlan(regs)
+        if isinstance(acc, AsyncBlock):
+            acc.__dict__['_plan'] = plan
+    ual = acc[0]._ual if isinstance(acc, AsyncRepeat) else acc._ual
+    data = await asyncio.gather(*[read_words(ual, wsize, a, n)
+                                  for wsize, a, n in plan.ranges])
+    return build_snapshot(acc, plan.decode(data))
+
+
+class LocalServer(object):
+    """A stand-in for a remote UAL server, for the tests.  It is an
+    asynchronous UAL object: the accesses are done in order on UAL (a
+    synchronous UAL object), and each reply comes after LATENCY seconds as
+    over a network.  Several requests can be in flight"""
+
+    METHODS = (set(READ_METHODS.values()) | set(WRITE_METHODS.values())
+               | set(READ_BLOCK_METHODS.values()) | set(WRITE_BLOCK_METHODS.values()))
+
+    def __init__(self, ual, latency=0.):
+        self.ual = ual
+        self.latency = latency
+        # Statistics.
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, *args):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            res = getattr(self.ual, method)(*args)
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return res
+
+    def __getattr__(self, name):
+        if name not in self.METHODS or not hasattr(self.ual, name):
+            raise AttributeError(name)
+
+        async def method(*args):
+            return await self.request(name, *args)
+        return method
@@ -0,0 +1,174 @@
+"""UAL object over a memory mapping of a file or of a device.
+
+The file can be a PCIe BAR resource file
+(/sys/bus/pci/devices/.../resource0), a UIO device (/dev/uioN), /dev/mem
+(with the physical address as offset) or a regular file to test without
+hardware.  The accesses are done through memoryviews of the mapping cast
+to the size of the access, so that each access is a single load or store
+of the right size.  The byte order is the native one.
+
+BufferUAL is the same UAL object over a buffer in memory (like a
+bytearray)."""
+
+import mmap
+import os
+import stat
+
+# Format of the memoryviews, per size.
+FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+def unaligned(addr, n):
+    return ValueError('unaligned {}-byte access at 0x{:x}'.format(n, addr))
+
+
+class BufferUAL(object):
+    def __init__(self, buf):
+        """Access the writable buffer BUF"""
+        self.init_views(memoryview(buf).cast('B'))
+
+    def init_views(self, whole):
+        size = len(whole)
+        self.size = size
+        # The views per size, the view for size N has (size // N) items.
+        self.views = {n: whole[:size - size % n].cast(fmt) for n, fmt in FORMATS.items()}
+        self.m8 = self.views[1]
+        self.m16 = self.views[2]
+        self.m32 = self.views[4]
+        self.m64 = self.views[8]
+        self.whole = whole
+
+    def close(self):
+        for v in self.views.values():
+            v.release()
+        self.whole.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    @staticmethod
+    def index(addr, n):
+        if addr % n != 0:
+            raise unaligned(addr, n)
+        return addr // n
+
+    def block_index(self, addr, n, count):
+        """Return the index of a block of COUNT words of N bytes at ADDR,
+        which must be within the buffer"""
+        if addr < 0 or addr + count * n > self.size:
+            raise IndexError('block of {} {}-byte words at 0x{:x} out of the buffer'.format(
+                count, n, addr))
+        return self.index(addr, n)
+
+    def readb(self, addr):
+        return self.m8[addr]
+
+    def readw(self, addr):
+        if addr & 1:
+            raise unaligned(addr, 2)
+        return self.m16[addr >> 1]
+
+    def readl(self, addr):
+        if addr & 3:
+            raise unaligned(addr, 4)
+        return self.m32[addr >> 2]
+
+    def readq(self, addr):
+        if addr & 7:
+            raise unaligned(addr, 8)
+        return self.m64[addr >> 3]
+
+    def writeb(self, addr, val):
+        self.m8[addr] = val
+
+    def writew(self, addr, val):
+        if addr & 1:
+            raise unaligned(addr, 2)
+        self.m16[addr >> 1] = val
+
+    def writel(self, addr, val):
+        if addr & 3:
+            raise unaligned(addr, 4)
+        self.m32[addr >> 2] = val
+
+    def writeq(self, addr, val):
+        if addr & 7:
+            raise unaligned(addr, 8)
+        self.m64[addr >> 3] = val
+
+    def view(self, addr, size, word_size):
+        """Return a view (without copy) of SIZE bytes from ADDR, as words of
+        WORD_SIZE bytes.  The view must be released before closing"""
+        count = size // word_size
+        i = self.block_index(addr, word_size, count)
+        return self.views[word_size][i:i + count]
+
+    def read_block(self, word_size, addr, count):
+        """Return the list of COUNT words of WORD_SIZE bytes read from ADDR
+        (a copy, see view())"""
+        i = self.block_index(addr, word_size, count)
+        return self.views[word_size][i:i + count].tolist()
+
+    def write_block(self, word_size, addr, words):
+        i = self.block_index(addr, word_size, len(words))
+        v = self.views[word_size]
+        try:
+            src = memoryview(words)
+        except TypeError:
+            # Not a buffer (like a list).
+            src = None
+        if src is not None and src.format == v.format and src.ndim == 1:
+            v[i:i + len(src)] = src
+        else:
+            for j, w in enumerate(words):
+                v[i + j] = w
+
+    def readb_block(self, addr, count):
+        return self.read_block(1, addr, count)
+
+    def readw_block(self, addr, count):
+        return self.read_block(2, addr, count)
+
+    def readl_block(self, addr, count):
+        return self.read_block(4, addr, count)
+
+    def writeb_block(self, addr, words):
+        self.write_block(1, addr, words)
+
+    def writew_block(self, addr, words):
+        self.write_block(2, addr, words)
+
+    def writel_block(self, addr, words):
+        self.write_block(4, addr, words)
+
+
+class MmapUAL(BufferUAL):
+    def __init__(self, filename, size=None, offset=0):
+        """Map SIZE bytes of FILENAME from OFFSET (by default, the whole
+        file).  SIZE is required for a device (like /dev/uio0 or /dev/mem,
+        whose size is 0): use the size of the map (c_size of the root)"""
+        fd = os.open(filename, os.O_RDWR | getattr(os, 'O_SYNC', 0))
+        try:
+            if size is None:
+                st = os.fstat(fd)
+                if not stat.S_ISREG(st.st_mode):
+                    raise ValueError('the size is required to map {} (not a regular file)'.format(
+                        filename))
+                size = st.st_size - offset
+            if size <= 0:
+                raise ValueError('cannot map {} bytes of {} at offset 0x{:x}'.format(
+                    size, filename, offset))
+            # The offset of a mapping must be a multiple of the page size.
+            delta = offset % mmap.ALLOCATIONGRANULARITY
+            self.mmap = mmap.mmap(fd, size + delta, offset=offset - delta)
+        finally:
+            os.close(fd)
+        self.init_views(memoryview(self.mmap)[delta:delta + size])
+
+    def close(self):
+        # The views must be released before closing the mapping.
+        super(MmapUAL, self).close()
+        self.mmap.close()
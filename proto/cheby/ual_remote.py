@@ -0,0 +1,397 @@
+"""Remote UAL: access to a device through TCP, with many accesses per
+frame.
+
+A request frame is the length of the rest of the frame (u32), followed by
+the operations.  Each operation is:
+
+  op (u8)       the kind (high nibble, see below) and the size of the
+                words in bytes (low nibble: 1, 2, 4 or 8)
+  addr (u64)
+  then for a write: the value (a word)
+       for a block read: the number of words (u32)
+       for a block write: the number of words (u32) and the words
+
+The reply frame is the length of the rest of the frame (u32), the status
+(u8, 0 for success) and then the words read by the operations (in order),
+or the error message (utf-8) if the status is not 0.  The operations are
+done in order and atomically, up to the first error.  All the numbers are
+little-endian.
+
+RemoteServer is the reference server, for any UAL object (like a
+cheby.ual_mmap.MmapUAL or BufferUAL).  RemoteUAL is the client, a UAL
+object for cheby.ual.  In a 'with remote.write_batch():' block, the writes
+are sent with the next read or at the end of the block, so that they need
+only one round trip.  The reads (readl...) return their value, so they are
+still sent at once (with the pending writes): defer_read() and
+defer_read_block() queue reads whose results are available after the
+block."""
+
+import argparse
+import contextlib
+import socket
+import socketserver
+import struct
+import sys
+import threading
+
+import cheby.ual_mmap as ual_mmap
+
+# Kinds of operations.
+OP_READ = 1
+OP_WRITE = 2
+OP_READ_BLOCK = 3
+OP_WRITE_BLOCK = 4
+
+# Struct format of the words, per size.
+FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+SUFFIXES = {1: 'b', 2: 'w', 4: 'l', 8: 'q'}
+
+HEADER = struct.Struct('<I')
+OP = struct.Struct('<BQ')
+OP_COUNT = struct.Struct('<BQI')
+COUNT = struct.Struct('<I')
+WORDS = {n: struct.Struct('<' + fmt) for n, fmt in FORMATS.items()}
+OP_WORDS = {n: struct.Struct('<BQ' + fmt) for n, fmt in FORMATS.items()}
+
+DEFAULT_PORT = 5025
+
+
+class RemoteError(Exception):
+    pass
+
+
+def recv_exact(sock, n):
+    """Receive N bytes from SOCK.  Return None if the connection is closed
+    before the first byte"""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        r = sock.recv_into(view[pos:])
+        if r == 0:
+            if pos == 0:
+                return None
+            raise RemoteError('connection closed within a frame')
+        pos += r
+    return buf
+
+
+def recv_frame(sock):
+    hdr = recv_exact(sock, HEADER.size)
+    if hdr is None:
+        return None
+    res = recv_exact(sock, HEADER.unpack(hdr)[0])
+    if res is None:
+        raise RemoteError('connection closed within a frame')
+    return res
+
+
+def pack_words(size, words):
+    """Return the encoding of the sequence WORDS of SIZE bytes"""
+    if sys.byteorder == 'little' and isinstance(words, memoryview) \
+       and words.format == FORMATS[size]:
+        return words.tobytes()
+    return struct.pack('<{}{}'.format(len(words), FORMATS[size]), *words)
+
+
+def unpack_words(size, data, off, count):
+    """Return COUNT words of SIZE bytes decoded from DATA at OFF"""
+    if sys.byteorder == 'little':
+        # Without copy.
+        return memoryview(data)[off:off + count * size].cast(FORMATS[size])
+    return struct.unpack_from('<{}{}'.format(count, FORMATS[size]), data, off)
+
+
+# Server.
+
+class Device(object):
+    """The methods of a UAL object, per (kind, size)"""
+    def __init__(self, ual):
+        self.ual = ual
+        self.methods = {}
+        for n, sfx in SUFFIXES.items():
+            read = getattr(ual, 'read' + sfx, None)
+            write = getattr(ual, 'write' + sfx, None)
+            if read is not None:
+                self.methods[(OP_READ, n)] = read
+                if hasattr(ual, 'view'):
+                    # Encoded without an intermediate list.
+                    self.methods[(OP_READ_BLOCK, n)] = self.view_block_method(ual.view, n)
+                else:
+                    self.methods[(OP_READ_BLOCK, n)] = getattr(
+                        ual, 'read{}_block'.format(sfx), self.read_block_method(read, n))
+            if write is not None:
+                self.methods[(OP_WRITE, n)] = write
+                self.methods[(OP_WRITE_BLOCK, n)] = getattr(
+                    ual, 'write{}_block'.format(sfx), self.write_block_method(write, n))
+
+    @staticmethod
+    def read_block_method(read, n):
+        return lambda addr, count: [read(addr + i * n) for i in range(count)]
+
+    @staticmethod
+    def view_block_method(view, n):
+        return lambda addr, count: view(addr, count * n, n)
+
+    @staticmethod
+    def write_block_method(write, n):
+        def write_block(addr, words):
+            for i, w in enumerate(words):
+                write(addr + i * n, w)
+        return write_block
+
+    def execute(self, frame):
+        """Execute the operations of the request FRAME, return the reply
+        (without the length)"""
+        res = bytearray(b'\0')
+        off = 0
+        nop = 0
+        try:
+            while off < len(frame):
+                nop += 1
+                op, addr = OP.unpack_from(frame, off)
+                off += OP.size
+                kind = op >> 4
+                n = op & 0xf
+                method = self.methods.get((kind, n))
+                if method is None:
+                    raise RemoteError('unhandled operation 0x{:02x}'.format(op))
+                if kind == OP_READ:
+                    res += WORDS[n].pack(method(addr))
+                elif kind == OP_WRITE:
+                    method(addr, WORDS[n].unpack_from(frame, off)[0])
+                    off += n
+                elif kind == OP_READ_BLOCK:
+                    count = COUNT.unpack_from(frame, off)[0]
+                    off += COUNT.size
+                    words = method(addr, count)
+                    if len(words) != count:
+                        raise RemoteError('block read of {} words returned {}'.format(
+                            count, len(words)))
+                    res += pack_words(n, words)
+                else:
+                    count = COUNT.unpack_from(frame, off)[0]
+                    off += COUNT.size
+                    if off + count * n > len(frame):
+                        raise RemoteError('truncated block write')
+                    method(addr, unpack_words(n, frame, off, count))
+                    off += count * n
+        except Exception as e:
+            return b'\1' + 'operation {}: {}'.format(nop, e).encode('utf-8')
+        return res
+
+
+class RemoteHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                frame = recv_frame(sock)
+            except (RemoteError, OSError):
+                return
+            if frame is None:
+                return
+            with self.server.lock:
+                reply = self.server.device.execute(frame)
+            sock.sendall(HEADER.pack(len(reply)) + reply)
+
+
+class RemoteServer(socketserver.ThreadingTCPServer):
+    """The reference server: serve UAL (a UAL object) on ADDRESS, a (host,
+    port) tuple.  The frames of the clients are executed one at a time"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, ual):
+        self.device = Device(ual)
+        self.lock = threading.Lock()
+        super(RemoteServer, self).__init__(address, RemoteHandler)
+
+
+# Client.
+
+class Pending(object):
+    """The result of a deferred read, available after the batch as
+    'value'"""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = None
+
+
+class RemoteUAL(object):
+    def __init__(self, host, port=DEFAULT_PORT, timeout=None):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The request being built, and the (size, count, Pending) of its
+        # reads (count is None for a word read).
+        self.frame = bytearray()
+        self.reads = []
+        # Depth of the write_batch blocks.
+        self.batch_depth = 0
+        self.round_trips = 0
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    @contextlib.contextmanager
+    def write_batch(self):
+        """Context manager: the writes (and the deferred reads) within the
+        block are sent with the next read or at the end of the block.  If
+        the block raises an exception, the operations not sent yet are
+        discarded"""
+        self.batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.frame = bytearray()
+            self.reads = []
+            raise
+        finally:
+            self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self.flush()
+
+    def flush(self):
+        """Send the pending operations and wait for the reply"""
+        if not self.frame:
+            return
+        frame, reads = self.frame, self.reads
+        self.frame = bytearray()
+        self.reads = []
+        self.sock.sendall(HEADER.pack(len(frame)) + frame)
+        reply = recv_frame(self.sock)
+        if reply is None:
+            raise RemoteError('connection closed by the server')
+        self.round_trips += 1
+        if reply[0] != 0:
+            raise RemoteError(reply[1:].decode('utf-8', 'replace'))
+        size = 1 + sum(n if count is None else count * n for n, count, _ in reads)
+        if len(reply) != size:
+            raise RemoteError('reply of {} bytes instead of {}'.format(len(reply), size))
+        off = 1
+        for n, count, p in reads:
+            if count is None:
+                p.value = WORDS[n].unpack_from(reply, off)[0]
+                off += n
+            else:
+                p.value = list(unpack_words(n, reply, off, count))
+                off += count * n
+
+    def defer_read(self, size, addr):
+        """Add a read of a word of SIZE bytes at ADDR to the request.
+        Return a Pending whose value is set when the request is sent"""
+        p = Pending()
+        self.frame += OP.pack((OP_READ << 4) | size, addr)
+        self.reads.append((size, None, p))
+        return p
+
+    def defer_read_block(self, size, addr, count):
+        """Add a read of COUNT words of SIZE bytes from ADDR to the
+        request.  Return a Pending whose value is set when the request is
+        sent"""
+        p = Pending()
+        self.frame += OP_COUNT.pack((OP_READ_BLOCK << 4) | size, addr, count)
+        self.reads.append((size, count, p))
+        return p
+
+    def read(self, size, addr):
+        # The value is returned, so the request is sent at once (also
+        # within a write_batch block).
+        p = self.defer_read(size, addr)
+        self.flush()
+        return p.value
+
+    def write(self, size, addr, val):
+        self.frame += OP_WORDS[size].pack((OP_WRITE << 4) | size, addr, val)
+        if self.batch_depth == 0:
+            self.flush()
+
+    def read_block(self, size, addr, count):
+        p = self.defer_read_block(size, addr, count)
+        self.flush()
+        return p.value
+
+    def write_block(self, size, addr, words):
+        self.frame += OP_COUNT.pack((OP_WRITE_BLOCK << 4) | size, addr, len(words))
+        self.frame += pack_words(size, words)
+        if self.batch_depth == 0:
+            self.flush()
+
+    def readb(self, addr):
+        return self.read(1, addr)
+
+    def readw(self, addr):
+        return self.read(2, addr)
+
+    def readl(self, addr):
+        return self.read(4, addr)
+
+    def readq(self, addr):
+        return self.read(8, addr)
+
+    def writeb(self, addr, val):
+        self.write(1, addr, val)
+
+    def writew(self, addr, val):
+        self.write(2, addr, val)
+
+    def writel(self, addr, val):
+        self.write(4, addr, val)
+
+    def writeq(self, addr, val):
+        self.write(8, addr, val)
+
+    def readb_block(self, addr, count):
+        return self.read_block(1, addr, count)
+
+    def readw_block(self, addr, count):
+        return self.read_block(2, addr, count)
+
+    def readl_block(self, addr, count):
+        return self.read_block(4, addr, count)
+
+    def writeb_block(self, addr, words):
+        self.write_block(1, addr, words)
+
+    def writew_block(self, addr, words):
+        self.write_block(2, addr, words)
+
+    def writel_block(self, addr, words):
+        self.write_block(4, addr, words)
+
+
+def main():
+    aparser = argparse.ArgumentParser(description='cheby remote UAL server')
+    aparser.add_argument('--host', default='localhost',
+                         help='address to listen on (default: localhost)')
+    aparser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                         help='port to listen on (default: {})'.format(DEFAULT_PORT))
+    aparser.add_argument('--mmap', metavar='FILE',
+                         help='serve a memory mapping of FILE (instead of a memory)')
+    aparser.add_argument('--size', type=int,
+                         help='size in bytes of the memory (default: 64KB) or of the mapping '
+                         '(default: the size of FILE, required for a device)')
+    args = aparser.parse_args()
+
+    if args.mmap:
+        try:
+            ual = ual_mmap.MmapUAL(args.mmap, args.size)
+        except (OSError, ValueError) as e:
+            sys.stderr.write('error: {}\n'.format(e))
+            sys.exit(2)
+    else:
+        ual = ual_mmap.BufferUAL(bytearray(args.size or 0x10000))
+    with RemoteServer((args.host, args.port), ual) as server:
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""Watch mode: regenerate the outputs when the input files change.
+
+The files watched are the input, all the submaps it loads (transitively)
+and the custom script.  They are watched with inotify when available
+(Linux), otherwise by polling their modification time.
+
+The yaml documents and the laid out submaps are kept in memory (see
+parser.DocumentCache and layout.SubmapCache), so only the modified files
+are read again, and only the modified submaps and the maps that include
+them are laid out again.  A file whose document hasn't changed (only
+comments or layout were modified) doesn't trigger a rebuild, and a
+modification of the custom script only runs --gen-custom.  The outputs
+that are unchanged are not rewritten (see output.py)."""
+
+import copy
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+import cheby.main
+import cheby.parser as parser
+import cheby.layout as layout
+import cheby.output as output
+import cheby.pipeline as pipeline
+
+
+# inotify events.
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Editors write a file in several steps: wait until the files are quiet
+# for this delay (in seconds) before reporting a change.
+SETTLE_DELAY = 0.1
+
+
+class InotifyWatcher(object):
+    """Watch files with inotify.  The directories are watched (and not the
+    files), so that files replaced by a rename are still watched."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # Watched directories, by watch descriptor.
+        self.dirs = {}
+        # Watched files, by real path.
+        self.files = {}
+
+    def set_files(self, files):
+        self.files = {os.path.realpath(f): f for f in files}
+        dirs = set(os.path.dirname(f) for f in self.files)
+        for wd, d in list(self.dirs.items()):
+            if d not in dirs:
+                # The events already queued for it are ignored.
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.dirs[wd]
+        for d in dirs:
+            if d not in self.dirs.values():
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(d), IN_MASK)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(),
+                                  'cannot watch {}'.format(d))
+                self.dirs[wd] = d
+
+    def read_events(self, changed):
+        data = os.read(self.fd, 1 << 16)
+        off = 0
+        while off < len(data):
+            wd, _mask, _cookie, length = struct.unpack_from('iIII', data, off)
+            off += 16
+            name = os.fsdecode(data[off:off + length].rstrip(b'\0'))
+            off += length
+            path = os.path.join(self.dirs.get(wd, ''), name)
+            if path in self.files:
+                changed.add(self.files[path])
+
+    def wait(self, timeout=None):
+        """Wait until some files are modified.  Return the list of the
+        modified files (empty after TIMEOUT seconds)"""
+        changed = set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if changed:
+                delay = SETTLE_DELAY
+            elif deadline is None:
+                delay = None
+            else:
+                delay = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd], [], [], delay)
+            if ready:
+                self.read_events(changed)
+            elif changed or deadline is not None:
+                return sorted(changed)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher(object):
+    """Watch files by polling their modification time and size"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.stamps = {}
+
+    @staticmethod
+    def get_stamp(filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def set_files(self, files):
+        self.stamps = {f: self.get_stamp(f) for f in files}
+
+    def wait(self, timeout=None):
+        """See InotifyWatcher.wait"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(self.interval)
+            changed = [f for f, s in self.stamps.items()
+                       if self.get_stamp(f) != s]
+            if changed:
+                time.sleep(SETTLE_DELAY)
+                for f in changed:
+                    self.stamps[f] = self.get_stamp(f)
+                return sorted(changed)
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+
+    def close(self):
+        pass
+
+
+def get_watcher(interval=0.5):
+    """Return an InotifyWatcher, or a PollWatcher if inotify is not
+    available"""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError, TypeError):
+        # TypeError: no libc found.
+        return PollWatcher(interval)
+
+
+class Watch(object):
+    """The state of a watch: the arguments and the files read"""
+
+    def __init__(self, args):
+        self.args = copy.copy(args)
+        if args.options.document_cache is None:
+            self.args.options = args.options.replace(
+                document_cache=parser.DocumentCache())
+        if args.options.submap_cache is None:
+            self.args.options = self.args.options.replace(
+                submap_cache=layout.SubmapCache())
+        self.cache = self.args.options.document_cache
+        # The files read by the last build.
+        self.files = [args.input]
+        self.custom = None
+        if args.gen_custom is not None:
+            self.custom = args.custom
+
+    def get_generators(self, changed):
+        """Return the generators to run after CHANGED files were modified
+        (None for all of them)"""
+        if changed is None:
+            return None
+        docs = [f for f in changed if f != self.custom]
+        # Use a list to refresh all the documents.
+        if any([self.cache.refresh(f) for f in docs]):
+            return None
+        return [g for g in cheby.main.get_generators()
+                if g.name == 'gen_custom' and self.custom in changed]
+
+    def build(self, changed=None):
+        """Regenerate the outputs after CHANGED files (all when None) were
+        modified.  Return a summary of the build"""
+        gens = self.get_generators(changed)
+        if gens == []:
+            return 'no change'
+        if gens is None:
+            gens = cheby.main.get_generators()
+        outputs = output.OutputSet()
+        start = time.perf_counter()
+        try:
+            t = pipeline.run(cheby.main.get_stages(), gens, self.args, outputs,
+                             ['layout'], self.args.jobs)
+        except parser.ParseException as e:
+            return "error: {}:{}".format(self.args.input, e)
+        except layout.LayoutException as e:
+            return "error: {}".format(e)
+        except cheby.main.UsageException as e:
+            return "error: {}".format(e)
+        except SystemExit as e:
+            return "error: exit with status {}".format(e.code)
+        except Exception as e:
+            return "error: {}: {}".format(type(e).__name__, e)
+        self.files = layout.get_input_filenames(t)
+        if self.custom is not None and os.path.isfile(self.custom):
+            self.files.append(self.custom)
+        return "built in {:.3f}s ({})".format(
+            time.perf_counter() - start, outputs.summary())
+
+
+def run_watch(args, interval=0.5):
+    """Build the outputs of ARGS, and rebuild them when the files read
+    change, until interrupted"""
+    w = Watch(args)
+    watcher = get_watcher(interval)
+    sys.stderr.write("cheby: {}\n".format(w.build()))
+    try:
+        while True:
+            # After an error, the files of the last correct build (or the
+            # input) are watched.
+            watcher.set_files(w.files)
+            changed = watcher.wait()
+            sys.stderr.write("cheby: {} changed: {}\n".format(
+                ', '.join(changed), w.build(changed)))
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()
@@ -5,9 +5,19 @@ def w(fd, s):
 
 
 def wln(fd, s=""):
-    fd.write(s)
-    fd.write('\n')
+    fd.write(s + '\n')
 
 
 def windent(fd, indent):
     w(fd, '  ' * indent)
+
+
+class StringList(object):
+    """A file-like object that only collects the strings written, so that
+    a whole unit is written with a single join"""
+    def __init__(self):
+        self.parts = []
+        self.write = self.parts.append
+
+    def getvalue(self):
+        return ''.join(self.parts)
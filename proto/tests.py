@@ -2,8 +2,17 @@
 """Simple test program"""
 import sys
 import os
+import io
+import re
+import contextlib
 import subprocess
+import time
 import argparse
+import tempfile
+import asyncio
+import threading
+import importlib.util
+import concurrent.futures
 import cheby.parser as parser
 import cheby.layout as layout
 import cheby.print_pretty as pprint
@@ -28,7 +37,21 @@ import cheby.print_latex as print_latex
 import cheby.print_rest as print_rest
 import cheby.gen_custom as gen_custom
 import cheby.gen_edge3 as gen_edge3
-from cheby.hdl.globals import gconfig
+import cheby.output as output
+import cheby.depfile as depfile
+import cheby.batch as batch
+import cheby.pipeline as pipeline
+import cheby.api as api
+import cheby.watch as watch
+import cheby.server as server
+import cheby.artifact_cache as artifact_cache
+import cheby.ual as ual
+import cheby.ual_mmap as ual_mmap
+import cheby.ual_async as ual_async
+import cheby.ual_remote as ual_remote
+import cheby.model as model
+import cheby.main
+from cheby.options import Options
 
 srcdir = os.path.join(os.path.dirname(os.path.realpath(__file__)),
                       '../testfiles/')
@@ -71,13 +94,97 @@ class write_buffer(object):
     def get(self):
         return self.buffer
 
-def elab_vhdl(vhdl_file):
+
+class VhdlChecker(object):
+    """Check VHDL files with ghdl, by batches.
+
+    The packages are analysed once in a work library, then the files are
+    checked BATCH at a time.  A batch never has two files declaring the
+    same design unit, as the second one would replace the first one, nor
+    two files generated from the same cheby file (like the -consts.vhdl
+    and -consts.vhdl-ohwr files).  When a batch fails, its files are
+    checked one by one to find the culprits."""
+
+    unit_re = re.compile(r'^\s*(?:entity|package)\s+(\w+)\s+is\b', re.I | re.M)
+
+    def __init__(self, batch):
+        self.batch = batch
+        # List of (vhdl file, cheby file) not yet checked, and the design
+        # units and the cheby files of the batch.
+        self.pending = []
+        self.units = set()
+        self.sources = set()
+        self.workdir = None
+
+    def ghdl(self, cmd, files, quiet=False):
+        out = subprocess.DEVNULL if quiet else None
+        res = subprocess.run(['ghdl', cmd, '--workdir=' + self.workdir.name] + files,
+                             stdout=out, stderr=out)
+        return res.returncode == 0
+
+    def add(self, vhdl_file, cheby_file):
+        with open(vhdl_file) as f:
+            units = set(u.lower() for u in self.unit_re.findall(f.read()))
+        if units & self.units or cheby_file in self.sources:
+            self.flush()
+        self.pending.append((vhdl_file, cheby_file))
+        self.units |= units
+        self.sources.add(cheby_file)
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        self.units = set()
+        self.sources = set()
+        if not pending:
+            return
+        if self.workdir is None:
+            self.workdir = tempfile.TemporaryDirectory()
+            if not self.ghdl('-a', [srcdir + 'tb/cheby_pkg.vhd', srcdir + 'tb/wishbone_pkg.vhd']):
+                self.workdir = None
+                error('VHDL analysis of the packages failed')
+                # With --keep, the files are not checked.
+                for vhdl_file, cheby_file in pending:
+                    error('VHDL elaboration failed for {} (from {})'.format(vhdl_file, cheby_file))
+                return
+        if self.ghdl('-s', ['-Werror=runtime-error'] + [f for f, _ in pending], True):
+            return
+        for vhdl_file, cheby_file in pending:
+            if not self.ghdl('-s', ['-Werror=runtime-error', vhdl_file]):
+                error('VHDL elaboration failed for {} (from {})'.format(vhdl_file, cheby_file))
+
+
+vhdl_checker = None
+
+# In a worker (with --jobs), the VHDL files to check, as (vhdl file, cheby
+# file).  They are checked by the main process, in batches across the jobs.
+worker_elab = None
+
+
+def elab_vhdl(vhdl_file, cheby_file):
     """Function to elaborate VHDL"""
+    global vhdl_checker
+    if args.elab_batch > 0:
+        if worker_elab is not None:
+            worker_elab.append((vhdl_file, cheby_file))
+            return
+        if vhdl_checker is None:
+            vhdl_checker = VhdlChecker(args.elab_batch)
+        vhdl_checker.add(vhdl_file, cheby_file)
+        return
     vhdl_pkgs = [srcdir + 'tb/cheby_pkg.vhd', srcdir + 'tb/wishbone_pkg.vhd']
     res = subprocess.run(['ghdl', '-s', '-Werror=runtime-error'] + vhdl_pkgs + [vhdl_file])
     if res.returncode != 0:
         error('VHDL elaboration failed for {}'.format(vhdl_file))
 
+
+def flush_elab():
+    """Check the VHDL files not yet checked"""
+    if vhdl_checker is not None:
+        vhdl_checker.flush()
+
+
 def elab_sv(sv_file, top_entity):
     """Function to elaborate SV/Verilog"""
     # Allow the definition of a different verilator command
@@ -99,6 +206,75 @@ def check_c_syntax(c_file):
     if res.returncode != 0:
         error('C syntax check failed for {}'.format(c_file))
 
+
+# With --jobs, the pool of worker processes, and the jobs submitted to it
+# as (test, file, future).
+pool = None
+jobs = []
+
+
+def init_worker(wargs):
+    global args, pool, worker_elab
+    args = wargs
+    pool = None
+    worker_elab = []
+
+
+def run_job(name, f):
+    """Run test NAME (on file F if not None) in a worker.  Return the number
+    of tests, the outputs, the error message (or None) and the VHDL files
+    to check"""
+    global nbr_tests
+    nbr_tests = 0
+    del worker_elab[:]
+    out = io.StringIO()
+    err = io.StringIO()
+    msg = None
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            if f is None:
+                globals()[name]()
+            else:
+                globals()[name](f)
+        except TestError as e:
+            msg = e.msg
+    return nbr_tests, out.getvalue(), err.getvalue(), msg, list(worker_elab)
+
+
+def run_test(func):
+    """Run test FUNC, or submit it to the pool"""
+    if pool is None:
+        func()
+    else:
+        jobs.append((func.__name__, None, pool.submit(run_job, func.__name__, None)))
+
+
+def run_files(func, files):
+    """Call FUNC for each file of FILES, or submit them to the pool"""
+    for f in files:
+        if pool is None:
+            func(f)
+        else:
+            jobs.append((func.__name__, f, pool.submit(run_job, func.__name__, f)))
+
+
+def wait_jobs():
+    """Collect the results of the jobs, in the order of submission, and
+    check their VHDL files"""
+    global nbr_tests
+    for name, f, fut in jobs:
+        n, out, err, msg, elab = fut.result()
+        nbr_tests += n
+        sys.stdout.write(out)
+        sys.stderr.write(err)
+        if msg is not None:
+            raise TestError('{} (in {}{})'.format(
+                msg, name, '' if f is None else ' for ' + f))
+        for vhdl_file, cheby_file in elab:
+            elab_vhdl(vhdl_file, cheby_file)
+    flush_elab()
+
+
 def parse_ok(f):
     try:
         return parser.parse_yaml(f)
@@ -268,74 +444,82 @@ def compare_buffer_and_file(buf, filename):
     return False
 
 
-def test_genc_ref():
+def genc_ref_file(f):
     global nbr_tests
-    for f in ['issue103/top',
-              'bug-gen-c-02/mbox_regs', 'bug-gen-c-02/fip_urv_regs',
-              'issue67/repeatInRepeat', 'issue67/repeatInRepeatC',
-              'bug-same-label/same_label',
-              'features/blkprefix3', 'features/blkprefix5']:
-        h_file = srcdir + f + '.h'
-        cheby_file = srcdir + f + '.cheby'
-        t = parse_ok(cheby_file)
-        layout_ok(t)
-        gen_name.gen_name_memmap(t)
-        buf = write_buffer()
-        gen_c.gen_c_cheby(buf, t, 'neutral')
-        if not compare_buffer_and_file(buf, h_file):
-            error('c header generation error for {}'.format(f))
-        
-        # Check C syntax
-        # Note: Exclude issue103/top because it includes other header files
-        # not generated here.
-        if f != 'issue103/top' and args.elaborate:
-            check_c_syntax(h_file)
-        nbr_tests += 1
+    h_file = srcdir + f + '.h'
+    cheby_file = srcdir + f + '.cheby'
+    t = parse_ok(cheby_file)
+    layout_ok(t)
+    gen_name.gen_name_memmap(t)
+    buf = write_buffer()
+    gen_c.gen_c_cheby(buf, t, 'neutral')
+    if not compare_buffer_and_file(buf, h_file):
+        error('c header generation error for {}'.format(f))
 
+    # Check C syntax
+    # Note: Exclude issue103/top because it includes other header files
+    # not generated here.
+    if f != 'issue103/top' and args.elaborate:
+        check_c_syntax(h_file)
+    nbr_tests += 1
 
-def test_hdl():
-    # Just generate vhdl (without baseline)
+
+def test_genc_ref():
+    run_files(genc_ref_file,
+              ['issue103/top',
+               'bug-gen-c-02/mbox_regs', 'bug-gen-c-02/fip_urv_regs',
+               'issue67/repeatInRepeat', 'issue67/repeatInRepeatC',
+               'bug-same-label/same_label',
+               'features/blkprefix3', 'features/blkprefix5'])
+
+
+def hdl_file(f):
     global nbr_tests
     fd = write_null()
-    for f in ['features/simple_reg3', 'features/simple_reg4_ro',
-              'features/reg_value1', 'features/reg_value2', 'features/reg_value3',
-              'features/field_value1', 'features/field_value2',
-              'features/field_range1',
-              'features/submap_align1',
-              'wb_slave_vic',
-              '../examples/svec-leds/leds',
-              'inter-mt/mt_cpu_xb',
-              'inter-mt/mt_cpu_xb-include',
-              'inter-mt/mt_cpu_xb-extern',
-              'inter-mt/mt_cpu_xb-busgroup',
-              'inter-mt/mt_cpu_xb-busgroup2',
-              'inter-mt/mt_cpu_lr-busgroup',
-              'demo_all', 'features/big_addr', 'issue24/map_arrays',
-              'features/cern_info', 'issue22/map_ro', 'issue22/map_rw',
-              'demo_all_old',
-              'access/const_ro', 'access/const_rw',
-              'access/autoclear_rw', 'access/autoclear_wo',
-              'access/orclr_rw', 'issue46/types', 'issue58/port',
-              'issue60/busgroup-axi4', 'issue60/busgroup-cernbe',
-              'issue60/busgroup-filename', 'issue60/busgroup-include',
-              'issue60/busgroup-interface', 'issue82/m1',
-              'issue95/m1', 'issue95/m2', 'issue95/m3', 'issue95/sm1', 'issue95/sm3',
-              'features/avalon-noaddr', 'issue129/acdipole_ip', 'issue129/acdipole_ip-orig',
-              'issue67/repeatInRepeat']:
-        if args.verbose:
-            print('test hdl: {}'.format(f))
-        t = parse_ok(srcdir + f + '.cheby')
-        layout_ok(t)
-        expand_hdl.expand_hdl(t)
-        gen_name.gen_name_memmap(t)
-        if t.c_address_spaces_map is None:
-            h = gen_hdl.generate_hdl(t)
+    if args.verbose:
+        print('test hdl: {}'.format(f))
+    t = parse_ok(srcdir + f + '.cheby')
+    layout_ok(t)
+    expand_hdl.expand_hdl(t)
+    gen_name.gen_name_memmap(t)
+    if t.c_address_spaces_map is None:
+        h = gen_hdl.generate_hdl(t)
+        print_vhdl.print_vhdl(fd, h)
+    else:
+        for sp in t.children:
+            h = gen_hdl.generate_hdl(sp)
             print_vhdl.print_vhdl(fd, h)
-        else:
-            for sp in t.children:
-                h = gen_hdl.generate_hdl(sp)
-                print_vhdl.print_vhdl(fd, h)
-        nbr_tests += 1
+    nbr_tests += 1
+
+
+def test_hdl():
+    # Just generate vhdl (without baseline)
+    run_files(hdl_file,
+              ['features/simple_reg3', 'features/simple_reg4_ro',
+               'features/reg_value1', 'features/reg_value2', 'features/reg_value3',
+               'features/field_value1', 'features/field_value2',
+               'features/field_range1',
+               'features/submap_align1',
+               'wb_slave_vic',
+               '../examples/svec-leds/leds',
+               'inter-mt/mt_cpu_xb',
+               'inter-mt/mt_cpu_xb-include',
+               'inter-mt/mt_cpu_xb-extern',
+               'inter-mt/mt_cpu_xb-busgroup',
+               'inter-mt/mt_cpu_xb-busgroup2',
+               'inter-mt/mt_cpu_lr-busgroup',
+               'demo_all', 'features/big_addr', 'issue24/map_arrays',
+               'features/cern_info', 'issue22/map_ro', 'issue22/map_rw',
+               'demo_all_old',
+               'access/const_ro', 'access/const_rw',
+               'access/autoclear_rw', 'access/autoclear_wo',
+               'access/orclr_rw', 'issue46/types', 'issue58/port',
+               'issue60/busgroup-axi4', 'issue60/busgroup-cernbe',
+               'issue60/busgroup-filename', 'issue60/busgroup-include',
+               'issue60/busgroup-interface', 'issue82/m1',
+               'issue95/m1', 'issue95/m2', 'issue95/m3', 'issue95/sm1', 'issue95/sm3',
+               'features/avalon-noaddr', 'issue129/acdipole_ip', 'issue129/acdipole_ip-orig',
+               'issue67/repeatInRepeat'])
 
 def expand_hdl_err(t):
     try:
@@ -389,96 +573,97 @@ def test_hdl_err():
             assert(str(e) != '')
         nbr_tests += 1
 
-def test_hdl_ref():
-    # Generate HDL, compare with a baseline and potentially elaborate.
+def hdl_ref_file(f):
     global nbr_tests
-
-    for f in ['fmc-adc01/fmc_adc_alt_trigin', 'fmc-adc01/fmc_adc_alt_trigout',
-              'issue9/test', 'issue10/test',
-              'issue8/simpleMap_bug', 'issue8/simpleMap_noBug',
-              'issue14/test-axi', 'issue14/test-be', 'issue14/test-le',
-              'issue11/test_port1_reg', 'issue11/test_port1',
-              'issue11/test_port1_field',
-              'issue11/test_port2_reg', 'issue11/test_port2_wire',
-              'issue13/mainMap2', 'memory01/mainMap',
-              'memory01/sramro', 'memory01/sramwo', 'memory01/sramrw',
-              'issue39/addressingMemory',
-              'issue40/bugConstraints',
-              'issue41/bugBlockFields',
-              'issue45/test8', 'issue45/test16',
-              'features/wires1', 'features/semver1', 'features/semver2',
-              'features/mapinfo2',
-              'features/enums1', 'features/enums2',
-              'features/orclrout_rw',
-              'features/blkprefix1', 'features/blkprefix2', 'features/blkprefix3',
-              'features/blkprefix4', 'features/blkprefix5',
-              'features/regprefix1', 'features/regprefix2', 'features/regprefix3',
-              'features/mem64ro', 'features/mem64rodual',
-              'features/iogroup1', 'features/iogroup2', 'features/repeat-iogroup1',
-              'features/repeat-iogroup2', 'features/repeat-iogroup3',
-              'features/repeat-iogroup4',
-              'features/no_port', 'features/memwide',
-              'issue52/hwInfo',
-              'bug-gen_wt/m1',
-              'issue59/inherit', 'issue64/simple_reg1', 'issue66/m1',
-              'issue44/m1', 'issue75/m1',
-              'features/xilinx_attrs', 'features/xilinx_attrs_cern',
-              'features/axi4_byte', 'features/axi4_word', 'features/axi4_submap_wb',
-              'features/reg128', 'features/reg-strobe',
-              'issue77/m1', 'issue77/m2', 'issue77/m3',
-              'issue77/s1', 'issue77/s2', 'issue77/s3', 'issue77/s4',
-              'issue77/s5', 'issue77/s6',
-              'issue79/CSR', 'bug-memory/mem64ro', 'issue87/qsm_regs', 'issue89/map',
-              'issue92/blockInMap', 'issue90/bugDPSSRAMbwSel',
-              'bug-repmem/bran', 'bug-empty/noout', 'bug-empty/noinp',
-              'bug-cernbe/repro', 'bug-cernbe/sub_repro']:
-        if args.verbose:
-            print('test hdl with ref: {}'.format(f))
-        cheby_file = srcdir + f + '.cheby'
-        vhdl_file = srcdir + f + '.vhdl'
-        verilog_file = srcdir + f + '.v'
-        sv_file = srcdir + f + '.sv'
-        t = parse_ok(cheby_file)
-        layout_ok(t)
-        expand_hdl.expand_hdl(t)
-        gen_name.gen_name_memmap(t)
-        h = gen_hdl.generate_hdl(t)
-
-        # Generate VHDL
-        buf_vhdl = write_buffer()
-        print_vhdl.print_vhdl(buf_vhdl, h)
-        if not compare_buffer_and_file(buf_vhdl, vhdl_file):
-            error('vhdl generation error for {}'.format(f))
-
-        # Generate SV
-        gconfig.hdl_lang = 'sv'
-        buf_sv = write_buffer()
-        print_verilog.print_verilog(buf_sv, h)
-        if not compare_buffer_and_file(buf_sv, sv_file):
-            error('SV generation error for {}'.format(f))
-
-        # Generate Verilog
-        gconfig.hdl_lang = 'verilog'
-        buf_verilog = write_buffer()
-        print_verilog.print_verilog(buf_verilog, h)
-        if not compare_buffer_and_file(buf_verilog, verilog_file):
-            error('Verilog generation error for {}'.format(f))
-        gconfig.hdl_lang = None
+    if args.verbose:
+        print('test hdl with ref: {}'.format(f))
+    cheby_file = srcdir + f + '.cheby'
+    vhdl_file = srcdir + f + '.vhdl'
+    verilog_file = srcdir + f + '.v'
+    sv_file = srcdir + f + '.sv'
+    t = parse_ok(cheby_file)
+    layout_ok(t)
+    expand_hdl.expand_hdl(t)
+    gen_name.gen_name_memmap(t)
+    h = gen_hdl.generate_hdl(t)
+
+    # Generate VHDL
+    buf_vhdl = write_buffer()
+    print_vhdl.print_vhdl(buf_vhdl, h)
+    if not compare_buffer_and_file(buf_vhdl, vhdl_file):
+        error('vhdl generation error for {}'.format(f))
+
+    # Generate SV
+    buf_sv = write_buffer()
+    print_verilog.print_verilog(buf_sv, h, Options(hdl_lang='sv'))
+    if not compare_buffer_and_file(buf_sv, sv_file):
+        error('SV generation error for {}'.format(f))
+
+    # Generate Verilog
+    buf_verilog = write_buffer()
+    print_verilog.print_verilog(buf_verilog, h, Options(hdl_lang='verilog'))
+    if not compare_buffer_and_file(buf_verilog, verilog_file):
+        error('Verilog generation error for {}'.format(f))
+
+    nbr_tests += 1
+
+    if args.elaborate:
+        # Elaboration tests
+        top_entity = t.hdl_module_name
+
+        # Elaborate VHDL using GHDL
+        elab_vhdl(vhdl_file, cheby_file)
+
+        # Elaborate SV and Verilog using Verilator
+        elab_sv(sv_file, top_entity)
+        elab_sv(verilog_file, top_entity)
 
         nbr_tests += 1
 
-        if args.elaborate:
-            # Elaboration tests
-            top_entity = t.hdl_module_name
-
-            # Elaborate VHDL using GHDL
-            elab_vhdl(vhdl_file)
-
-            # Elaborate SV and Verilog using Verilator
-            elab_sv(sv_file, top_entity)
-            elab_sv(verilog_file, top_entity)
 
-            nbr_tests += 1
+def test_hdl_ref():
+    # Generate HDL, compare with a baseline and potentially elaborate.
+    run_files(hdl_ref_file,
+              ['fmc-adc01/fmc_adc_alt_trigin', 'fmc-adc01/fmc_adc_alt_trigout',
+               'issue9/test', 'issue10/test',
+               'issue8/simpleMap_bug', 'issue8/simpleMap_noBug',
+               'issue14/test-axi', 'issue14/test-be', 'issue14/test-le',
+               'issue11/test_port1_reg', 'issue11/test_port1',
+               'issue11/test_port1_field',
+               'issue11/test_port2_reg', 'issue11/test_port2_wire',
+               'issue13/mainMap2', 'memory01/mainMap',
+               'memory01/sramro', 'memory01/sramwo', 'memory01/sramrw',
+               'issue39/addressingMemory',
+               'issue40/bugConstraints',
+               'issue41/bugBlockFields',
+               'issue45/test8', 'issue45/test16',
+               'features/wires1', 'features/semver1', 'features/semver2',
+               'features/mapinfo2',
+               'features/enums1', 'features/enums2',
+               'features/orclrout_rw',
+               'features/blkprefix1', 'features/blkprefix2', 'features/blkprefix3',
+               'features/blkprefix4', 'features/blkprefix5',
+               'features/regprefix1', 'features/regprefix2', 'features/regprefix3',
+               'features/mem64ro', 'features/mem64rodual',
+               'features/iogroup1', 'features/iogroup2', 'features/repeat-iogroup1',
+               'features/repeat-iogroup2', 'features/repeat-iogroup3',
+               'features/repeat-iogroup4',
+               'features/no_port', 'features/memwide',
+               'issue52/hwInfo',
+               'bug-gen_wt/m1',
+               'issue59/inherit', 'issue64/simple_reg1', 'issue66/m1',
+               'issue44/m1', 'issue75/m1',
+               'features/xilinx_attrs', 'features/xilinx_attrs_cern',
+               'features/axi4_byte', 'features/axi4_word', 'features/axi4_submap_wb',
+               'features/reg128', 'features/reg-strobe',
+               'issue77/m1', 'issue77/m2', 'issue77/m3',
+               'issue77/s1', 'issue77/s2', 'issue77/s3', 'issue77/s4',
+               'issue77/s5', 'issue77/s6',
+               'issue79/CSR', 'bug-memory/mem64ro', 'issue87/qsm_regs', 'issue89/map',
+               'issue92/blockInMap', 'issue90/bugDPSSRAMbwSel',
+               'bug-repmem/bran', 'bug-empty/noout', 'bug-empty/noinp',
+               'bug-cernbe/repro', 'bug-cernbe/sub_repro'])
+    flush_elab()
 
 def test_hdl_ref_async_rst():
     # Generate HDL with asynchronous reset and compare with a baseline
@@ -492,13 +677,11 @@ def test_hdl_ref_async_rst():
         vhdl_file = srcdir + f + "_async_rst.vhdl"
         sv_file = srcdir + f + "_async_rst.sv"
 
-        gconfig.rst_sync = False
-
         t = parse_ok(cheby_file)
         layout_ok(t)
         expand_hdl.expand_hdl(t)
         gen_name.gen_name_memmap(t)
-        h = gen_hdl.generate_hdl(t)
+        h = gen_hdl.generate_hdl(t, Options(rst_sync=False))
         buf = write_buffer()
         print_vhdl.print_vhdl(buf, h)
         if not compare_buffer_and_file(buf, vhdl_file):
@@ -509,8 +692,6 @@ def test_hdl_ref_async_rst():
             error("SV generation error for {}".format(f))
         nbr_tests += 1
 
-        gconfig.rst_sync = True
-
 def test_verilog_ref():
     # Generate verilog and compare with a baseline.
     global nbr_tests
@@ -542,21 +723,17 @@ def test_sv_ref():
         cheby_file = srcdir + f + ".cheby"
         vlog_file = srcdir + f + ".sv"
 
-        gconfig.hdl_lang = "sv"
-
         t = parse_ok(cheby_file)
         layout_ok(t)
         expand_hdl.expand_hdl(t)
         gen_name.gen_name_memmap(t)
         h = gen_hdl.generate_hdl(t)
         buf = write_buffer()
-        print_verilog.print_verilog(buf, h)
+        print_verilog.print_verilog(buf, h, Options(hdl_lang="sv"))
         if not compare_buffer_and_file(buf, vlog_file):
             error("sv generation error for {}".format(f))
         nbr_tests += 1
 
-        gconfig.hdl_lang = None
-
 def test_issue84():
     global nbr_tests
     for f in ['issue84/sps200CavityControl_as']:
@@ -626,9 +803,42 @@ def sub_gena_compare(filename, t):
         error('gena DSP C generation error for {}'.format(filename))
 
 
+def gena_file(f):
+    global nbr_tests
+    if args.verbose:
+        print('test gena: {}'.format(f))
+    # Test Gena to Cheby conversion
+    xmlfile = srcdir + 'gena/' + f + '.xml'
+    chebfile = srcdir + 'gena/' + f + '.cheby'
+    t = gena2cheby.convert(xmlfile)
+    buf = write_buffer()
+    pprint.pprint_cheby(buf, t)
+    if not compare_buffer_and_file(buf, chebfile):
+        error('gena2cheby conversion error for {}'.format(f))
+    # Test parse+layout
+    t = parse_ok(chebfile)
+    layout_ok(t)
+    # Test memmap generation
+    hmemmap = gen_gena_memmap.gen_gena_memmap(t)
+    buf = write_buffer()
+    print_vhdl.print_vhdl(buf, hmemmap)
+    memmapfile = srcdir + 'gena/HDL/' + 'MemMap_' + t.name + '.vhd'
+    if not compare_buffer_and_file(buf, memmapfile):
+        error('gena memmap generation error for {}'.format(f))
+    # Test regctrl generation
+    hregctrl = gen_gena_regctrl.gen_gena_regctrl(t, True)
+    buf = write_buffer()
+    print_vhdl.print_vhdl(buf, hregctrl)
+    regctrlfile = srcdir + 'gena/HDL/' + 'RegCtrl_' + t.name + '.vhd'
+    if not compare_buffer_and_file(buf, regctrlfile):
+        error('gena regctrl generation error for {}'.format(f))
+    # Test DSP map generation
+    sub_gena_compare('gena/' + f, t)
+    nbr_tests += 1
+
+
 def test_gena():
     # Feature tests
-    global nbr_tests
     files = ['CRegs', 'CRegs_Regs', 'CRegs_NoRMW', 'CRegs_Regs_NoRMW',
              'CRegs_internal',
              'Regs', 'Regs_Mems', 'Regs_rdstrobe', 'Regs_nodff',
@@ -649,37 +859,7 @@ def test_gena():
              'CRegs_Address', 'CRegs_resize_signed', 'CRegs_d8',
              'Submap', 'Submap_internal',
              'Muxed', 'Muxed2', 'Semver', 'Consts']
-    for f in files:
-        if args.verbose:
-            print('test gena: {}'.format(f))
-        # Test Gena to Cheby conversion
-        xmlfile = srcdir + 'gena/' + f + '.xml'
-        chebfile = srcdir + 'gena/' + f + '.cheby'
-        t = gena2cheby.convert(xmlfile)
-        buf = write_buffer()
-        pprint.pprint_cheby(buf, t)
-        if not compare_buffer_and_file(buf, chebfile):
-            error('gena2cheby conversion error for {}'.format(f))
-        # Test parse+layout
-        t = parse_ok(chebfile)
-        layout_ok(t)
-        # Test memmap generation
-        hmemmap = gen_gena_memmap.gen_gena_memmap(t)
-        buf = write_buffer()
-        print_vhdl.print_vhdl(buf, hmemmap)
-        memmapfile = srcdir + 'gena/HDL/' + 'MemMap_' + t.name + '.vhd'
-        if not compare_buffer_and_file(buf, memmapfile):
-            error('gena memmap generation error for {}'.format(f))
-        # Test regctrl generation
-        hregctrl = gen_gena_regctrl.gen_gena_regctrl(t, True)
-        buf = write_buffer()
-        print_vhdl.print_vhdl(buf, hregctrl)
-        regctrlfile = srcdir + 'gena/HDL/' + 'RegCtrl_' + t.name + '.vhd'
-        if not compare_buffer_and_file(buf, regctrlfile):
-            error('gena regctrl generation error for {}'.format(f))
-        # Test DSP map generation
-        sub_gena_compare('gena/' + f, t)
-        nbr_tests += 1
+    run_files(gena_file, files)
 
 
 def test_gena_regctrl_err():
@@ -781,13 +961,12 @@ def test_gena2cheby_regressions():
         # Test Gena to Cheby conversion
         xmlfile = srcdir + f + '.xml'
         chebfile = srcdir + f + '.cheby'
+        flags = gena2cheby.Flags()
         if f.endswith("-preset-no"):
-            gena2cheby.flag_keep_preset = "no"
+            flags.keep_preset = "no"
         elif f.endswith("-preset-always"):
-            gena2cheby.flag_keep_preset = "always"
-        else:
-            gena2cheby.flag_keep_preset = "no-split"
-        t = gena2cheby.convert(xmlfile)
+            flags.keep_preset = "always"
+        t = gena2cheby.convert(xmlfile, flags)
         buf = write_buffer()
         pprint.pprint_cheby(buf, t)
         if not compare_buffer_and_file(buf, chebfile):
@@ -840,8 +1019,32 @@ def test_gena_dsp_regressions():
         nbr_tests += 1
 
 
-def test_wbgen2cheby():
+def wbgen2cheby_file(f):
     global nbr_tests
+    wbgen_options = Options(vhdl_style='wbgen')
+    if args.verbose:
+        print('test wbgen2cheby: {}'.format(f))
+    # Test Gena to Cheby conversion
+    wbfile = srcdir + 'wbgen/' + f + '.wb'
+    chebfile = srcdir + 'wbgen/' + f + '.cheby'
+    buf = write_buffer()
+    wbgen2cheby.convert(buf, wbfile)
+    if not compare_buffer_and_file(buf, chebfile):
+        error('wbgen2cheby conversion error for {}'.format(f))
+    # Test parse+layout
+    t = parse_ok(chebfile)
+    layout_ok(t)
+    # Test vhdl generation
+    h = gen_wbgen_hdl.expand_hdl(t)
+    buf = write_buffer()
+    print_vhdl.print_vhdl(buf, h, wbgen_options)
+    hdlfile = srcdir + 'wbgen/' + f + '.vhdl'
+    if not compare_buffer_and_file(buf, hdlfile):
+        error('wbgen vhdl generation error for {}'.format(f))
+    nbr_tests += 1
+
+
+def test_wbgen2cheby():
     files = ['reg1', 'reg2', 'reg_field1', 'reg_in', 'reg_noprefix', 'reg_noprefix2',
              'reg_unsigned', 'reg_signed',
              'reg_loadext', 'reg_ackread',
@@ -862,35 +1065,14 @@ def test_wbgen2cheby():
              'version',
              'svec_xloader_wb',
              '../issue28/wrc_syscon_wb']
-    print_vhdl.style = 'wbgen'
-    for f in files:
-        if args.verbose:
-            print('test wbgen2cheby: {}'.format(f))
-        # Test Gena to Cheby conversion
-        wbfile = srcdir + 'wbgen/' + f + '.wb'
-        chebfile = srcdir + 'wbgen/' + f + '.cheby'
-        buf = write_buffer()
-        wbgen2cheby.convert(buf, wbfile)
-        if not compare_buffer_and_file(buf, chebfile):
-            error('wbgen2cheby conversion error for {}'.format(f))
-        # Test parse+layout
-        t = parse_ok(chebfile)
-        layout_ok(t)
-        # Test vhdl generation
-        h = gen_wbgen_hdl.expand_hdl(t)
-        buf = write_buffer()
-        print_vhdl.print_vhdl(buf, h)
-        hdlfile = srcdir + 'wbgen/' + f + '.vhdl'
-        if not compare_buffer_and_file(buf, hdlfile):
-            error('wbgen vhdl generation error for {}'.format(f))
-        nbr_tests += 1
-    print_vhdl.style = None
+    run_files(wbgen2cheby_file, files)
 
 
 def test_consts():
     # Generate constants and compare with a baseline.
     global nbr_tests
 
+    ohwr_files = []
     for f in ['demo_all', 'features/semver1', 'features/mapinfo1',
               'issue64/simple_reg1', 'issue_g2/reg', 'bug-consts/blkpfx',
               'features/enums1', 'features/enums2', 'bug-const-range/const_range',
@@ -919,9 +1101,13 @@ def test_consts():
             if args.elaborate:
                 # Elaboration tests
 
-                if style == 'vhdl' or style == 'vhdl-ohwr':
+                if style == 'vhdl':
                     # Elaborate VHDL using GHDL
-                    elab_vhdl(file)
+                    elab_vhdl(file, chebfile)
+                elif style == 'vhdl-ohwr':
+                    # After the vhdl files, so that the files of the same
+                    # map are in different batches.
+                    ohwr_files.append((file, chebfile))
 
                 # We don't test SV elaboration here because Verilator requires a top-level instance
 
@@ -929,6 +1115,9 @@ def test_consts():
                     check_c_syntax(file)
 
         nbr_tests += 1
+    for file, chebfile in ohwr_files:
+        elab_vhdl(file, chebfile)
+    flush_elab()
 
 def test_doc():
     # Generate html and md, compare with a baseline.
@@ -999,8 +1188,926 @@ def test_edge3():
                 error('edge3 generation error for {}'.format(f))
         nbr_tests += 1
 
+def test_output():
+    # Outputs are rewritten only when their content changes.
+    global nbr_tests
+    with tempfile.TemporaryDirectory() as d:
+        fname = os.path.join(d, 'out.h')
+        t = parse_ok(srcdir + 'demo.cheby')
+        layout_ok(t)
+        gen_name.gen_name_memmap(t)
+        for i in range(2):
+            outputs = output.OutputSet()
+            with outputs.open(fname) as f:
+                gen_c.gen_c_cheby(f, t, 'neutral')
+            if i == 0:
+                mtime = os.stat(fname).st_mtime_ns
+                if outputs.rewritten != [fname]:
+                    error('output not written')
+            elif outputs.unchanged != [fname] \
+                    or os.stat(fname).st_mtime_ns != mtime:
+                error('unchanged output rewritten')
+        # Nothing is written in case of error.
+        outputs = output.OutputSet()
+        try:
+            with outputs.open(fname) as f:
+                f.write('partial')
+                raise TestError('abort')
+        except TestError:
+            pass
+        if open(fname).read().startswith('partial') or os.listdir(d) != ['out.h']:
+            error('output written after an error')
+        # A new file has the default mode, an existing file keeps its mode.
+        umask = os.umask(0o022)
+        try:
+            output.write_file(os.path.join(d, 'new'), b'x')
+            os.chmod(fname, 0o640)
+            output.write_file(fname, b'x')
+        finally:
+            os.umask(umask)
+        if os.stat(os.path.join(d, 'new')).st_mode & 0o777 != 0o644 \
+           or os.stat(fname).st_mode & 0o777 != 0o640:
+            error('incorrect mode of the outputs')
+    nbr_tests += 1
+
+def test_depfile():
+    global nbr_tests
+    t = parse_ok(srcdir + 'bug-cernbe/repro.cheby')
+    layout_ok(t)
+    inputs = layout.get_input_filenames(t)
+    if inputs != [srcdir + 'bug-cernbe/repro.cheby',
+                  srcdir + 'bug-cernbe/sub_repro.cheby']:
+        error('bad input files for bug-cernbe/repro: {}'.format(inputs))
+    buf = write_buffer()
+    depfile.gen_depfile(buf, ['a b.vhdl', 'c.h'], ['x.cheby', 'y$.cheby'])
+    if buf.get() != 'a\\ b.vhdl c.h: \\\n  x.cheby \\\n  y$$.cheby\n':
+        error('bad dependency file: {}'.format(buf.get()))
+    with tempfile.TemporaryDirectory() as d:
+        dep = os.path.join(d, 'out.d')
+        out = os.path.join(d, 'out.h')
+        argv = ['--gen-c', out]
+        open(out, 'w').write('')
+        for mode in ['mtime', 'hash']:
+            if depfile.is_up_to_date(dep, argv, mode):
+                error('up to date without dependency file')
+            depfile.write_depfile(dep, [out], inputs, argv)
+            if not depfile.is_up_to_date(dep, argv, mode):
+                error('not up to date after a run')
+            if depfile.is_up_to_date(dep, argv + ['--gen-doc'], mode):
+                error('up to date with different options')
+            os.unlink(dep)
+    nbr_tests += 1
+
+def test_batch():
+    global nbr_tests
+    with tempfile.TemporaryDirectory() as d:
+        manifest = os.path.join(d, 'manifest.yaml')
+        with open(manifest, 'w') as f:
+            f.write('args: --header=none\n')
+            f.write('inputs:\n')
+            for name in ['bug-cernbe/repro', 'bug-cernbe/sub_repro', 'no-such-file']:
+                f.write('  - input: {}{}.cheby\n'.format(srcdir, name))
+                f.write('    args: [--gen-c={}]\n'.format(
+                    os.path.join(d, os.path.basename(name) + '.h')))
+        entries = batch.load_manifest(manifest)
+        results = batch.run_entries(entries)
+        if [r['status'] for r in results] != ['ok', 'ok', 'error']:
+            error('unexpected batch results: {}'.format(results))
+        if results[1]['cache_hits'] != 1:
+            error('submap not reused in batch')
+        if not os.path.isfile(os.path.join(d, 'sub_repro.h')):
+            error('batch output not generated')
+    nbr_tests += 1
+
+def test_lazy_imports():
+    # The generators are not loaded before they are needed.
+    global nbr_tests
+    code = ('import sys, types, cheby.main; '
+            'print(" ".join(sorted(n for n, m in sys.modules.items() '
+            'if n.startswith("cheby.") and type(m) is types.ModuleType)))')
+    res = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                         universal_newlines=True,
+                         cwd=os.path.dirname(os.path.realpath(__file__)))
+    mods = res.stdout.split()
+    if res.returncode != 0 or mods != ['cheby.main', 'cheby.options']:
+        error('unexpected modules loaded by cheby.main: {}'.format(mods))
+    # Concurrent first uses of the modules, in a fresh interpreter.
+    code = ('import sys, threading, cheby.server; '
+            'srv = cheby.server.Server(); res = []; '
+            'ts = [threading.Thread(target=lambda: res.append(srv.handle('
+            '{"op": "generate", "input": sys.argv[1], '
+            '"outputs": ["gen-hdl", "gen-c", "gen-consts"]}))) for _ in range(20)]; '
+            '[t.start() for t in ts]; [t.join() for t in ts]; '
+            'print(" ".join(sorted(set(r.get("error", "ok") for r in res))))')
+    res = subprocess.run([sys.executable, '-c', code, srcdir + 'demo_all.cheby'],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                         universal_newlines=True,
+                         cwd=os.path.dirname(os.path.realpath(__file__)))
+    if res.returncode != 0 or res.stdout.strip() != 'ok':
+        error('concurrent first uses of the lazy modules: {}'.format(res.stdout))
+    nbr_tests += 1
+
+def test_options_threads():
+    # Generations with different options can run concurrently.
+    global nbr_tests
+    f = srcdir + 'features/axi4_byte'
+
+    def gen(rst_sync, lang):
+        opts = Options(hdl_lang=lang, rst_sync=rst_sync)
+        t = parser.parse_yaml(f + '.cheby')
+        layout.layout_cheby(t, opts)
+        expand_hdl.expand_hdl(t)
+        gen_name.gen_name_memmap(t)
+        h = gen_hdl.generate_hdl(t, opts)
+        buf = write_buffer()
+        if lang == 'vhdl':
+            print_vhdl.print_vhdl(buf, h, opts)
+        else:
+            print_verilog.print_verilog(buf, h, opts)
+        return buf
+
+    jobs = [(True, 'vhdl', '.vhdl'), (True, 'sv', '.sv'),
+            (False, 'vhdl', '_async_rst.vhdl'), (False, 'verilog', '_async_rst.sv')] * 4
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as ex:
+        res = list(ex.map(lambda j: gen(j[0], j[1]), jobs))
+    for (_, _, suffix), buf in zip(jobs, res):
+        if not compare_buffer_and_file(buf, f + suffix):
+            error('concurrent generation error for {}{}'.format(f, suffix))
+    nbr_tests += 1
+
+def test_pipeline():
+    global nbr_tests
+    # Only the stages needed by the requested outputs are run.
+    stages = cheby.main.get_stages()
+    if pipeline.needed_stages(stages, ['names']) != {'parse', 'layout', 'names'}:
+        error('incorrect stages for names')
+    argv = ['--gen-c', '-', '-i', srcdir + 'demo_all.cheby']
+    gens = [g.name for g in cheby.main.get_generators()
+            if g.enabled(cheby.main.decode_args(argv))]
+    if gens != ['gen_c']:
+        error('incorrect generators: {}'.format(gens))
+    # Outputs are the same with several jobs.
+    with tempfile.TemporaryDirectory() as d:
+        res = []
+        for jobs in ['1', '3']:
+            # In generation order.
+            names = [os.path.join(d, jobs + ext) for ext in ['.txt', '.h', '.html', '.vhdl']]
+            argv = ['--header=none', '-j', jobs, '-i', srcdir + 'demo_all.cheby',
+                    '--print-simple', names[0], '--gen-c', names[1],
+                    '--gen-doc', names[2], '--gen-hdl', names[3]]
+            outputs = cheby.main.run(cheby.main.decode_args(argv))
+            if outputs.files != names:
+                error('incorrect outputs with {} jobs: {}'.format(jobs, outputs.files))
+            res.append([open(n).read() for n in names])
+        if res[0] != res[1]:
+            error('outputs differ with several jobs')
+        # The gena memmap needs a later stage than silecs, but is written
+        # before.
+        for jobs in ['1', '3']:
+            names = [os.path.join(d, jobs + ext) for ext in ['.gena.vhdl', '.silecs']]
+            argv = ['--header=none', '-j', jobs, '-i', srcdir + 'gena/Area_CRegs.cheby',
+                    '--gen-silecs', names[1], '--gen-gena-memmap', names[0]]
+            outputs = cheby.main.run(cheby.main.decode_args(argv))
+            if outputs.files != names:
+                error('incorrect gena outputs with {} jobs: {}'.format(jobs, outputs.files))
+    nbr_tests += 1
+
+def test_profile():
+    global nbr_tests
+    with tempfile.TemporaryDirectory() as d:
+        argv = ['--header=none', '-j', '2', '-i', srcdir + 'demo_all.cheby',
+                '--gen-c', os.path.join(d, 'a.h'), '--gen-hdl', os.path.join(d, 'a.vhdl'),
+                '--profile=json', '--profile-dump', os.path.join(d, 'prof')]
+        args = cheby.main.decode_args(argv)
+        cheby.main.run(args)
+        res = args.options.profiler.to_json()
+        names = [s['name'] for s in res['sections']]
+        if names != ['import', 'parse', 'layout', 'layout/load-submap', 'names', 'gen_c', 'expand', 'gen_hdl',
+                     'gen_hdl/generate_hdl', 'gen_hdl/generate_hdl/hdlopt',
+                     'gen_hdl/print']:
+            error('incorrect profile sections: {}'.format(names))
+        for s in res['sections']:
+            if s['calls'] < 1 or s['wall'] > res['wall'] or s['peak'] <= 0:
+                error('incorrect profile for {}: {}'.format(s['name'], s))
+        dumps = sorted(os.listdir(os.path.join(d, 'prof')))
+        if dumps != ['expand.prof', 'gen_c.prof', 'gen_hdl.prof', 'import.prof',
+                     'layout.prof', 'names.prof', 'parse.prof']:
+            error('incorrect profile dumps: {}'.format(dumps))
+    nbr_tests += 1
+
+def test_api():
+    global nbr_tests
+    f = srcdir + 'features/axi4_byte'
+    m = api.load(f + '.cheby')
+    # The map can be used several times, with different options.
+    for ff_reset, ref in [('sync', '.vhdl'), ('async', '_async_rst.vhdl'),
+                          ('sync', '.vhdl')]:
+        res = m.generate(['gen-hdl'], ff_reset=ff_reset)
+        if list(res) != ['gen-hdl'] or res['gen-hdl'] != open(f + ref).read():
+            error('api: incorrect hdl for {}'.format(ref))
+    f = srcdir + 'demo_all'
+    with open(f + '.cheby') as fd:
+        m = api.loads(fd.read(), f + '.cheby')
+    res = m.generate(['gen-consts', 'gen-c'], consts_style='h')
+    if res['gen-consts'] != open(f + '-consts.h').read():
+        error('api: incorrect consts')
+    if res != api.generate(f + '.cheby', ['gen-c', 'gen-consts'], consts_style='h'):
+        error('api: load and loads differ')
+    for artifacts, kwargs in [(['gen-x'], {}), (['gen-c'], {'hdl': 'c'}),
+                              (['gen-c'], {'jobs': 2}), (['gen-c'], {'gen_hdl': 'x'}),
+                              (['gen-c'], {'watch': True}), (['gen-c'], {'cache_dir': 'x'}),
+                              (['gen-c'], {'help': True})]:
+        try:
+            m.generate(artifacts, **kwargs)
+            error('api: error not detected for {} {}'.format(artifacts, kwargs))
+        except api.ApiException:
+            pass
+    # The address space is required for a map with address spaces.
+    m = api.load(srcdir + 'issue124/project.cheby')
+    for kwargs in [{}, {'address_space': 'BAR1'}]:
+        try:
+            m.generate(['gen-hdl'], **kwargs)
+            error('api: address space error not detected for {}'.format(kwargs))
+        except api.ApiException:
+            pass
+    if 'entity' not in m.generate(['gen-hdl'], address_space='BAR0')['gen-hdl']:
+        error('api: incorrect hdl for an address space')
+    nbr_tests += 1
+
+def test_watch():
+    global nbr_tests
+    with tempfile.TemporaryDirectory() as d:
+        for f in ['demo_all.cheby', 'demo_all_sub.cheby']:
+            with open(srcdir + f) as src, open(os.path.join(d, f), 'w') as dst:
+                dst.write(src.read())
+        inp = os.path.join(d, 'demo_all.cheby')
+        sub = os.path.join(d, 'demo_all_sub.cheby')
+        out = os.path.join(d, 'a.h')
+        w = watch.Watch(cheby.main.decode_args(['-i', inp, '--gen-c', out]))
+        if not w.build().startswith('built') or w.files != [inp, sub]:
+            error('watch: incorrect first build')
+        # A comment doesn't change the document.
+        with open(sub, 'a') as fd:
+            fd.write('# comment\n')
+        if w.build([sub]) != 'no change':
+            error('watch: rebuild for a comment')
+        with open(inp) as fd:
+            text = fd.read()
+        with open(inp, 'w') as fd:
+            fd.write(text.replace('a normal reg with some fields', 'a changed reg'))
+        if not w.build([inp]).startswith('built') \
+           or 'a changed reg' not in open(out).read():
+            error('watch: incorrect rebuild')
+        # The submap is not laid out again when only the input changes.
+        cache = w.args.options.submap_cache
+        misses = cache.misses
+        with open(inp, 'w') as fd:
+            fd.write(text)
+        if not w.build([inp]).startswith('built') or cache.misses != misses \
+           or 'a normal reg with some fields' not in open(out).read():
+            error('watch: incorrect rebuild with the submap cache')
+        # The directories no longer used are not watched.
+        watcher = watch.get_watcher()
+        if isinstance(watcher, watch.InotifyWatcher):
+            watcher.set_files([inp])
+            watcher.set_files([srcdir + 'demo_all.cheby'])
+            if list(watcher.dirs.values()) != [os.path.dirname(os.path.realpath(srcdir + 'demo_all.cheby'))]:
+                error('watch: incorrect watched directories {}'.format(watcher.dirs))
+        watcher.close()
+        # Both watchers see the modification.
+        for watcher in [watch.get_watcher(), watch.PollWatcher(0.05)]:
+            watcher.set_files(w.files)
+            if watcher.wait(0.2) != []:
+                error('watch: spurious change with {}'.format(watcher))
+            with open(sub, 'a') as fd:
+                fd.write('\n')
+            os.utime(sub, ns=(0, 0))
+            if watcher.wait(2) != [sub]:
+                error('watch: change not detected with {}'.format(watcher))
+            watcher.close()
+    nbr_tests += 1
+
+def test_server():
+    global nbr_tests
+    f = srcdir + 'demo_all.cheby'
+    ref = api.generate(f, ['gen-c'])
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'cheby.sock')
+        srv = server.make_server(path, server.Server(max_maps=1))
+        ex = concurrent.futures.ThreadPoolExecutor(4)
+        ex.submit(srv.serve_forever)
+        try:
+            req = {'input': f, 'outputs': ['gen-c']}
+            # Concurrent requests, once the map is in the cache.
+            res = [server.request(path, req)]
+            res += ex.map(lambda r: server.request(path, r), [req] * 3)
+            if any(r != {'status': 'ok', 'outputs': ref} for r in res):
+                error('server: incorrect response')
+            with open(f) as fd:
+                req = {'content': fd.read(), 'filename': f, 'outputs': ['gen-c']}
+            if server.request(path, req)['outputs'] != ref:
+                error('server: incorrect response for a content')
+            for req in [{'outputs': ['gen-c']}, {'input': f, 'outputs': ['gen-x']},
+                        {'op': 'unknown'}, [], {'input': srcdir + 'nofile.cheby'}]:
+                if server.request(path, req)['status'] != 'error':
+                    error('server: error not detected for {}'.format(req))
+            stats = server.request(path, {'op': 'stats'})['stats']
+            if stats['requests'] != 10 or stats['errors'] != 5 or stats['maps'] != 1 \
+               or stats['map_hits'] != 3 or 'p50' not in stats['latency_ms']:
+                error('server: incorrect stats: {}'.format(stats))
+            if server.request(path, {'op': 'shutdown'}) != {'status': 'ok'}:
+                error('server: incorrect shutdown')
+        finally:
+            srv.shutdown()
+            ex.shutdown()
+            srv.server_close()
+        # Concurrent requests to a server just started (in a fresh
+        # interpreter).
+        os.unlink(path)
+        proc = subprocess.Popen([sys.executable, '-m', 'cheby.main', '--serve', path],
+                                stderr=subprocess.DEVNULL,
+                                cwd=os.path.dirname(os.path.realpath(__file__)))
+        try:
+            for _ in range(500):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.01)
+            req = {'input': f, 'outputs': ['gen-hdl', 'gen-c', 'gen-consts']}
+            with concurrent.futures.ThreadPoolExecutor(20) as ex:
+                res = list(ex.map(lambda r: server.request(path, r), [req] * 20))
+            errors = set(r.get('error') for r in res if r['status'] != 'ok')
+            if errors:
+                error('server: errors on a cold server: {}'.format(errors))
+            server.request(path, {'op': 'shutdown'})
+            proc.wait(30)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+    nbr_tests += 1
+
+def test_artifact_cache():
+    global nbr_tests
+    with tempfile.TemporaryDirectory() as d:
+        for f in ['demo_all.cheby', 'demo_all_sub.cheby']:
+            with open(srcdir + f) as src, open(os.path.join(d, f), 'w') as dst:
+                dst.write(src.read())
+        sub = os.path.join(d, 'demo_all_sub.cheby')
+        cdir = os.path.join(d, 'cache')
+        out = os.path.join(d, 'a.vhdl')
+        argv = ['--header=none', '--cache-dir', cdir, '-i', os.path.join(d, 'demo_all.cheby'),
+                '--gen-hdl', out, '--gen-c', os.path.join(d, 'a.h')]
+        res = []
+        for cached in [False, True, False]:
+            if res:
+                os.unlink(out)
+            if cached is False and res:
+                # A submap is modified.
+                with open(sub, 'a') as fd:
+                    fd.write('# comment\n')
+            outputs = cheby.main.run(cheby.main.decode_args(argv))
+            if outputs.cached != cached or len(outputs.files) != 2:
+                error('artifact cache: incorrect outputs {}'.format(outputs.summary()))
+            res.append(open(out).read())
+        if res[0] != res[1] or res[0] != res[2]:
+            error('artifact cache: outputs differ')
+        # Options are part of the key.
+        outputs = cheby.main.run(cheby.main.decode_args(argv + ['--hdl=verilog']))
+        if outputs.cached:
+            error('artifact cache: options not in the key')
+        # Nothing to profile.
+        args = cheby.main.decode_args(argv + ['--hdl=verilog', '--profile'])
+        outputs = cheby.main.run(args)
+        buf = io.StringIO()
+        args.options.profiler.report(buf)
+        if not outputs.cached or buf.getvalue() != 'cached, no generation\n':
+            error('artifact cache: incorrect profile {}'.format(buf.getvalue()))
+        cache = artifact_cache.ArtifactCache(cdir)
+        if len(os.listdir(os.path.join(cdir, 'entries'))) != 3:
+            error('artifact cache: incorrect number of entries')
+        cache.evict(0)
+        if any(os.listdir(os.path.join(cdir, k)) for k in ['inputs', 'entries', 'blobs']):
+            error('artifact cache: not evicted')
+    nbr_tests += 1
+
+
+class dict_ual(object):
+    """A UAL object on a dictionary of words, that counts the accesses"""
+    def __init__(self):
+        self.words = {}
+        self.accesses = 0
+
+    def readl(self, addr):
+        self.accesses += 1
+        return self.words.get(addr, 0)
+
+    def writel(self, addr, val):
+        self.accesses += 1
+        self.words[addr] = val
+
+    def readl_block(self, addr, count):
+        self.accesses += 1
+        return [self.words.get(addr + 4 * i, 0) for i in range(count)]
+
+    def writel_block(self, addr, vals):
+        self.accesses += 1
+        for i, v in enumerate(vals):
+            self.words[addr + 4 * i] = v
+
+
+def test_ual():
+    global nbr_tests
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+    u = dict_ual()
+    acc = ual.compile_access(t)(u, 0)
+    acc.ctrl.mode = 5
+    acc.ctrl.en = 1
+    if u.words[0] != 0xb or acc.ctrl.mode != 5 or acc.ctrl.en != 1:
+        error('ual: incorrect field access')
+    acc.ctrl.set(en=0, mode=1)
+    if acc.ctrl.read() != 0x2:
+        error('ual: incorrect set')
+    # Big endian: the first word has the MSB.
+    val = 0x1122334455667788
+    acc.wide.write(val)
+    if u.words[8] != 0x11223344 or u.words[12] != 0x55667788 or acc.wide.read() != val:
+        error('ual: incorrect multi-word register access')
+    if (acc.wide.lo, acc.wide.mid, acc.wide.hi) != (0x88, 0x45, 0x33):
+        error('ual: incorrect multi-word fields')
+    acc.wide.mid = 0xab
+    if acc.wide.read() != (val & ~(0xff << 28)) | (0xab << 28):
+        error('ual: incorrect multi-word field write')
+    u.accesses = 0
+    acc.status.read()
+    acc.wide.hi
+    if u.accesses != 2:
+        error('ual: {} accesses instead of 2'.format(u.accesses))
+    acc.blk.val.write(3)
+    acc.chan[2].gain.write(7)
+    acc.buf[3].sample.write(9)
+    if u.words[0x18] != 3 or u.words[0x28] != 7 or u.words[0x40c] != 9:
+        error('ual: incorrect addresses')
+    if len(acc.chan) != 4 or len(acc.buf) != 256:
+        error('ual: incorrect lengths')
+    # All the fields are decoded from one access.
+    u.words[4] = 0x2a01
+    u.accesses = 0
+    st = acc.status.read_fields()
+    if st != (1, 0x2a) or st.count != 0x2a or u.accesses != 1:
+        error('ual: incorrect read_fields')
+    # Dynamic access.
+    dyn = ual.UALValue(u, t, t, 0)
+    if dyn.status.count != 0x2a or dyn.status.read_fields() != st:
+        error('ual: incorrect dynamic field read')
+    if dyn.wide.mid != acc.wide.mid or dyn.chan[2].gain.read() != 7 \
+       or dyn.buf[3].sample.read() != 9:
+        error('ual: incorrect dynamic register read')
+    dyn.ctrl.mode = 3
+    if acc.ctrl.mode != 3:
+        error('ual: incorrect dynamic field write')
+    # Snapshot: cmd (write-only) is not read, so two ranges.
+    u.accesses = 0
+    snap = ual.snapshot(acc)
+    if u.accesses != 2:
+        error('ual: {} accesses for a snapshot'.format(u.accesses))
+    if snap.status != 0x2a01 or snap.status.count != 0x2a or snap.wide != acc.wide.read() \
+       or snap.blk.val != 3 or snap.chan[2].gain != 7 or hasattr(snap, 'cmd'):
+        error('ual: incorrect snapshot')
+    # Bulk write: ctrl, then wide and cmd, then the repeat.
+    u.accesses = 0
+    ual.bulk_write([(acc.chan[1].gain, 2), (acc.ctrl, 1), (acc.wide, 5), (acc.cmd, 4),
+                    (acc.chan[0].gain, 6)])
+    if u.accesses != 3:
+        error('ual: {} accesses for a bulk write'.format(u.accesses))
+    if acc.ctrl.read() != 1 or acc.wide.read() != 5 or u.words[0x10] != 4 \
+       or acc.chan[0].gain.read() != 6 or acc.chan[1].gain.read() != 2:
+        error('ual: incorrect bulk write')
+    nbr_tests += 1
+
+
+def test_ual_shadow():
+    global nbr_tests
+    t = parse_ok(srcdir + 'ual/shadow.cheby')
+    layout_ok(t)
+    u = dict_ual()
+    cache = ual.ShadowCache()
+    acc = ual.compile_access(t)(u, 0, cache)
+    u.words[0x4] = 0x3300
+    # The first update reads the register, the next ones just write.
+    acc.ctrl.mode = 3
+    acc.ctrl.en = 1
+    acc.irq.mask = 0x12
+    if u.accesses != 5 or u.words[0] != 0x7:
+        error('ual shadow: incorrect field updates')
+    # The hardware-modified fields are written as 0.
+    u.words[0x4] = 0x4412
+    acc.irq.set(mask=0x34)
+    if u.words[0x4] != 0x34:
+        error('ual shadow: or-clr field written')
+    acc.ctrl.start = 1
+    if u.words[0] != 0x17:
+        error('ual shadow: incorrect autoclear field write')
+    acc.ctrl.en = 0
+    if u.words[0] != 0x6:
+        error('ual shadow: autoclear field written again')
+    # A write-only register is never read.
+    u.accesses = 0
+    acc.cmd.arg = 5
+    acc.cmd.op = 2
+    if u.accesses != 2 or u.words[0x8] != 0x502:
+        error('ual shadow: incorrect write-only register update')
+    # Invalidation and synchronization.
+    u.words[0] = 0x8
+    cache.invalidate(acc.ctrl)
+    acc.ctrl.en = 1
+    if u.words[0] != 0x9:
+        error('ual shadow: incorrect invalidation')
+    u.words[0x10] = 0x11
+    u.words[0x14] = 0x22
+    u.accesses = 0
+    cache.sync(acc.chan)
+    acc.chan[1].gain.coarse = 3
+    if u.accesses != 2 or u.words[0x14] != 0x23:
+        error('ual shadow: incorrect sync')
+    ual.bulk_write([(acc.chan[0].gain, 0x40)])
+    acc.chan[0].gain.coarse = 1
+    if u.words[0x10] != 0x41:
+        error('ual shadow: bulk write not recorded')
+    # With the bypass policy (or without cache), the registers with
+    # hardware-modified fields are read, and these fields are still
+    # written as 0.
+    m = model.Model(t)
+    irq = m.regs['irq']
+    updates = []
+    for sh in [ual.ShadowCache('bypass'), None]:
+        a = ual.compile_access(t)(m, 0, sh)
+        updates += [lambda a=a: setattr(a.irq, 'mask', 0x34), lambda a=a: a.irq.set(mask=0x34)]
+    a = ual.UALValue(m, t, t, 0)
+    updates.append(lambda: setattr(a.irq, 'mask', 0x34))
+    for update in updates:
+        irq.set_field('pending', 0x44)
+        update()
+        if irq.written != 0x34 or irq.get_field('pending') != 0x44:
+            error('ual shadow: or-clr field written by a read-modify-write')
+    # Non-compiled access.
+    u = dict_ual()
+    acc = ual.create_ual_access(u, srcdir + 'ual/shadow.cheby', ual.ShadowCache())
+    acc.cmd.arg = 5
+    acc.ctrl.mode = 2
+    acc.ctrl.en = 1
+    if u.accesses != 4 or u.words[0x8] != 0x501 or u.words[0] != 0x5:
+        error('ual shadow: incorrect non-compiled access')
+    nbr_tests += 1
+
+
+def test_ual_async():
+    global nbr_tests
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+
+    async def run():
+        servers = [ual_async.LocalServer(dict_ual(), 0.001) for _ in range(3)]
+        boards = [ual_async.access(s, t) for s in servers]
+        b = boards[0]
+        await b.ctrl.set(en=1, mode=5)
+        f = await b.ctrl.read_fields()
+        if servers[0].ual.words[0] != 0xb or f.en != 1 or f.mode != 5:
+            error('ual async: incorrect set')
+        await b.wide.write(0x1122334455667788)
+        if await b.wide.read() != 0x1122334455667788 or servers[0].max_in_flight != 2:
+            error('ual async: incorrect pipelined multiword access')
+        await b.chan[2].gain.write(7)
+        await b.buf[3].sample.write(9)
+        if servers[0].ual.words[0x28] != 7 or servers[0].ual.words[0x40c] != 9:
+            error('ual async: incorrect repeat or memory address')
+        # The classes of the registers are built once, also for the
+        # elements of a memory.
+        if type(b.buf[1].sample) is not type(b.buf[3].sample) \
+           or b.buf[1].sample._value_type is not boards[1].buf[0].sample._value_type:
+            error('ual async: memory element classes not shared')
+        # Concurrent accesses to several boards.
+        for i, s in enumerate(servers):
+            s.ual.words[4] = i
+        res = await asyncio.gather(*[bd.status.read() for bd in boards])
+        if res != [0, 1, 2]:
+            error('ual async: incorrect concurrent reads')
+        servers[1].requests = 0
+        snap = await ual_async.snapshot(boards[1])
+        if servers[1].requests != 2 or snap.status != 1 or snap.chan[2].gain != 0:
+            error('ual async: incorrect snapshot')
+        # The or-clr fields are written as 0 by set().
+        ts = parse_ok(srcdir + 'ual/shadow.cheby')
+        layout_ok(ts)
+        m = model.Model(ts)
+        m.regs['irq'].set_field('pending', 0x44)
+        await ual_async.access(ual_async.LocalServer(m), ts).irq.set(mask=0x34)
+        if m.regs['irq'].written != 0x34 or m.regs['irq'].get_field('pending') != 0x44:
+            error('ual async: or-clr field written by set')
+
+    asyncio.run(run())
+    nbr_tests += 1
+
+
+def test_ual_mmap():
+    global nbr_tests
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+    with tempfile.NamedTemporaryFile() as f:
+        # A file as the device.
+        f.write(bytes(t.c_size))
+        f.flush()
+        with ual_mmap.MmapUAL(f.name) as m:
+            acc = ual.compile_access(t)(m, 0)
+            acc.ctrl.write(0x12345678)
+            acc.wide.write(0x1122334455667788)
+            if m.readw(0) != 0x5678 or m.readb(3) != 0x12 or m.readq(8) != 0x5566778811223344:
+                error('ual mmap: incorrect sized accesses')
+            try:
+                m.readl(2)
+                error('ual mmap: unaligned access not detected')
+            except ValueError:
+                pass
+            # The views are not copies, the blocks read are.
+            buf = acc.buf.view()
+            buf[3] = 99
+            blk = m.readl_block(0x400, 4)
+            buf[3] = 98
+            if len(buf) != 256 or acc.buf[3].sample.read() != 98 or blk != [0, 0, 0, 99]:
+                error('ual mmap: incorrect memory view')
+            m.writel_block(0x20, [1, 2, 3, 4])
+            if ual.snapshot(acc).chan[3].gain != 4:
+                error('ual mmap: incorrect block write')
+            buf.release()
+            # The blocks must be within the mapping.
+            end = m.size - 8
+            for op in [lambda: m.readl_block(end, 8), lambda: m.view(end, 32, 4),
+                       lambda: m.writel_block(end, [5] * 8)]:
+                try:
+                    op()
+                    error('ual mmap: block out of the mapping not detected')
+                except IndexError:
+                    pass
+            if m.readl_block(end, 2) != [0, 0]:
+                error('ual mmap: block partly written')
+        with open(f.name, 'rb') as fd:
+            if fd.read(4) != (0x12345678).to_bytes(4, sys.byteorder):
+                error('ual mmap: file not written')
+    # An empty file, and a device (its size is not known).
+    with tempfile.NamedTemporaryFile() as f:
+        for filename in [f.name, '/dev/zero']:
+            if not os.path.exists(filename):
+                continue
+            try:
+                ual_mmap.MmapUAL(filename).close()
+                error('ual mmap: incorrect size not detected for {}'.format(filename))
+            except ValueError:
+                pass
+    nbr_tests += 1
+
+def test_ual_remote():
+    global nbr_tests
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+    dev = ual_mmap.BufferUAL(bytearray(t.c_size))
+    server = ual_remote.RemoteServer(('localhost', 0), dev)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with ual_remote.RemoteUAL('localhost', server.server_address[1]) as r:
+            acc = ual.compile_access(t)(r, 0)
+            acc.ctrl.mode = 3
+            if dev.readl(0) != 6 or r.round_trips != 2:
+                error('ual remote: incorrect field update')
+            # All the accesses of a batch in one round trip.
+            with r.write_batch():
+                acc.ctrl.write(1)
+                acc.chan[1].gain.write(9)
+                r.writel_block(0x400, [1, 2, 3])
+                gain = r.defer_read(4, 0x24)
+                words = r.defer_read_block(4, 0x400, 3)
+            if r.round_trips != 3 or gain.value != 9 or words.value != [1, 2, 3]:
+                error('ual remote: incorrect batch')
+            # A read sends the pending writes.
+            with r.write_batch():
+                acc.cmd.write(5)
+                if acc.cmd.read() != 5 or r.round_trips != 4:
+                    error('ual remote: incorrect read in a batch')
+            # The operations of a block that raised are not sent.
+            try:
+                with r.write_batch():
+                    acc.cmd.write(6)
+                    raise KeyError
+            except KeyError:
+                pass
+            if r.round_trips != 4 or dev.readl(acc.cmd._addr) != 5:
+                error('ual remote: operations of a failed batch sent')
+            snap = ual.snapshot(acc)
+            if snap.ctrl != 1 or snap.chan[1].gain != 9:
+                error('ual remote: incorrect block reads')
+            try:
+                r.readl(2)
+                error('ual remote: error not reported')
+            except ual_remote.RemoteError:
+                pass
+            if acc.chan[1].gain.read() != 9:
+                error('ual remote: incorrect access after an error')
+            # A reply without all the words read is an error.
+            execute = server.device.execute
+            server.device.execute = lambda frame: execute(frame)[:-4]
+            try:
+                p = r.defer_read_block(4, 0x400, 3)
+                r.readl(0x24)
+                error('ual remote: short reply not detected')
+            except ual_remote.RemoteError:
+                pass
+            finally:
+                server.device.execute = execute
+            if p.value is not None:
+                error('ual remote: value decoded from a short reply')
+    finally:
+        server.shutdown()
+        server.server_close()
+    # The server checks the number of words of a block read.
+    short = dict_ual()
+    short.readl_block = lambda addr, count: [0] * (count - 1)
+    frame = ual_remote.OP_COUNT.pack((ual_remote.OP_READ_BLOCK << 4) | 4, 0, 8)
+    if ual_remote.Device(short).execute(frame)[0] == 0:
+        error('ual remote: short block read not detected')
+    nbr_tests += 1
+
+
+def test_model():
+    global nbr_tests
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+    m = model.Model(t)
+    acc = ual.compile_access(t)(m, 0)
+    # Presets, constants and access.
+    if acc.ctrl.mode != 2 or acc.blk.id.read() != 0x55:
+        error('model: incorrect preset or constant')
+    m.regs['status'].set_field('count', 7)
+    acc.status.write(0)
+    acc.cmd.write(5)
+    if acc.status.count != 7 or acc.cmd.read() != 0 or m.regs['cmd'].value != 5:
+        error('model: incorrect read-only or write-only register')
+    # Only the bits of the fields are kept, the words are big-endian.
+    acc.wide.write(0x1122334455667788)
+    if acc.wide.read() != 0x330450000088 or m.rvals[8] != 0x3304:
+        error('model: incorrect multiword register')
+    acc.chan[2].gain.write(3)
+    acc.buf[3].sample.write(9)
+    if m.regs['chan[2].gain'].value != 3 or m.memories['buf'].data.readl(12) != 9:
+        error('model: incorrect repeat or memory')
+    # Hardware-modified fields.
+    t = parse_ok(srcdir + 'ual/shadow.cheby')
+    layout_ok(t)
+    m = model.Model(t)
+    acc = ual.compile_access(t)(m, 0)
+    starts = []
+    m.regs['ctrl'].on_write(lambda r: starts.append(r.written >> 4 & 1))
+    acc.ctrl.write(0x13)
+    m.regs['irq'].set_field('pending', 0x5)
+    m.regs['irq'].set_field('pending', 0x2)
+    acc.irq.write(0x0401)
+    if acc.ctrl.read() != 0x3 or starts != [1] or acc.irq.read() != 0x0301:
+        error('model: incorrect autoclear or or-clr field')
+    if acc.cmd.read() != 0 or m.regs['cmd'].value != 1:
+        error('model: incorrect write-only preset')
+    # Submaps.
+    t = parse_ok(srcdir + 'ual/top.cheby')
+    layout_ok(t)
+    m = model.Model(t, strict=True)
+    ext = dict_ual()
+    m.attach('ext', ext)
+    m.writel(0x24, 0x3300)
+    m.writel(0x104, 7)
+    m.writel(0x0, 1)
+    if m.submaps['regs'].regs['irq'].value != 0 or ext.words[4] != 7 or m.readl(0x104) != 7:
+        error('model: incorrect submap')
+    try:
+        m.readl(0x80)
+        error('model: access to no register not detected')
+    except ValueError:
+        pass
+    m.reset()
+    if m.readl(0x0) != 0:
+        error('model: incorrect reset')
+    # The submaps are accessed with the word size of the bus.
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+    sub = model.Model(t)
+    sub.word_size = 2
+    for u in [object(), sub]:
+        try:
+            m.attach('ext', u)
+            error('model: incorrect word size of a submap not detected')
+        except ValueError:
+            pass
+    # One model per address space (they all start at 0).
+    t = parse_ok(srcdir + 'ual/spaces.cheby')
+    layout_ok(t)
+    try:
+        model.Model(t)
+        error('model: map with address spaces not detected')
+    except ValueError:
+        pass
+    m0 = model.Model(t, space='bar0')
+    m2 = model.Model(t, space='bar2')
+    m0.writel(0, 1)
+    m2.writel(0, 2)
+    if m0.readl(0) != 1 or m2.readl(0) != 2 or list(m2.regs) != ['data']:
+        error('model: incorrect address spaces')
+    nbr_tests += 1
+
+
+def test_ual_numpy():
+    global nbr_tests
+    if importlib.util.find_spec('numpy') is None:
+        # numpy is optional.
+        return
+    import numpy
+    t = parser.parse_yaml_string('''
+memory-map:
+  bus: wb-32-be
+  name: mems
+  children:
+    - memory:
+        name: samples
+        memsize: 8k
+        children:
+          - reg:
+              name: v
+              width: 16
+              type: signed
+              access: rw
+    - memory:
+        name: pairs
+        memsize: 1k
+        children:
+          - reg:
+              name: a
+              width: 64
+              access: rw
+          - reg:
+              name: b
+              width: 32
+              access: rw
+              children:
+                - field:
+                    name: lo
+                    range: 3-0
+                - field:
+                    name: hi
+                    range: 31-20
+''')
+    layout_ok(t)
+    u = dict_ual()
+    acc = ual.compile_access(t)(u, 0)
+    if acc.samples.dtype != numpy.int16 or acc.pairs.dtype.names != ('a', 'b'):
+        error('ual numpy: incorrect dtype')
+    vals = numpy.arange(-100, 100, dtype=numpy.int16)
+    u.accesses = 0
+    acc.samples.write(10, vals)
+    res = acc.samples.read(10, len(vals))
+    if u.accesses != 2 or not (res == vals).all() or acc.samples[10].v.read() != 0xff9c:
+        error('ual numpy: incorrect signed memory transfer')
+    pairs = numpy.zeros(3, acc.pairs.dtype)
+    pairs['a'] = [1, 1 << 40, 3]
+    pairs['b'] = [7, 8, 9]
+    acc.pairs.write(2, pairs)
+    if acc.pairs[3].a.read() != 1 << 40 or acc.pairs[4].b.read() != 9 \
+       or acc.pairs.read(2, 3).tolist() != pairs.tolist():
+        error('ual numpy: incorrect structured memory transfer')
+    pairs['b'] = [0x12300007, 8, 0xfff00000]
+    acc.pairs.write(2, pairs)
+    f = acc.pairs.read_fields(2, 3)
+    if f.dtype.names != ('b',) or f['b'].dtype.names != ('lo', 'hi') \
+       or f['b']['hi'].dtype != numpy.uint16 \
+       or f['b']['lo'].tolist() != [7, 8, 0] or f['b']['hi'].tolist() != [0x123, 0, 0xfff]:
+        error('ual numpy: incorrect fields of a memory')
+    try:
+        acc.samples.read(len(acc.samples) - 10, 100)
+        error('ual numpy: out of range transfer not detected')
+    except IndexError:
+        pass
+    # Zero-copy array on a mapping.
+    t = parse_ok(srcdir + 'ual/regs.cheby')
+    layout_ok(t)
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(bytes(t.c_size))
+        f.flush()
+        with ual_mmap.MmapUAL(f.name) as m:
+            acc = ual.compile_access(t)(m, 0)
+            arr = acc.buf.array()
+            arr[5] = 1234
+            if acc.buf[5].sample.read() != 1234:
+                error('ual numpy: incorrect memory array')
+            del arr
+    nbr_tests += 1
+
 def main():
-    global args
+    global args, pool
 
     # Crude
     aparser = argparse.ArgumentParser(description='cheby tests')
@@ -1008,37 +2115,40 @@ def main():
     aparser.add_argument('-r', '--regen', action='store_true', help='Regenerate golden test files.')
     aparser.add_argument('-k', '--keep', action='store_true', help='Keep running tests after an error occured.')
     aparser.add_argument('-e', '--elaborate', action='store_true', help='Enable elaboration/compilation tests.')
+    aparser.add_argument('-j', '--jobs', type=int, default=1, help='Run the tests in JOBS processes.')
+    aparser.add_argument('-b', '--elab-batch', type=int, default=64,
+                         help='Number of VHDL files checked per ghdl run (0 to check each file separately).')
     args = aparser.parse_args()
 
+    if args.jobs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            args.jobs, initializer=init_worker, initargs=(args,))
+    # These tests submit a job per file.
+    file_tests = [test_genc_ref, test_hdl, test_hdl_ref, test_gena, test_wbgen2cheby]
     try:
-        test_self()
-        test_parser()
-        test_layout()
-        test_print()
-        test_genc_ref()
-        test_hdl()
-        test_hdl_err()
-        test_hdl_ref()
-        test_hdl_ref_async_rst()
-        test_verilog_ref()
-        test_sv_ref()
-        test_issue84()
-        test_gena()
-        test_gena_regctrl_err()
-        test_gena2cheby()
-        test_gena2cheby_err()
-        test_gena2cheby_regressions()
-        test_gena_gen_regressions()
-        test_gena_dsp_regressions()
-        test_wbgen2cheby()
-        test_consts()
-        test_doc()
-        test_custom()
-        test_edge3()
+        for test in [test_self, test_parser, test_layout, test_print, test_genc_ref,
+                     test_hdl, test_hdl_err, test_hdl_ref, test_hdl_ref_async_rst,
+                     test_verilog_ref, test_sv_ref, test_issue84, test_gena,
+                     test_gena_regctrl_err, test_gena2cheby, test_gena2cheby_err,
+                     test_gena2cheby_regressions, test_gena_gen_regressions,
+                     test_gena_dsp_regressions, test_wbgen2cheby, test_consts, test_doc,
+                     test_custom, test_edge3, test_output, test_depfile, test_batch,
+                     test_lazy_imports, test_options_threads, test_pipeline,
+                     test_profile, test_api, test_watch, test_server,
+                     test_artifact_cache, test_ual, test_ual_shadow, test_ual_async, test_ual_mmap,
+                     test_ual_remote, test_model, test_ual_numpy]:
+            if test in file_tests:
+                test()
+            else:
+                run_test(test)
+        wait_jobs()
         print("Done ({} tests)!".format(nbr_tests))
     except TestError as e:
         werr(e.msg)
         sys.exit(2)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
 
 
 if __name__ == '__main__':
@@ -24,6 +24,7 @@ setup(
     keywords="VHDL HDL registers driver",
     url='https://gitlab.cern.ch/cohtdrivers/cheby',
 
+    python_requires='>=3.9',
     install_requires=[
         'pyyaml',
     ],